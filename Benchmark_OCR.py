@@ -0,0 +1,522 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import glob
+import random
+import hashlib
+import platform
+import argparse
+import importlib
+import subprocess
+import tempfile
+import numpy as np
+import cv2
+from PIL import Image, ImageDraw, ImageFont
+from OCR_Result import OCRResult
+from OCR_Render import draw_boxes, save_image
+from OCR_Comparison import score_corpus
+
+"""
+Reproducible offline benchmark of the OCR engines and their post-processing.
+A fixed corpus of synthetic P&ID pages is drawn from the backgrounds/ and fonts/ assets with a
+seeded random generator, so every run sees the same pages and knows the ground truth of every
+word. Each engine is timed stage by stage on the synthetic pages and the drawings in Data:
+decode, detect/recognise, box conversion, annotation and PNG write. Textract is never called,
+its saved responses (.tbc or JSON) are replayed instead, so it only runs on drawings that have one.
+The Textract to Label Studio conversion is timed at 1k, 10k and 50k blocks by tiling a saved
+response across a larger page.
+
+Results are written as JSON, one file per commit by default, and --compare flags the stages
+that got slower, and the scores that got worse, between two result files.
+"""
+
+SEED = 42
+PAGES = 8
+PAGE_SIZE = (1024, 1024)
+WORDS_PER_PAGE = (20, 40)
+FONT_SIZE = (18, 32)
+FONT_FILE = os.path.join('fonts', 'Romans_SHX', 'romans__.ttf')
+BACKGROUND_DIR = 'backgrounds'
+DRAWINGS_DIR = 'Data'
+REPEAT = 3
+BLOCK_COUNTS = (1000, 10000, 50000)
+BENCHMARK_DIR = os.path.join('Results', 'benchmark')
+# a stage is a regression if its median is this much slower, and slower by at least MIN_DELTA seconds
+TOLERANCE = 0.10
+MIN_DELTA = 0.001
+# a score is a regression if it drops by more than this
+SCORE_TOLERANCE = 0.01
+# scores where higher is better, cer is the one where lower is better
+SCORES = ('precision', 'recall', 'f1', 'text_accuracy')
+
+ENGINE_MODULES = {
+    'keras': 'Keras_OCR',
+    'textract': 'Textract_OCR',
+    'tesseract': 'Tesseract_OCR',
+}
+DEFAULT_ENGINES = ['tesseract', 'keras', 'textract']
+STAGES = ['decode', 'recognise', 'convert', 'annotate', 'png_write']
+
+TAG_PREFIXES = ['PV', 'FV', 'LV', 'HV', 'XV', 'PSV', 'PT', 'FT', 'LT', 'TT', 'PI', 'TI', 'FIC', 'LIC', 'PIC']
+LINE_SERVICES = ['PG', 'PL', 'WF', 'FG', 'CW', 'IA', 'N2']
+WORDS = ['NOTE', 'DRAIN', 'VENT', 'TO', 'FROM', 'SEE', 'DETAIL', 'FLARE', 'NC', 'NO', 'LO', 'LC', 'SP', 'TYP']
+
+
+def get_tag_text(rng):
+    """Random P&ID text, an instrument tag, a line number or a plain word
+    :param rng: random.Random
+    :return: text without spaces, so each text is one word"""
+    kind = rng.random()
+    if kind < 0.5:
+        return f'{rng.choice(TAG_PREFIXES)}-{rng.randint(1000, 9999)}{rng.choice(["", "", "A", "B"])}'
+    if kind < 0.75:
+        return f'{rng.choice([2, 3, 4, 6, 8])}"-{rng.choice(LINE_SERVICES)}-{rng.randint(1000, 9999)}-A1A'
+    return rng.choice(WORDS)
+
+
+def make_page(rng, background, size=PAGE_SIZE, words=WORDS_PER_PAGE, font_size=FONT_SIZE, font_file=FONT_FILE):
+    """Draw a synthetic page of non overlapping words over a background
+    :param rng: random.Random
+    :param background: BGR background image
+    :param size: (width, height) of the page
+    :param words: (min, max) number of words
+    :param font_size: (min, max) font size
+    :param font_file: ttf font file
+    :return: BGR image, ground truth OCRResult"""
+    width, height = size
+    bh, bw = background.shape[:2]
+    if bw < width or bh < height:
+        background = cv2.resize(background, (max(bw, width), max(bh, height)), interpolation=cv2.INTER_AREA)
+        bh, bw = background.shape[:2]
+    x, y = rng.randint(0, bw - width), rng.randint(0, bh - height)
+    page = Image.fromarray(cv2.cvtColor(background[y:y + height, x:x + width], cv2.COLOR_BGR2RGB))
+    draw = ImageDraw.Draw(page)
+
+    texts, boxes = [], []
+    for _ in range(rng.randint(*words)):
+        text = get_tag_text(rng)
+        font = ImageFont.truetype(font_file, rng.randint(*font_size))
+        # try a few places before giving up on the word
+        for _ in range(20):
+            left, top = rng.randint(10, width - 10), rng.randint(10, height - 10)
+            box = draw.textbbox((left, top), text, font=font)
+            if box[2] > width - 10 or box[3] > height - 10:
+                continue
+            if any(box[0] < b[2] + 5 and b[0] < box[2] + 5 and box[1] < b[3] + 5 and b[1] < box[3] + 5 for b in boxes):
+                continue
+            draw.text((left, top), text, font=font, fill=(0, 0, 0))
+            texts.append(text)
+            boxes.append(box)
+            break
+    boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+    truth = OCRResult.from_columns(texts, boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3], engine='ground_truth')
+    return cv2.cvtColor(np.asarray(page), cv2.COLOR_RGB2BGR), truth
+
+
+def make_corpus(folder, pages=PAGES, seed=SEED, size=PAGE_SIZE):
+    """Write the synthetic corpus, the same pages for the same seed
+    :param folder: output folder
+    :param pages: number of pages
+    :param seed: random seed
+    :param size: (width, height) of the pages
+    :return: list of (png file, ground truth OCRResult), sha256 of the corpus"""
+    rng = random.Random(seed)
+    backgrounds = [cv2.imread(file) for file in sorted(glob.glob(os.path.join(BACKGROUND_DIR, '*.png')))]
+    if not backgrounds:
+        raise FileNotFoundError(f'No background pages in {os.path.abspath(BACKGROUND_DIR)}, '
+                                f'the synthetic corpus is drawn on the pngs there')
+    os.makedirs(folder, exist_ok=True)
+    corpus, h = [], hashlib.sha256()
+    for i in range(pages):
+        image, truth = make_page(rng, rng.choice(backgrounds), size=size)
+        file = os.path.join(folder, f'synthetic_{seed}_{i:03d}.png')
+        cv2.imwrite(file, image)
+        h.update(image.tobytes())
+        h.update(truth.to_bytes())
+        corpus.append((file, truth))
+    return corpus, h.hexdigest()
+
+
+def recognise_keras(file, image):
+    keras = importlib.import_module('Keras_OCR')
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if max(rgb.shape[:2]) > keras.TILE_SIZE:
+        return keras.recognize_tiled(rgb)
+    return keras.get_prediction_groups([rgb])[0]
+
+
+def convert_keras(raw, image):
+    return importlib.import_module('Keras_OCR').create_prediction_result(raw)
+
+
+def recognise_textract(file, image):
+    # replay the saved response instead of calling Textract
+    return importlib.import_module('Textract_Cache').load_textract_blocks(file)
+
+
+def convert_textract(raw, image):
+    height, width = image.shape[:2]
+    return importlib.import_module('Textract_OCR').process_textract_blocks_to_result(raw, height, width)
+
+
+def recognise_tesseract(file, image):
+    return importlib.import_module('Tesseract_OCR').image_to_data(image)
+
+
+def convert_tesseract(raw, image):
+    tesseract = importlib.import_module('Tesseract_OCR')
+    return tesseract.convert_boxes_to_result(tesseract.convert_data_to_boxes(raw))
+
+
+# engine name -> (recognise, convert, loader of the engine's models)
+ENGINE_STAGES = {
+    'keras': (recognise_keras, convert_keras, 'get_pipeline'),
+    'textract': (recognise_textract, convert_textract, None),
+    'tesseract': (recognise_tesseract, convert_tesseract, 'load_tesseract'),
+}
+
+
+def summarise_times(times):
+    """Summary statistics of a list of timings
+    :param times: list of seconds
+    :return: dictionary of n, median, mean, min and max seconds"""
+    if not times:
+        return {'n': 0}
+    times = np.asarray(times, dtype=np.float64)
+    return {'n': int(times.size), 'median': round(float(np.median(times)), 6), 'mean': round(float(times.mean()), 6),
+            'min': round(float(times.min()), 6), 'max': round(float(times.max()), 6)}
+
+
+def time_page(engine, file, out_folder):
+    """Run an engine on a page, one stage at a time
+    :param engine: engine name, one of ENGINE_STAGES
+    :param file: png file
+    :param out_folder: folder for the annotated image
+    :return: dictionary of stage timings and the OCRResult, or None if the engine has nothing for the page"""
+    recognise, convert, _ = ENGINE_STAGES[engine]
+    timings = {}
+    start = time.perf_counter()
+    image = cv2.imread(file)
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    raw = recognise(file, image)
+    timings['recognise'] = time.perf_counter() - start
+    if raw is None:
+        return None, None
+
+    start = time.perf_counter()
+    result = convert(raw, image)
+    timings['convert'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    annotated = draw_boxes(image.copy(), result, thickness=2)
+    timings['annotate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    save_image(annotated, os.path.join(out_folder, f'{engine}.png'), fmt='png', preview_scale=1.0)
+    timings['png_write'] = time.perf_counter() - start
+    return timings, result
+
+
+def benchmark_engine(engine, synthetic, drawings, out_folder, repeat=REPEAT):
+    """Time an engine over the corpus and score it
+    Synthetic pages are scored against their ground truth, drawings against their saved Textract response.
+    :param engine: engine name, one of ENGINE_STAGES
+    :param synthetic: list of (png file, ground truth OCRResult)
+    :param drawings: list of png files
+    :param out_folder: folder for the annotated images
+    :param repeat: number of timed passes over the corpus
+    :return: dictionary of load time, stage timings and scores"""
+    _, _, loader = ENGINE_STAGES[engine]
+    start = time.perf_counter()
+    module = importlib.import_module(ENGINE_MODULES[engine])
+    if loader is not None:
+        getattr(module, loader)()
+    load = time.perf_counter() - start
+
+    pages = [(file, truth, 'synthetic') for file, truth in synthetic] + [(file, None, 'drawings') for file in drawings]
+    # an untimed pass warms up the engine, e.g. the first TensorFlow call, and gets the results to score
+    scored = {'synthetic': [], 'drawings': []}
+    timed = []
+    for file, truth, kind in pages:
+        timings, result = time_page(engine, file, out_folder)
+        if timings is None:
+            continue
+        timed.append(file)
+        # Textract is the reference of the drawings, there is no point scoring it against itself
+        reference = truth if truth is not None else textract_reference(file) if engine != 'textract' else None
+        if reference is not None:
+            scored[kind].append({'engine': result, 'reference': reference})
+
+    times = {stage: [] for stage in STAGES + ['total']}
+    for _ in range(repeat):
+        for file in timed:
+            timings, _ = time_page(engine, file, out_folder)
+            for stage, seconds in timings.items():
+                times[stage].append(seconds)
+            times['total'].append(sum(timings.values()))
+
+    scores = {}
+    for kind, pairs in scored.items():
+        rows = score_corpus(pairs, reference='reference')
+        if rows:
+            scores[kind] = {key: value for key, value in rows[0].items() if key not in ('engine', 'reference')}
+    return {'load': round(load, 6), 'pages': len(timed),
+            'stages': {stage: summarise_times(seconds) for stage, seconds in times.items()}, 'scores': scores}
+
+
+def textract_reference(file):
+    """The saved Textract response of a drawing as an OCRResult
+    :param file: png file
+    :return: OCRResult, or None if there is no saved response"""
+    blocks = recognise_textract(file, None)
+    if blocks is None:
+        return None
+    return convert_textract(blocks, cv2.imread(file))
+
+
+def has_words(textract_blocks):
+    """Check a saved Textract response has any WORD blocks
+    :param textract_blocks: TextractBlocks or None
+    :return: True if there is at least one WORD block"""
+    return textract_blocks is not None and bool(textract_blocks.mask('WORD').any())
+
+
+def tile_response(blocks, count, seed=SEED):
+    """Tile the WORD blocks of a response across a grid until there are count of them
+    Each copy is scaled into its own cell, so the tiled page looks like a larger drawing.
+    :param blocks: list of Textract blocks
+    :param count: number of WORD blocks wanted
+    :param seed: seed of the new block Ids
+    :return: Textract response dictionary, grid size"""
+    rng = random.Random(seed)
+    words = [block for block in blocks if block['BlockType'] == 'WORD']
+    if not words:
+        raise ValueError('The response has no WORD blocks to tile')
+    copies = math.ceil(count / len(words))
+    grid = math.ceil(math.sqrt(copies))
+    tiled = []
+    for copy in range(copies):
+        cx, cy = copy % grid, copy // grid
+        for block in words:
+            if len(tiled) == count:
+                break
+            box = block['Geometry']['BoundingBox']
+            geometry = {
+                'BoundingBox': {'Width': box['Width'] / grid, 'Height': box['Height'] / grid,
+                                'Left': (box['Left'] + cx) / grid, 'Top': (box['Top'] + cy) / grid},
+                'Polygon': [{'X': (point['X'] + cx) / grid, 'Y': (point['Y'] + cy) / grid}
+                            for point in block['Geometry'].get('Polygon', [])],
+            }
+            tiled.append(dict(block, Geometry=geometry, Id=str(uuid.UUID(int=rng.getrandbits(128), version=4))))
+    return {'Blocks': tiled}, grid
+
+
+def benchmark_label_studio(drawing, folder, counts=BLOCK_COUNTS, repeat=REPEAT):
+    """Time the Textract to Label Studio conversion of tiled copies of a saved response
+    :param drawing: png file with a saved Textract response with WORD blocks
+    :param folder: scratch folder for the tiled responses
+    :param counts: numbers of WORD blocks to time
+    :param repeat: number of timed conversions of each size
+    :return: dictionary of block count to timings"""
+    label_studio = importlib.import_module('Textract_Label_Studio')
+    blocks = importlib.import_module('Textract_Cache').load_textract_blocks(drawing)
+    if not has_words(blocks):
+        return {}
+    blocks = blocks.to_response()['Blocks']
+    height, width = cv2.imread(drawing).shape[:2]
+    results = {}
+    for count in counts:
+        response, grid = tile_response(blocks, count)
+        file = os.path.join(folder, f'tiled_{count}.json')
+        with open(file, 'w') as f:
+            json.dump(response, f)
+        # the first conversion also writes the .tbc cache, it is not timed
+        label_studio.process_texract_json_for_label_studio(file, height * grid, width * grid)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            label_studio.process_texract_json_for_label_studio(file, height * grid, width * grid)
+            times.append(time.perf_counter() - start)
+        results[str(count)] = summarise_times(times)
+    return results
+
+
+def get_commit():
+    """Get the current git commit, marked dirty if there are uncommitted changes
+    :return: short commit hash, or None outside a git checkout"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def run_benchmark(engines=DEFAULT_ENGINES, pages=PAGES, seed=SEED, repeat=REPEAT, drawings_dir=DRAWINGS_DIR,
+                  block_counts=BLOCK_COUNTS, outfile=None):
+    """Run the benchmark and write the results
+    :param engines: list of engine names
+    :param pages: number of synthetic pages
+    :param seed: seed of the synthetic corpus
+    :param repeat: number of timed passes
+    :param drawings_dir: folder of png drawings, with saved Textract responses for Textract and scoring
+    :param block_counts: WORD block counts for the Label Studio conversion, empty to skip it
+    :param outfile: JSON filepath, defaults to Results/benchmark/<commit>.json
+    :return: results dictionary"""
+    commit = get_commit()
+    drawings = sorted(glob.glob(os.path.join(drawings_dir, '*.png')))
+    results = {
+        'meta': {
+            'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'seed': seed, 'pages': pages,
+            'repeat': repeat, 'drawings': [os.path.basename(file) for file in drawings],
+        },
+        'engines': {},
+        'label_studio': {},
+    }
+    with tempfile.TemporaryDirectory() as folder:
+        corpus, results['meta']['corpus_sha256'] = make_corpus(os.path.join(folder, 'corpus'), pages, seed)
+        for engine in engines:
+            print(f'Benchmarking {engine}')
+            results['engines'][engine] = benchmark_engine(engine, corpus, drawings, folder, repeat=repeat)
+        # tiling needs at least one WORD block to copy
+        with_words = [file for file in drawings if has_words(recognise_textract(file, None))]
+        if block_counts and with_words:
+            print('Benchmarking the Textract to Label Studio conversion')
+            results['label_studio'] = benchmark_label_studio(with_words[0], folder, block_counts, repeat)
+
+    outfile = outfile or os.path.join(BENCHMARK_DIR, f'{commit or "benchmark"}.json')
+    os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+    with open(outfile, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print(f'Results written to {outfile}')
+    return results
+
+
+def print_results(results):
+    """Print the median stage timings of a results dictionary
+    :param results: results dictionary"""
+    print(f'{"engine":>12} ' + ' '.join(f'{stage:>10}' for stage in STAGES + ['total']) + f' {"f1":>8}')
+    for engine, result in results['engines'].items():
+        stages = ' '.join(f'{result["stages"][stage].get("median", float("nan")):>10.4f}' for stage in STAGES + ['total'])
+        f1 = result['scores'].get('synthetic', result['scores'].get('drawings', {})).get('f1', '')
+        print(f'{engine:>12} {stages} {f1:>8}')
+    for count, stats in results['label_studio'].items():
+        print(f'Label Studio conversion of {count} blocks: {stats.get("median", float("nan")):.4f}s')
+
+
+def get_timings(results):
+    """Flatten the median timings of a results dictionary
+    :param results: results dictionary
+    :return: dictionary of name to median seconds"""
+    timings = {}
+    for engine, result in results.get('engines', {}).items():
+        for stage, stats in result['stages'].items():
+            if 'median' in stats:
+                timings[f'{engine}.{stage}'] = stats['median']
+    for count, stats in results.get('label_studio', {}).items():
+        if 'median' in stats:
+            timings[f'label_studio.{count}'] = stats['median']
+    return timings
+
+
+def compare_results(baseline, current, tolerance=TOLERANCE, min_delta=MIN_DELTA, score_tolerance=SCORE_TOLERANCE):
+    """Compare two results dictionaries and flag the regressions
+    :param baseline: results of the earlier commit
+    :param current: results of the later commit
+    :param tolerance: fraction a median may grow by before it is a regression
+    :param min_delta: seconds a median must grow by to be a regression, so tiny stages don't flag on noise
+    :param score_tolerance: amount a score may worsen by before it is a regression
+    :return: list of comparison rows, each with a regression flag"""
+    rows = []
+    old_timings, new_timings = get_timings(baseline), get_timings(current)
+    for name in sorted(old_timings.keys() & new_timings.keys()):
+        old, new = old_timings[name], new_timings[name]
+        ratio = new / old if old else float('inf')
+        regression = new > old * (1 + tolerance) and new - old > min_delta
+        rows.append({'name': name, 'kind': 'time', 'baseline': old, 'current': new, 'change': round(ratio - 1, 4),
+                     'regression': regression})
+
+    for engine in sorted(baseline.get('engines', {}).keys() & current.get('engines', {}).keys()):
+        old_scores, new_scores = baseline['engines'][engine]['scores'], current['engines'][engine]['scores']
+        for kind in sorted(old_scores.keys() & new_scores.keys()):
+            for score in SCORES + ('cer',):
+                old, new = old_scores[kind].get(score), new_scores[kind].get(score)
+                if old is None or new is None:
+                    continue
+                worse = old - new if score != 'cer' else new - old
+                rows.append({'name': f'{engine}.{kind}.{score}', 'kind': 'score', 'baseline': old, 'current': new,
+                             'change': round(new - old, 4), 'regression': worse > score_tolerance})
+    return rows
+
+
+def print_comparison(rows, baseline, current):
+    """Print comparison rows
+    :param rows: list of comparison rows
+    :param baseline: results of the earlier commit
+    :param current: results of the later commit"""
+    print(f'Baseline {baseline["meta"].get("commit")}, current {current["meta"].get("commit")}')
+    if baseline['meta'].get('corpus_sha256') != current['meta'].get('corpus_sha256'):
+        print('Warning: the synthetic corpus differs between the runs, check the seed and page count')
+    print(f'{"name":>32} {"baseline":>12} {"current":>12} {"change":>10}')
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        # timings change by a fraction, scores by their difference
+        change = f'{row["change"]:+.1%}' if row['kind'] == 'time' else f'{row["change"]:+.4f}'
+        print(f'{row["name"]:>32} {row["baseline"]:>12} {row["current"]:>12} {change:>10}{flag}')
+    regressions = sum(row['regression'] for row in rows)
+    print(f'{regressions} regression{"s" if regressions != 1 else ""}')
+
+
+def compare_files(baseline_file, current_file, tolerance=TOLERANCE, min_delta=MIN_DELTA,
+                  score_tolerance=SCORE_TOLERANCE):
+    """Compare two result files
+    :param baseline_file: JSON results of the earlier commit
+    :param current_file: JSON results of the later commit
+    :param tolerance: fraction a median may grow by before it is a regression
+    :param min_delta: seconds a median must grow by to be a regression
+    :param score_tolerance: amount a score may worsen by before it is a regression
+    :return: list of the regression rows"""
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    with open(current_file, 'r') as f:
+        current = json.load(f)
+    rows = compare_results(baseline, current, tolerance, min_delta, score_tolerance)
+    print_comparison(rows, baseline, current)
+    return [row for row in rows if row['regression']]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the OCR engines and post-processing offline')
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINE_STAGES), default=DEFAULT_ENGINES)
+    parser.add_argument('--pages', type=int, default=PAGES, help='synthetic pages in the corpus')
+    parser.add_argument('--seed', type=int, default=SEED, help='seed of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed passes over the corpus')
+    parser.add_argument('--drawings', default=DRAWINGS_DIR, help='folder of png drawings with saved Textract responses')
+    parser.add_argument('--blocks', type=int, nargs='*', default=list(BLOCK_COUNTS),
+                        help='WORD block counts for the Label Studio conversion, none to skip it')
+    parser.add_argument('--output', default=None, help='results file, defaults to Results/benchmark/<commit>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), default=None,
+                        help='compare two results files instead of running the benchmark')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown of a stage, e.g. 0.1')
+    parser.add_argument('--min-delta', type=float, default=MIN_DELTA, help='smallest slowdown in seconds that is flagged')
+    parser.add_argument('--score-tolerance', type=float, default=SCORE_TOLERANCE, help='allowed drop of a score')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.compare:
+        regressions = compare_files(*args.compare, tolerance=args.tolerance, min_delta=args.min_delta,
+                                    score_tolerance=args.score_tolerance)
+        sys.exit(1 if regressions else 0)
+    run_benchmark(args.engines, pages=args.pages, seed=args.seed, repeat=args.repeat, drawings_dir=args.drawings,
+                  block_counts=tuple(args.blocks), outfile=args.output)
@@ -0,0 +1,258 @@
+import os
+import csv
+import glob
+import json
+import time
+import argparse
+from itertools import islice
+import numpy as np
+import cv2
+import tensorflow as tf
+import keras_ocr
+import Keras_OCR
+import Train_Keras_Detector as training
+from OCR_Comparison import score_corpus, SUMMARY_FIELDS
+
+"""
+Export of the keras-ocr detector and recognizer for faster CPU inference.
+Both models are converted to TFLite and, if tf2onnx is installed, to ONNX, as float32, float16
+and int8. Post-training int8 quantisation is calibrated on synthetic P&ID pages and their word
+crops, so the activation ranges match our drawings rather than keras-ocr's training data.
+The recognizer is exported up to its softmax, CTC decoding needs TensorFlow ops TFLite lacks,
+so Keras_OCR decodes the best path in numpy instead. A manifest.json records the alphabet and
+input shapes, which is all Keras_OCR needs to run the exported models with KERAS_OCR_BACKEND.
+
+The report runs every exported model over synthetic pages and the drawings in Data and scores
+it against the float Keras models, with seconds per page and model size, to choose a backend.
+"""
+
+EXPORT_DIR = Keras_OCR.EXPORT_DIR
+BACKENDS = ('tflite', 'onnx')
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+DETECTOR_WEIGHTS = Keras_OCR.DETECTOR_WEIGHTS
+RECOGNIZER_WEIGHTS = Keras_OCR.RECOGNIZER_WEIGHTS
+CALIBRATION_PAGES = 32
+CALIBRATION_CROPS = 256
+ONNX_OPSET = 13
+REPORT_FILE = os.path.join('Results', 'Export_Report.csv')
+REPORT_FIELDS = ['backend', 'quantization', 'pages', 'seconds_per_page', 'size_mb'] + SUMMARY_FIELDS[2:]
+
+
+def iter_calibration_pages(pages=CALIBRATION_PAGES):
+    """Detector inputs for int8 calibration, from synthetic validation pages
+    :param pages: number of pages
+    :return: generator of (1, height, width, 3) float32 arrays"""
+    for image, _ in islice(training.get_image_generator('val'), pages):
+        yield keras_ocr.detection.compute_input(image)[np.newaxis].astype(np.float32)
+
+
+def iter_calibration_crops(recognizer, crops=CALIBRATION_CROPS):
+    """Recognizer inputs for int8 calibration, from word crops of synthetic validation pages
+    :param recognizer: keras-ocr Recognizer
+    :param crops: number of crops
+    :return: generator of (1, height, width, channels) float32 arrays"""
+    _, height, width, channels = recognizer.model.input_shape
+    max_length = recognizer.training_model.input_shape[1][1]
+    for crop, _ in islice(training.iter_synthetic_crops('val', max_length, width, height), crops):
+        if channels == 1:
+            crop = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)[..., np.newaxis]
+        yield (crop[np.newaxis] / 255.0).astype(np.float32)
+
+
+def export_tflite(model, outfile, quantization='float32', calibration=None):
+    """Convert a Keras model to TFLite
+    Inputs and outputs stay float32 for every quantisation, so the exported models are drop-in.
+    :param model: Keras model
+    :param outfile: .tflite filepath
+    :param quantization: 'float32', 'float16' or 'int8'
+    :param calibration: function returning a generator of model inputs, needed for int8
+    :return: outfile"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x] for x in calibration())
+    with open(outfile, 'wb') as f:
+        f.write(converter.convert())
+    return outfile
+
+
+class CalibrationReader:
+    """onnxruntime calibration data reader over a generator of model inputs"""
+
+    def __init__(self, input_name, calibration):
+        self.input_name = input_name
+        self.inputs = calibration()
+
+    def get_next(self):
+        x = next(self.inputs, None)
+        return None if x is None else {self.input_name: x}
+
+
+def export_onnx(model, outfile, quantization='float32', calibration=None):
+    """Convert a Keras model to ONNX with tf2onnx
+    float16 converts the weights with onnxconverter-common, int8 is static QDQ quantisation
+    with onnxruntime, both keep float32 inputs and outputs.
+    :param model: Keras model
+    :param outfile: .onnx filepath
+    :param quantization: 'float32', 'float16' or 'int8'
+    :param calibration: function returning a generator of model inputs, needed for int8
+    :return: outfile"""
+    import onnx
+    import tf2onnx
+    signature = [tf.TensorSpec(model.input_shape, tf.float32, name='input')]
+    float_file = outfile if quantization == 'float32' else outfile + '.float32'
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=ONNX_OPSET, output_path=float_file)
+    if quantization == 'float16':
+        from onnxconverter_common import float16
+        onnx.save(float16.convert_float_to_float16(onnx.load(float_file), keep_io_types=True), outfile)
+    elif quantization == 'int8':
+        from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+        quantize_static(float_file, outfile, CalibrationReader('input', calibration),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8)
+    if float_file != outfile:
+        os.remove(float_file)
+    return outfile
+
+
+def export_models(backends=BACKENDS, quantizations=QUANTIZATIONS, export_dir=EXPORT_DIR,
+                  calibration_pages=CALIBRATION_PAGES, calibration_crops=CALIBRATION_CROPS):
+    """Export the detector and recognizer in every backend and quantisation
+    :param backends: tuple of 'tflite' and/or 'onnx'
+    :param quantizations: tuple of 'float32', 'float16' and/or 'int8'
+    :param export_dir: output folder
+    :param calibration_pages: synthetic pages to calibrate the detector on
+    :param calibration_crops: word crops to calibrate the recognizer on
+    :return: list of exported files"""
+    os.makedirs(export_dir, exist_ok=True)
+    detector, recognizer = Keras_OCR.load_models()
+    models = {
+        'detector': (detector.model, lambda: iter_calibration_pages(calibration_pages)),
+        # the softmax output, without the CTC decoding of the prediction model
+        'recognizer': (recognizer.model, lambda: iter_calibration_crops(recognizer, calibration_crops)),
+    }
+    exporters = {'tflite': export_tflite, 'onnx': export_onnx}
+    files = []
+    for backend in backends:
+        for quantization in quantizations:
+            for name, (model, calibration) in models.items():
+                outfile = Keras_OCR.get_exported_file(name, backend, quantization, export_dir)
+                start = time.perf_counter()
+                try:
+                    exporters[backend](model, outfile, quantization, calibration)
+                except ImportError as e:
+                    print(f'Skipping {backend} export, {e}')
+                    break
+                print(f'Exported {outfile} in {time.perf_counter() - start:.1f}s '
+                      f'({os.path.getsize(outfile) / 2 ** 20:.1f} MB)')
+                files.append(outfile)
+
+    manifest = {
+        'alphabet': recognizer.alphabet,
+        'detector_input_shape': list(detector.model.input_shape),
+        'recognizer_input_shape': list(recognizer.model.input_shape),
+        'detector_weights': DETECTOR_WEIGHTS if os.path.exists(DETECTOR_WEIGHTS) else 'clovaai_general',
+        'recognizer_weights': RECOGNIZER_WEIGHTS if os.path.exists(RECOGNIZER_WEIGHTS) else 'kurapan',
+    }
+    with open(os.path.join(export_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return files
+
+
+def get_report_pages(synthetic_pages=16, drawings='Data'):
+    """Pages for the report, synthetic test pages and the drawings of a folder
+    :param synthetic_pages: number of synthetic pages
+    :param drawings: folder of png drawings
+    :return: list of (name, RGB image, tiled) tuples, drawings are too large to run without tiling"""
+    pages = [(f'synthetic_{i}', image, False)
+             for i, (image, _) in enumerate(islice(training.get_image_generator('test'), synthetic_pages))]
+    pages += [(os.path.basename(file), Keras_OCR.read_image(file), True)
+              for file in sorted(glob.glob(os.path.join(drawings, '*.png')))]
+    return pages
+
+
+def run_pipeline(pipeline, pages):
+    """Run a pipeline over the report pages
+    :param pipeline: keras-ocr Pipeline
+    :param pages: list of (name, RGB image, tiled) tuples
+    :return: list of OCRResults, seconds per page"""
+    results = []
+    start = time.perf_counter()
+    for _, image, tiled in pages:
+        if tiled:
+            predictions = Keras_OCR.recognize_tiled(image, pipeline=pipeline)
+        else:
+            predictions = Keras_OCR.get_prediction_groups([image], pipeline=pipeline)[0]
+        results.append(Keras_OCR.create_prediction_result(predictions))
+    return results, (time.perf_counter() - start) / max(len(pages), 1)
+
+
+def report(backends=BACKENDS, quantizations=QUANTIZATIONS, export_dir=EXPORT_DIR, synthetic_pages=16,
+           drawings='Data', outfile=REPORT_FILE):
+    """Accuracy against latency of the exported models, scored against the float Keras models
+    :param backends: tuple of 'tflite' and/or 'onnx'
+    :param quantizations: tuple of 'float32', 'float16' and/or 'int8'
+    :param export_dir: folder of the exported models
+    :param synthetic_pages: number of synthetic test pages
+    :param drawings: folder of png drawings
+    :param outfile: csv filepath
+    :return: list of report rows"""
+    pages = get_report_pages(synthetic_pages, drawings)
+    # the reference is the keras backend, the same weights the models were exported from
+    reference, seconds = run_pipeline(Keras_OCR.get_pipeline('keras'), pages)
+    size = sum(os.path.getsize(w) for w in (DETECTOR_WEIGHTS, RECOGNIZER_WEIGHTS) if os.path.exists(w))
+    rows = [{'backend': 'keras', 'quantization': 'float32', 'pages': len(pages), 'seconds_per_page': round(seconds, 3),
+             'size_mb': round(size / 2 ** 20, 1) if size else ''}]
+
+    for backend in backends:
+        for quantization in quantizations:
+            files = [Keras_OCR.get_exported_file(name, backend, quantization, export_dir)
+                     for name in ('detector', 'recognizer')]
+            if not all(os.path.exists(file) for file in files):
+                continue
+            pipeline = Keras_OCR.load_exported_pipeline(backend, quantization, export_dir)
+            results, seconds = run_pipeline(pipeline, pages)
+            summary = score_corpus(({'keras': ref, 'exported': result} for ref, result in zip(reference, results)),
+                                   reference='keras')
+            summary = summary[0] if summary else {}
+            rows.append(dict({field: summary.get(field, '') for field in SUMMARY_FIELDS[2:]},
+                             backend=backend, quantization=quantization, pages=len(pages),
+                             seconds_per_page=round(seconds, 3),
+                             size_mb=round(sum(os.path.getsize(file) for file in files) / 2 ** 20, 1)))
+
+    os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+    with open(outfile, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(' '.join(f'{field:>16}' for field in REPORT_FIELDS))
+    for row in rows:
+        print(' '.join(f'{row.get(field, ""):>16}' for field in REPORT_FIELDS))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Export the keras-ocr models to TFLite/ONNX and report their accuracy and speed')
+    parser.add_argument('--mode', choices=('export', 'report', 'both'), default='both')
+    parser.add_argument('--backend', choices=BACKENDS, nargs='+', default=list(BACKENDS))
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, nargs='+', default=list(QUANTIZATIONS))
+    parser.add_argument('--export-dir', default=EXPORT_DIR, help='folder of the exported models')
+    parser.add_argument('--calibration-pages', type=int, default=CALIBRATION_PAGES, help='synthetic pages for int8 calibration')
+    parser.add_argument('--calibration-crops', type=int, default=CALIBRATION_CROPS, help='word crops for int8 calibration')
+    parser.add_argument('--report-pages', type=int, default=16, help='synthetic pages in the report')
+    parser.add_argument('--drawings', default='Data', help='folder of png drawings in the report')
+    parser.add_argument('--report-file', default=REPORT_FILE, help='report csv file')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode in ('export', 'both'):
+        export_models(tuple(args.backend), tuple(args.quantization), args.export_dir,
+                      calibration_pages=args.calibration_pages, calibration_crops=args.calibration_crops)
+    if args.mode in ('report', 'both'):
+        report(tuple(args.backend), tuple(args.quantization), args.export_dir, synthetic_pages=args.report_pages,
+               drawings=args.drawings, outfile=args.report_file)
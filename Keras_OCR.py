@@ -1,29 +1,231 @@
-import pdf2image
-import keras_ocr
 import cv2
 import os
+import time
+import json
+import string
+import hashlib
+import threading
+import numpy as np
+from itertools import islice
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import version
+from OCR_Cache import ocr_cache, hash_image
+from OCR_Result import OCRResult
+from OCR_Render import render_result
+# pdf2image requires poppler, set its location in OCR_Files.POPPLER_PATH
+from OCR_Files import get_files_from_folder, iter_pdf_pages
 
-# pdf2image requires poppler to be installed
-# you can set POPPLER_PATH to the location of the bin folder
-# this is the default location for poppler-0.68.0
-POPPLER_PATH = r'C:\Program Files\poppler-0.68.0\bin'
+# inference backend: 'keras' runs the full Keras models, 'tflite' or 'onnx' run the
+# models exported by Export_Models, at the given quantisation
+KERAS_BACKEND = os.environ.get('KERAS_OCR_BACKEND', 'keras')
+KERAS_QUANTIZATION = os.environ.get('KERAS_OCR_QUANTIZATION', 'float16')
+EXPORT_DIR = os.path.join('Models', 'export')
+# weights saved by Train_Keras_Detector, used by every backend when they exist
+DETECTOR_WEIGHTS = os.path.join('Models', 'Detector_Weights.h5')
+RECOGNIZER_WEIGHTS = os.path.join('Models', 'Recognizer_Weights.h5')
+# the fine-tuned recognizer's alphabet, lower case letters, digits and symbols found in P&ID drawings
+RECOGNIZER_ALPHABET = ''.join(sorted(set(string.digits + string.ascii_lowercase + '!?."#/\\')))
 
-# keras-ocr will automatically download pretrained
-# weights for the detector and recognizer.
-pipeline = keras_ocr.pipeline.Pipeline()
+class ExportedModel:
+    """Runs an exported TFLite or ONNX model behind the Keras model.predict interface keras-ocr calls"""
 
-def get_files_from_folder(folder):
-    """Get all pdf files from a folder
+    def __init__(self, file, input_shape):
+        """
+        Args:
+        file (str): A .tflite or .onnx model file
+        input_shape (tuple): The Keras input shape, None for dynamic dimensions
+        """
+        self.file = file
+        self.input_shape = tuple(input_shape)
+        # interpreters are not thread safe and tiles may be run from a thread pool
+        self.lock = threading.Lock()
+        if file.endswith('.onnx'):
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(file, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            self.interpreter = None
+        else:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                from tensorflow.lite import Interpreter
+            self.interpreter = Interpreter(model_path=file)
+            self.interpreter.allocate_tensors()
+            self.input_index = self.interpreter.get_input_details()[0]['index']
+            self.output_index = self.interpreter.get_output_details()[0]['index']
+            self.session = None
+
+    def _run(self, x):
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: x})[0]
+        if tuple(self.interpreter.get_input_details()[0]['shape']) != x.shape:
+            self.interpreter.resize_tensor_input(self.input_index, x.shape)
+            self.interpreter.allocate_tensors()
+        self.interpreter.set_tensor(self.input_index, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+    def predict(self, x, batch_size=None, **kwargs):
+        """Run the model in batches
+        Args:
+        x (numpy array): The model input
+        batch_size (int): The batch size, defaults to the whole input
+        return: The model output
+        """
+        x = np.asarray(x, dtype=np.float32)
+        batch_size = batch_size or len(x)
+        with self.lock:
+            outputs = [self._run(x[i:i + batch_size]) for i in range(0, len(x), batch_size)]
+        return np.concatenate(outputs) if outputs else np.empty((0,))
+
+class CTCGreedyModel:
+    """Greedy CTC decoding of an exported recognizer, the same as the keras-ocr prediction model
+    The exported model stops at the softmax, because CTC decoding needs TensorFlow ops TFLite lacks."""
+
+    def __init__(self, model, blank_label_idx):
+        self.model = model
+        self.input_shape = model.input_shape
+        self.blank_label_idx = blank_label_idx
+
+    def predict(self, x, **kwargs):
+        """Decode the best path, merging repeats and dropping blanks, padded with -1
+        Args:
+        x (numpy array): The recognizer input
+        return: An array of label indices
+        """
+        best = self.model.predict(x, **kwargs).argmax(axis=-1)
+        keep = np.ones(best.shape, dtype=bool)
+        keep[:, 1:] = best[:, 1:] != best[:, :-1]
+        keep &= best != self.blank_label_idx
+        decoded = np.full(best.shape, -1, dtype=np.int64)
+        for row, (labels, mask) in enumerate(zip(best, keep)):
+            labels = labels[mask]
+            decoded[row, :len(labels)] = labels
+        return decoded
+
+def get_exported_file(model, backend, quantization, export_dir=EXPORT_DIR):
+    """Get the file of an exported model
+    Args:
+    model (str): 'detector' or 'recognizer'
+    backend (str): 'tflite' or 'onnx'
+    quantization (str): 'float32', 'float16' or 'int8'
+    export_dir (str): The folder of the exported models
+    return: The model filepath
+    """
+    return os.path.join(export_dir, f'{model}_{quantization}.{backend}')
+
+def load_exported_pipeline(backend, quantization, export_dir=EXPORT_DIR):
+    """Build a keras-ocr pipeline around exported models
+    The detector and recognizer are created without building or loading their Keras
+    models, their predict calls go to the exported models instead.
     Args:
-    folder (str): The folder to get the files from
-    return: A list of files
+    backend (str): 'tflite' or 'onnx'
+    quantization (str): 'float32', 'float16' or 'int8'
+    export_dir (str): The folder of the exported models and their manifest
+    return: The keras-ocr pipeline
     """
+    import keras_ocr
+    with open(os.path.join(export_dir, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+    detector = keras_ocr.detection.Detector.__new__(keras_ocr.detection.Detector)
+    detector.model = ExportedModel(get_exported_file('detector', backend, quantization, export_dir),
+                                   manifest['detector_input_shape'])
+    recognizer = keras_ocr.recognition.Recognizer.__new__(keras_ocr.recognition.Recognizer)
+    recognizer.alphabet = manifest['alphabet']
+    recognizer.blank_label_idx = len(recognizer.alphabet)
+    recognizer.model = ExportedModel(get_exported_file('recognizer', backend, quantization, export_dir),
+                                     manifest['recognizer_input_shape'])
+    recognizer.prediction_model = CTCGreedyModel(recognizer.model, recognizer.blank_label_idx)
+    return keras_ocr.pipeline.Pipeline(detector=detector, recognizer=recognizer)
 
-    files = []
-    for file in os.listdir(folder):
-        if file.endswith(".pdf"):
-            files.append(os.path.join(folder, file))
-    return files
+def load_models(detector_weights=DETECTOR_WEIGHTS, recognizer_weights=RECOGNIZER_WEIGHTS):
+    """Load the Keras detector and recognizer, with our fine-tuned weights where they exist
+    This is what the keras backend runs and what Export_Models exports.
+    Args:
+    detector_weights (str): The h5 weights saved by train_detector
+    recognizer_weights (str): The h5 weights saved by train_recognizer
+    return: The detector and recognizer
+    """
+    import keras_ocr
+    # keras-ocr will automatically download pretrained
+    # weights for the detector and recognizer.
+    detector = keras_ocr.detection.Detector(weights='clovaai_general')
+    if os.path.exists(detector_weights):
+        detector.model.load_weights(detector_weights)
+    if os.path.exists(recognizer_weights):
+        recognizer = keras_ocr.recognition.Recognizer(alphabet=RECOGNIZER_ALPHABET, weights='kurapan')
+        recognizer.model.load_weights(recognizer_weights)
+    else:
+        recognizer = keras_ocr.recognition.Recognizer()
+    return detector, recognizer
+
+@lru_cache(maxsize=None)
+def get_pipeline(backend=None, quantization=None):
+    """Get the keras-ocr pipeline, it is created on first use
+    so importing this module does not load TensorFlow
+    Args:
+    backend (str): 'keras', 'tflite' or 'onnx', defaults to KERAS_BACKEND
+    quantization (str): The quantisation of exported models, defaults to KERAS_QUANTIZATION
+    return: The keras-ocr pipeline
+    """
+    backend = backend or KERAS_BACKEND
+    if backend != 'keras':
+        return load_exported_pipeline(backend, quantization or KERAS_QUANTIZATION)
+    import keras_ocr
+    detector, recognizer = load_models()
+    return keras_ocr.pipeline.Pipeline(detector=detector, recognizer=recognizer)
+
+def get_files_fingerprint(files):
+    """Fingerprint model files by their name, size and modification time, cheap enough to check per page
+    Args:
+    files (list): A list of filepaths, missing files are skipped
+    return: A short hex digest, None if none of the files exist
+    """
+    stats = [(os.path.basename(file), os.path.getsize(file), os.path.getmtime(file))
+             for file in files if os.path.exists(file)]
+    if not stats:
+        return None
+    return hashlib.sha256(json.dumps(stats).encode('utf-8')).hexdigest()[:16]
+
+def get_backend_params():
+    """Get the backend settings and model files that change the results, used to key the cache
+    Retrained or re-exported models change the fingerprint, so their results are not served from the cache.
+    return: A dictionary, empty for the Keras backend with the stock weights so existing cache entries stay valid
+    """
+    if KERAS_BACKEND == 'keras':
+        fingerprint = get_files_fingerprint([DETECTOR_WEIGHTS, RECOGNIZER_WEIGHTS])
+        return {'weights': fingerprint} if fingerprint else {}
+    files = [os.path.join(EXPORT_DIR, 'manifest.json')] + \
+            [get_exported_file(model, KERAS_BACKEND, KERAS_QUANTIZATION) for model in ('detector', 'recognizer')]
+    return {'backend': KERAS_BACKEND, 'quantization': KERAS_QUANTIZATION, 'models': get_files_fingerprint(files)}
+
+def __getattr__(name):
+    # keep Keras_OCR.pipeline working without building it at import time
+    if name == 'pipeline':
+        return get_pipeline()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# tiling defaults for large drawings, the pipeline scales images by 2
+# so a 1024px tile is detected at the pipeline's 2048px maximum size
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+
+def iter_pages(files, dpi=200):
+    """Stream the pages of pdf and image files
+    Args:
+    files (list): A list of pdf and image files
+    dpi (int): The resolution to render pdf pages at
+    return: A generator of (page name, RGB numpy array) tuples, pdf pages are named <name>_<page index>.png
+    """
+    for file in files:
+        if file.lower().endswith(".pdf"):
+            name = os.path.splitext(os.path.basename(file))[0]
+            for i, page in iter_pdf_pages(file, dpi):
+                # named like an image file, so splitting off the extension leaves the page index
+                yield f'{name}_{i}.png', page
+        else:
+            yield file, read_image(file)
 
 def convert_pdfs_to_images(files, output_folder):
     """Convert pdf files to images
@@ -38,14 +240,23 @@ def convert_pdfs_to_images(files, output_folder):
             "pdf": file,
             "pages": {}
         }
-        pages = pdf2image.convert_from_path(file, 200, poppler_path=POPPLER_PATH)
-        for i, page in enumerate(pages):
-            output_name = os.path.join(output_folder, f'{os.path.basename(file)}_{i}.png')
+        # the same page names as iter_pages and Textract_OCR.detect_pdf_text
+        name = os.path.splitext(os.path.basename(file))[0]
+        for i, page in iter_pdf_pages(file, 200):
+            output_name = os.path.join(output_folder, f'{name}_{i}.png')
             file_dict["pages"][i] = output_name
-            page.save(output_name, 'PNG')
+            cv2.imwrite(output_name, cv2.cvtColor(page, cv2.COLOR_RGB2BGR))
         new_files.append(file_dict)
     return new_files
 
+def read_image(file):
+    """Read an image file in keras-ocr format, same as keras_ocr.tools.read
+    Args:
+    file (str): The image file
+    return: An RGB numpy array
+    """
+    return cv2.cvtColor(cv2.imread(file), cv2.COLOR_BGR2RGB)
+
 def convert_images_to_keras_ocr(images):
     """Convert images to keras-ocr format
     Args:
@@ -54,16 +265,37 @@ def convert_images_to_keras_ocr(images):
     """
     images1 = []
     for i, image in images.items():
-        images1.append(keras_ocr.tools.read(image))
+        images1.append(read_image(image))
     return images1
 
-def get_prediction_groups(images):
+def get_prediction_groups(images, batch_size=None, pipeline=None):
     """Get the prediction groups
     Args:
     images (list): A list of images
+    batch_size (int): The batch size used by the detector and recognizer models
+    pipeline (keras_ocr.pipeline.Pipeline): The pipeline to run, defaults to get_pipeline()
     return: A list of prediction groups
     """
-    return pipeline.recognize(images)
+    pipeline = pipeline or get_pipeline()
+    if batch_size is None:
+        return pipeline.recognize(images)
+    return pipeline.recognize(images,
+                              detection_kwargs={'batch_size': batch_size},
+                              recognition_kwargs={'batch_size': batch_size})
+
+def iter_batches(items, batch_size):
+    """Split a list or a stream into fixed size batches
+    Args:
+    items (iterable): A list or generator of items
+    batch_size (int): The number of items in each batch
+    return: A generator of lists, the last one may be shorter
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
 
 def create_predictions_dict(predictions):
     """Create a dictionary of predictions
@@ -85,24 +317,17 @@ def create_predictions_dict(predictions):
         }
     return predictions_dict
 
-
-def cv2_annotations(predictions, image, with_text=False):
-    """Draw the annotations on the image
+def create_prediction_result(predictions):
+    """Create an OCRResult from keras-ocr predictions
     Args:
     predictions (list): A list of predictions
-    image (numpy array): The image to draw the annotations on
-    with_text (bool): Whether to draw the text on the image
-    return: The image with the annotations
+    return: An OCRResult, keras-ocr gives no confidences
     """
-    predictions_dict = {}
-    for i, prediction in enumerate(predictions):
-        text = prediction[0]
-        x1, y1 = int(round(prediction[1][0][0])), int(round(prediction[1][0][1]))
-        x2, y2 = int(round(prediction[1][2][0])), int(round(prediction[1][2][1]))
-        cv2.rectangle(img=image, pt1=(x1, y1), pt2=(x2, y2), color=(0, 255, 0), thickness=2)
-        if with_text:
-            cv2.putText(image, text, (x2, y2), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-    return image
+    corners = np.array([box for _, box in predictions], dtype=np.float64).reshape(-1, 4, 2)
+    # same rounding as create_predictions_dict, top left and bottom right corners
+    x1, y1 = np.rint(corners[:, 0, 0]), np.rint(corners[:, 0, 1])
+    x2, y2 = np.rint(corners[:, 2, 0]), np.rint(corners[:, 2, 1])
+    return OCRResult.from_columns([text for text, _ in predictions], x1, y1, x2, y2, engine='keras')
 
 def save_image(image, output_name):
     """Save the image
@@ -113,22 +338,178 @@ def save_image(image, output_name):
     cv2.imwrite(output_name, image)
 
 
-def process_single_file(file):
+def get_tile_origins(length, tile_size, overlap):
+    """Get the start positions of tiles along one axis
+    Args:
+    length (int): The length of the axis
+    tile_size (int): The length of a tile
+    overlap (int): The overlap between neighbouring tiles
+    return: A list of start positions, the last tile is aligned to the end of the axis
+    """
+    if length <= tile_size:
+        return [0]
+    step = max(tile_size - overlap, 1)
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+def get_tiles(image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Get the tile origins covering an image
+    Args:
+    image (numpy array): The image to tile
+    tile_size (int): The width and height of a tile
+    overlap (int): The overlap between neighbouring tiles
+    return: A list of (x, y) tile origins
+    """
+    height, width = image.shape[:2]
+    return [(x, y)
+            for y in get_tile_origins(height, tile_size, overlap)
+            for x in get_tile_origins(width, tile_size, overlap)]
+
+def non_max_suppression(boxes, scores, threshold=0.5, metric='ios'):
+    """Suppress overlapping boxes, keeping the highest scoring ones
+    Args:
+    boxes (numpy array): An (N, 4) array of x1, y1, x2, y2 boxes
+    scores (numpy array): An (N,) array of box scores
+    threshold (float): The overlap above which a box is suppressed
+    metric (str): 'iou' for intersection over union or 'ios' for intersection over the smaller box,
+    which also catches words cut in half at a tile edge
+    return: The indices of the kept boxes in their original order
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    x1, y1, x2, y2 = boxes.T
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        iw = np.maximum(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0)
+        ih = np.maximum(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0)
+        intersection = iw * ih
+        if metric == 'iou':
+            denominator = areas[i] + areas[rest] - intersection
+        else:
+            denominator = np.minimum(areas[i], areas[rest])
+        overlap = intersection / np.maximum(denominator, 1e-9)
+        order = rest[overlap <= threshold]
+    return np.sort(np.array(keep, dtype=np.int64))
+
+def recognize_tiled(image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, batch_size=4, workers=1, threshold=0.5,
+                    pipeline=None):
+    """Run the pipeline on overlapping tiles of a large image
+    Tiles are views into the image and only one batch per worker is in
+    flight, so memory use depends on the tile and batch size, not on the sheet size.
+    Args:
+    image (numpy array): The image to run the pipeline on
+    tile_size (int): The width and height of a tile
+    overlap (int): The overlap between neighbouring tiles, should exceed the longest word
+    batch_size (int): The number of tiles in each batch
+    workers (int): The number of batches run in parallel
+    threshold (float): The overlap above which duplicate boxes are suppressed
+    pipeline (keras_ocr.pipeline.Pipeline): The pipeline to run, defaults to get_pipeline()
+    return: A list of predictions in sheet coordinates
+    """
+
+    def run_batch(origins):
+        tiles = [image[y:y + tile_size, x:x + tile_size] for x, y in origins]
+        prediction_groups = get_prediction_groups(tiles, batch_size=batch_size, pipeline=pipeline)
+        shifted = []
+        for (x, y), predictions in zip(origins, prediction_groups):
+            for text, box in predictions:
+                shifted.append((text, box + np.array([x, y], dtype=box.dtype)))
+        return shifted
+
+    origins = get_tiles(image, tile_size, overlap)
+    predictions = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for shifted in executor.map(run_batch, iter_batches(origins, batch_size)):
+            predictions.extend(shifted)
+    if not predictions:
+        return predictions
+
+    # remove duplicates found in the overlap of two tiles, the larger box is the uncut word
+    corners = np.array([box for _, box in predictions])
+    boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    scores = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = non_max_suppression(boxes, scores, threshold=threshold)
+    return [predictions[i] for i in keep]
+
+def process_single_file(file, tile_size=None, overlap=TILE_OVERLAP, workers=1, cache=ocr_cache, image=None, render=True):
     """Run the pipeline on a single file
     Args:
     file (str): The file to run the pipeline on
-    return: A dictionary of predictions and the image with the annotations
+    tile_size (int): If set, run detection on tiles of this size instead of the whole sheet
+    overlap (int): The overlap between neighbouring tiles
+    workers (int): The number of tile batches run in parallel
+    cache (OCRCache): The result cache, None to always run the pipeline
+    image (numpy array): The file already decoded with cv2.imread, it is not modified
+    render (bool): Whether to draw and save the annotated image, see OCR_Render for the output format
+    return: An OCRResult and the image with the annotations, None if render is False
     """
 
-    image = keras_ocr.tools.read(file)
-    prediction_groups = pipeline.recognize([image])
-    predictions = prediction_groups[0]
-    predictions_dict = create_predictions_dict(predictions)
-    image2 = cv2_annotations(predictions, cv2.imread(file))
+    if image is None:
+        image = cv2.imread(file)
+    # keras-ocr expects RGB, this is what keras_ocr.tools.read does for a filepath
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    result = None
+    if cache is not None:
+        params = {'tile_size': tile_size, 'overlap': overlap if tile_size else None, **get_backend_params()}
+        key = cache.make_key(hash_image(image), 'keras', version('keras-ocr'), params)
+        result = cache.get(key)
+    if result is None:
+        if tile_size:
+            predictions = recognize_tiled(rgb_image, tile_size=tile_size, overlap=overlap, workers=workers)
+        else:
+            prediction_groups = get_pipeline().recognize([rgb_image])
+            predictions = prediction_groups[0]
+        result = create_prediction_result(predictions)
+        if cache is not None:
+            cache.put(key, result)
     dir, filename = os.path.split(file)
     fname, ext = os.path.splitext(filename)
     outfile = fname + '_Keras.png'
     outfile = os.path.join('Results', outfile)
-    cv2.imwrite(outfile, image2)
-    return predictions_dict, image2
+    image2 = render_result(image, result, outfile, color=(0, 255, 0), thickness=2, render=render)
+    return result, image2
 
+def process_batch(files, batch_size=4, output_folder='Results', tile_size=None, overlap=TILE_OVERLAP, dpi=200,
+                  render=True):
+    """Run the pipeline on a batch of files
+    Pages are streamed straight from the pdf renderer and grouped into fixed size
+    batches so the detector and recognizer run once per batch instead of once per page.
+    Args:
+    files (list): A list of pdf and image files
+    batch_size (int): The number of pages in each batch
+    output_folder (str): The folder to save the annotated images to
+    tile_size (int): If set, each page is split into tiles of this size and the tiles are batched
+    overlap (int): The overlap between neighbouring tiles
+    dpi (int): The resolution to render pdf pages at
+    render (bool): Whether to draw and save the annotated pages
+    return: A dictionary of OCRResults keyed by page name
+    """
+    results = {}
+    n_pages = 0
+    start = time.perf_counter()
+    for batch in iter_batches(iter_pages(files, dpi), batch_size):
+        pages = [page for page, _ in batch]
+        images = [image for _, image in batch]
+        n_pages += len(batch)
+        if tile_size:
+            prediction_groups = [recognize_tiled(image, tile_size=tile_size, overlap=overlap, batch_size=batch_size)
+                                 for image in images]
+        else:
+            prediction_groups = get_prediction_groups(images, batch_size=batch_size)
+        for page, image, predictions in zip(pages, images, prediction_groups):
+            results[page] = create_prediction_result(predictions)
+            if render:
+                fname, ext = os.path.splitext(os.path.basename(page))
+                render_result(cv2.cvtColor(image, cv2.COLOR_RGB2BGR), results[page],
+                              os.path.join(output_folder, fname + '_Keras.png'), color=(0, 255, 0), thickness=2)
+    elapsed = time.perf_counter() - start
+    if n_pages:
+        print(f'Processed {n_pages} pages in {elapsed:.1f}s ({n_pages / elapsed:.2f} pages/sec)')
+    return results
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import Textract_Label_Studio as label_studio
+from Textract_Cache import get_cache_file
+
+"""
+Incremental sync of drawings and their Textract pre-annotations into Label Studio.
+A SQLite state store records, for each drawing in a project, the sha256 of the image file, the hash
+of the Textract response, the pre-annotation version, the signature of the tag rules, the hash
+of the predicted results and the Label Studio task and prediction ids.
+A rerun only uploads images that changed, only imports drawings without a task, and only
+patches the predictions whose results changed, e.g. after a change to the valve patterns of the rule set.
+State is committed as each drawing is synced, so an interrupted sync resumes where it stopped.
+Drawings are found in the subfolders too and are keyed by their path relative to the synced folder,
+so drawings with the same name in different subfolders keep their own state and S3 objects.
+"""
+
+SYNC_DB = os.path.join('Results', 'label_studio_sync.sqlite')
+# bump when the conversion of Textract blocks to Label Studio results changes
+PREANNOTATION_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drawings (
+    project_id INTEGER NOT NULL,
+    drawing TEXT NOT NULL,
+    file_hash TEXT,
+    textract_hash TEXT,
+    preannotation_version INTEGER,
+    rules_signature TEXT,
+    results_hash TEXT,
+    url TEXT,
+    task_id INTEGER,
+    prediction_id INTEGER,
+    updated REAL,
+    PRIMARY KEY (project_id, drawing)
+)
+"""
+FIELDS = ('project_id', 'drawing', 'file_hash', 'textract_hash', 'preannotation_version', 'rules_signature',
+          'results_hash', 'url', 'task_id', 'prediction_id', 'updated')
+
+
+class SyncState:
+    """SQLite store of the sync state of each drawing"""
+
+    def __init__(self, path=SYNC_DB):
+        """
+        :param path: database file, ':memory:' for a throwaway store"""
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(SCHEMA)
+        columns = {row['name'] for row in self.connection.execute('PRAGMA table_info(drawings)')}
+        if 'image_hash' in columns:
+            # written before the column was renamed, it always held the sha256 of the file
+            self.connection.execute('ALTER TABLE drawings RENAME COLUMN image_hash TO file_hash')
+            self.connection.commit()
+
+    def get(self, project_id, drawing):
+        """Get the state of a drawing
+        :param project_id: Label Studio project id
+        :param drawing: drawing path relative to the synced folder, see get_drawing_key
+        :return: dictionary of FIELDS, or None if the drawing has never been synced"""
+        row = self.connection.execute('SELECT * FROM drawings WHERE project_id = ? AND drawing = ?',
+                                      (project_id, drawing)).fetchone()
+        return dict(row) if row is not None else None
+
+    def put(self, record):
+        """Insert or replace the state of a drawing and commit it
+        :param record: dictionary of FIELDS"""
+        record = dict(record, updated=time.time())
+        self.connection.execute(f'INSERT OR REPLACE INTO drawings ({", ".join(FIELDS)}) '
+                                f'VALUES ({", ".join("?" * len(FIELDS))})', [record.get(f) for f in FIELDS])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def get_drawing_key(file, folder):
+    """Get the key of a drawing in the state store
+    :param file: png filepath
+    :param folder: synced folder
+    :return: path of the file relative to the folder, with forward slashes"""
+    return os.path.relpath(file, folder).replace(os.sep, '/')
+
+
+def file_sha256(file):
+    """Hash the content of a file
+    :param file: filepath
+    :return: hex sha256"""
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_response_file(file):
+    """Get the saved Textract response of a drawing, preferring the .tbc cache
+    :param file: png filepath
+    :return: .tbc or .json filepath"""
+    cache_file = get_cache_file(file)
+    return cache_file if os.path.exists(cache_file) else os.path.splitext(file)[0] + '.json'
+
+
+def results_sha256(results):
+    """Hash Label Studio results
+    :param results: list of Label Studio results
+    :return: hex sha256"""
+    return hashlib.sha256(json.dumps(results, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_prediction_id(project, task_id):
+    """Get the id of the first prediction of a task
+    :param project: Label Studio Project
+    :param task_id: task id
+    :return: prediction id, or None if the task has none"""
+    predictions = project.get_task(task_id).get('predictions') or []
+    if not predictions:
+        return None
+    prediction = predictions[0]
+    return prediction['id'] if isinstance(prediction, dict) else prediction
+
+
+def patch_prediction(project, prediction_id, results):
+    """Replace the results of a prediction
+    :param project: Label Studio Project
+    :param prediction_id: prediction id
+    :param results: list of Label Studio results"""
+    project.make_request('PATCH', f'/api/predictions/{prediction_id}', json={'result': results})
+
+
+def patch_task_image(project, task_id, url):
+    """Point a task at a new image url
+    :param project: Label Studio Project
+    :param task_id: task id
+    :param url: image url"""
+    project.make_request('PATCH', f'/api/tasks/{task_id}', json={'data': {'ocr': url}})
+
+
+def sync_folder(folder, title=label_studio.PROJECT_TITLE, chunk_size=label_studio.IMPORT_CHUNK_SIZE, db=SYNC_DB,
+                ls=None):
+    """Sync the drawings of a folder into a Label Studio project, touching only what changed
+    :param folder: folder of png files with Textract responses next to them, subfolders included
+    :param title: Project title
+    :param chunk_size: number of new tasks per import request
+    :param db: state database file
+    :param ls: Label Studio Client, defaults to a new connection
+    :return: dictionary of counts of imported, patched and unchanged drawings"""
+    start = time.perf_counter()
+    ls = ls or label_studio.connect_to_label_studio()
+    project = label_studio.get_or_create_project(ls, label_studio.create_label_config(), title=title)
+    template = label_studio.load_template()
+    signature = label_studio.tag_classifier.signature
+    state = SyncState(db)
+    counts = {'imported': 0, 'patched': 0, 'unchanged': 0}
+
+    # find the drawings whose image, Textract response or tag rules changed since the last sync
+    stale = []
+    for file in label_studio.get_files_with_responses(folder, recursive=True):
+        drawing = get_drawing_key(file, folder)
+        record = state.get(project.id, drawing) or {'project_id': project.id, 'drawing': drawing}
+        file_hash = file_sha256(file)
+        textract_hash = file_sha256(get_response_file(file))
+        if (record.get('task_id') is not None and record.get('file_hash') == file_hash
+                and record.get('textract_hash') == textract_hash
+                and record.get('preannotation_version') == PREANNOTATION_VERSION
+                and record.get('rules_signature') == signature):
+            counts['unchanged'] += 1
+            continue
+        stale.append((file, record, file_hash))
+
+    # upload the changed images concurrently
+    to_upload = [file for file, record, file_hash in stale if record.get('file_hash') != file_hash]
+    urls = label_studio.upload_files(to_upload, label_studio.bucket, root=folder)
+
+    pending = []
+    for file, record, file_hash in stale:
+        task = label_studio.build_task(file, template, url=urls.get(file, record.get('url')))
+        results = task['predictions'][0]['result']
+        results_hash = results_sha256(results)
+        new_record = dict(record, file_hash=file_hash, preannotation_version=PREANNOTATION_VERSION,
+                          rules_signature=signature, results_hash=results_hash, url=task['data']['ocr'],
+                          # the json is converted to .tbc when it is first loaded, hash what will be found next time
+                          textract_hash=file_sha256(get_response_file(file)))
+        if record.get('task_id') is None:
+            pending.append((task, new_record))
+            if len(pending) >= chunk_size:
+                counts['imported'] += import_pending(project, pending, state)
+                pending = []
+            continue
+        if new_record['url'] != record.get('url'):
+            patch_task_image(project, record['task_id'], new_record['url'])
+        if results_hash != record.get('results_hash'):
+            if new_record.get('prediction_id') is None:
+                new_record['prediction_id'] = get_prediction_id(project, record['task_id'])
+            patch_prediction(project, new_record['prediction_id'], results)
+            counts['patched'] += 1
+        else:
+            counts['unchanged'] += 1
+        state.put(new_record)
+    if pending:
+        counts['imported'] += import_pending(project, pending, state)
+    state.close()
+
+    print(f'Synced {folder} into {title} in {time.perf_counter() - start:.1f}s: '
+          + ', '.join(f'{count} {name}' for name, count in counts.items()))
+    return counts
+
+
+def import_pending(project, pending, state):
+    """Import a chunk of new tasks and record their task ids
+    :param project: Label Studio Project
+    :param pending: list of (task, state record) tuples
+    :param state: SyncState
+    :return: number of tasks imported"""
+    task_ids = label_studio.import_tasks(project, [task for task, _ in pending], chunk_size=len(pending))
+    for (_, record), task_id in zip(pending, task_ids):
+        # the prediction id is looked up when the prediction is first patched
+        state.put(dict(record, task_id=task_id, prediction_id=None))
+    return len(pending)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Incrementally sync drawings and pre-annotations into Label Studio')
+    parser.add_argument('folder', help='folder of png files with Textract responses')
+    parser.add_argument('--project', default=label_studio.PROJECT_TITLE, help='title of the project to reuse or create')
+    parser.add_argument('--chunk-size', type=int, default=label_studio.IMPORT_CHUNK_SIZE, help='tasks per import request')
+    parser.add_argument('--db', default=SYNC_DB, help='sync state database')
+    parser.add_argument('--rules', default=label_studio.TAG_PATTERNS_FILE, help='tag rule set json file')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    label_studio.set_rule_set(args.rules)
+    sync_folder(args.folder, title=args.project, chunk_size=args.chunk_size, db=args.db)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import threading
+from OCR_Result import OCRResult
+
+"""
+Content addressed cache of OCR results shared by the Keras, Textract and Tesseract engines.
+Results are keyed by a hash of the decoded image, the engine name, the engine version and
+the parameters used, so a changed image or setting never serves a stale result.
+Entries are stored as compressed OCRResult .npz files and the least recently used entries
+are evicted once the cache grows past its size limit.
+"""
+
+CACHE_DIR = '.ocr_cache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_EXT = '.npz'
+# extensions of earlier cache formats, never read again and removed by evict and clear
+LEGACY_CACHE_EXTS = ('.json.gz',)
+
+
+def hash_image(image):
+    """Hash the pixels of a decoded image
+    :param image: numpy image
+    :return: hex digest"""
+    h = hashlib.sha256()
+    h.update(f'{image.dtype.str}{image.shape}'.encode())
+    h.update(memoryview(image).cast('B') if image.flags.c_contiguous else image.tobytes())
+    return h.hexdigest()
+
+
+class OCRCache:
+    """Size bounded LRU cache of OCR results on local disk, shared by the engine threads
+    The cache is best effort, an entry that can't be written is skipped rather than failing the OCR run."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        """
+        :param cache_dir: directory to store the entries in
+        :param max_bytes: total size of the entries above which the least recently used are evicted"""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size = None
+        # guards the size bookkeeping, reentrant as put evicts while holding it
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(image_hash, engine, version, params=None):
+        """Make a cache key
+        :param image_hash: hash of the image, see hash_image
+        :param engine: engine name
+        :param version: engine version
+        :param params: dictionary of parameters that change the result
+        :return: cache key"""
+        identity = json.dumps([image_hash, engine, str(version), params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_EXT)
+
+    def _entries(self):
+        """List the cached files, including those of earlier formats, as (last used, size, path) tuples"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith((CACHE_EXT,) + LEGACY_CACHE_EXTS):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def get(self, key):
+        """Get a cached result
+        :param key: cache key
+        :return: OCRResult or None"""
+        path = self._path(key)
+        try:
+            result = OCRResult.load_npz(path)
+            # the modification time records the last use for eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return result
+
+    def put(self, key, result):
+        """Store a result
+        :param key: cache key
+        :param result: OCRResult"""
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                result.save_npz(f)
+            with self._lock:
+                # an overwritten entry no longer counts towards the size
+                old_size = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(tmp, path)
+                if self._size is None:
+                    self._size = sum(size for _, size, _ in self._entries())
+                else:
+                    self._size += os.path.getsize(path) - old_size
+                if self._size > self.max_bytes:
+                    self.evict()
+        except OSError as e:
+            print(f'Skipped caching {key}: {e}')
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def evict(self):
+        """Remove the entries of earlier formats, then the least recently used entries until the cache
+        fits its size limit"""
+        with self._lock:
+            # earlier formats can never be hit, so they go first whatever their age
+            entries = sorted(self._entries(), key=lambda entry: (not entry[2].endswith(LEGACY_CACHE_EXTS), entry))
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if total <= self.max_bytes and not path.endswith(LEGACY_CACHE_EXTS):
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._size = total
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+
+# shared cache used by the engines, pass cache=None to process_single_file to bypass it
+ocr_cache = OCRCache()
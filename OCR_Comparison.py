@@ -0,0 +1,209 @@
+import csv
+import numpy as np
+
+# editdistance is a C implementation of Levenshtein distance, fall back to python if it's missing
+try:
+    import editdistance
+except ImportError:
+    editdistance = None
+
+"""
+Scoring of OCR engines against a reference engine, normally the Textract response.
+Words are matched one to one by the IoU of their boxes and each engine gets
+precision, recall and F1 for detection, plus a character error rate on the text.
+Boxes are swept left to right in chunks, so only boxes that overlap horizontally
+are compared and large pages don't need a full N x M IoU matrix.
+"""
+
+IOU_THRESHOLD = 0.5
+CHUNK_SIZE = 1024
+SUMMARY_FIELDS = ['engine', 'reference', 'words', 'reference_words', 'matched',
+                  'precision', 'recall', 'f1', 'text_accuracy', 'cer']
+
+
+def pairwise_iou(boxes1, boxes2):
+    """IoU of every pair of boxes
+    :param boxes1: (N, 4) array of x1, y1, x2, y2 boxes
+    :param boxes2: (M, 4) array of x1, y1, x2, y2 boxes
+    :return: (N, M) array of IoUs"""
+    a = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)[None, :, :]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = iw * ih
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    return np.where(union > 0, intersection / np.where(union > 0, union, 1), 0.0)
+
+
+def match_boxes(boxes, reference_boxes, threshold=IOU_THRESHOLD, chunk_size=CHUNK_SIZE):
+    """Match boxes one to one with reference boxes, greedily by highest IoU
+    :param boxes: (N, 4) array of x1, y1, x2, y2 boxes
+    :param reference_boxes: (M, 4) array of x1, y1, x2, y2 boxes
+    :param threshold: minimum IoU of a match
+    :param chunk_size: number of boxes compared per step of the sweep
+    :return: arrays of matched box indices, matched reference indices and their IoUs"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    reference_boxes = np.asarray(reference_boxes, dtype=np.float64).reshape(-1, 4)
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    if len(boxes) == 0 or len(reference_boxes) == 0:
+        return empty
+
+    # sweep line over x: sort the reference boxes by left edge so each chunk of boxes
+    # only needs the reference boxes that start before the chunk's right-most edge
+    # and, of those, only the ones that end after the chunk's left-most edge
+    order = np.argsort(boxes[:, 0], kind='stable')
+    ref_order = np.argsort(reference_boxes[:, 0], kind='stable')
+    ref_sorted = reference_boxes[ref_order]
+    ref_max_x2 = np.maximum.accumulate(ref_sorted[:, 2])
+
+    rows, cols, ious = [], [], []
+    for start in range(0, len(order), chunk_size):
+        idx = order[start:start + chunk_size]
+        chunk = boxes[idx]
+        hi = np.searchsorted(ref_sorted[:, 0], chunk[:, 2].max(), side='left')
+        lo = np.searchsorted(ref_max_x2, chunk[:, 0].min(), side='right')
+        if lo >= hi:
+            continue
+        iou = pairwise_iou(chunk, ref_sorted[lo:hi])
+        r, c = np.nonzero(iou >= threshold)
+        rows.append(idx[r])
+        cols.append(ref_order[lo + c])
+        ious.append(iou[r, c])
+    if not rows:
+        return empty
+    rows, cols, ious = np.concatenate(rows), np.concatenate(cols), np.concatenate(ious)
+
+    # greedy one to one assignment, best IoU first
+    matched_rows, matched_cols, matched_ious = [], [], []
+    used_rows, used_cols = set(), set()
+    for k in np.argsort(-ious, kind='stable').tolist():
+        i, j = int(rows[k]), int(cols[k])
+        if i in used_rows or j in used_cols:
+            continue
+        used_rows.add(i)
+        used_cols.add(j)
+        matched_rows.append(i)
+        matched_cols.append(j)
+        matched_ious.append(float(ious[k]))
+    return np.array(matched_rows, dtype=np.int64), np.array(matched_cols, dtype=np.int64), np.array(matched_ious)
+
+
+def levenshtein(a, b):
+    """Edit distance between two strings
+    :param a: string
+    :param b: string
+    :return: number of insertions, deletions and substitutions"""
+    if editdistance is not None:
+        return editdistance.eval(a, b)
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def count_matches(result, reference, threshold=IOU_THRESHOLD, case_sensitive=False):
+    """Count the matches of an engine's words against the reference words
+    :param result: OCRResult of the engine
+    :param reference: OCRResult of the reference
+    :param threshold: minimum IoU of a match
+    :param case_sensitive: whether text comparison is case sensitive, keras-ocr only predicts lower case
+    :return: dictionary of counts"""
+    rows, cols, _ = match_boxes(result.boxes, reference.boxes, threshold=threshold)
+    texts, reference_texts = result.text, reference.text
+    if not case_sensitive:
+        texts = [t.lower() for t in texts]
+        reference_texts = [t.lower() for t in reference_texts]
+
+    edits, exact = 0, 0
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        distance = levenshtein(texts[i], reference_texts[j])
+        edits += distance
+        exact += distance == 0
+    # reference words the engine missed count as deleted characters
+    missed = np.ones(len(reference_texts), dtype=bool)
+    missed[cols] = False
+    edits += sum(len(reference_texts[j]) for j in np.flatnonzero(missed).tolist())
+    return {
+        'words': len(result),
+        'reference_words': len(reference),
+        'matched': len(rows),
+        'exact': exact,
+        'edits': edits,
+        'reference_chars': sum(len(t) for t in reference_texts),
+    }
+
+
+def summarise(counts, engine='', reference=''):
+    """Turn match counts into a row of the summary table
+    :param counts: dictionary of counts from count_matches, or their sum over a corpus
+    :param engine: engine name
+    :param reference: reference engine name
+    :return: summary row"""
+    precision = counts['matched'] / counts['words'] if counts['words'] else 0.0
+    recall = counts['matched'] / counts['reference_words'] if counts['reference_words'] else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'engine': engine,
+        'reference': reference,
+        'words': counts['words'],
+        'reference_words': counts['reference_words'],
+        'matched': counts['matched'],
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(f1, 4),
+        'text_accuracy': round(counts['exact'] / counts['matched'], 4) if counts['matched'] else 0.0,
+        'cer': round(counts['edits'] / counts['reference_chars'], 4) if counts['reference_chars'] else 0.0,
+    }
+
+
+def compare_engines(results, reference='Textract', threshold=IOU_THRESHOLD):
+    """Score every engine against the reference engine on one page
+    :param results: dictionary of engine name to OCRResult
+    :param reference: name of the reference engine
+    :param threshold: minimum IoU of a match
+    :return: list of summary rows"""
+    return score_corpus([results], reference=reference, threshold=threshold)
+
+
+def score_corpus(pages, reference='Textract', threshold=IOU_THRESHOLD):
+    """Score every engine against the reference engine over a corpus
+    Counts are summed over the pages before the rates are worked out.
+    :param pages: iterable of dictionaries of engine name to OCRResult, one per page
+    :param reference: name of the reference engine
+    :param threshold: minimum IoU of a match
+    :return: list of summary rows"""
+    totals = {}
+    for results in pages:
+        for engine, result in results.items():
+            if engine == reference:
+                continue
+            counts = count_matches(result, results[reference], threshold=threshold)
+            total = totals.setdefault(engine, dict.fromkeys(counts, 0))
+            for key, value in counts.items():
+                total[key] += value
+    return [summarise(counts, engine, reference) for engine, counts in totals.items()]
+
+
+def write_summary(rows, file):
+    """Write summary rows to a csv file
+    :param rows: list of summary rows
+    :param file: csv filepath"""
+    with open(file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_summary(rows):
+    """Print summary rows as a table
+    :param rows: list of summary rows"""
+    print(' '.join(f'{field:>15}' for field in SUMMARY_FIELDS))
+    for row in rows:
+        print(' '.join(f'{row[field]:>15}' for field in SUMMARY_FIELDS))
@@ -0,0 +1,42 @@
+import os
+
+"""
+Input file helpers shared by the engines and main.
+This module imports nothing heavy, so main can find its inputs without loading an engine.
+"""
+
+# pdf2image requires poppler to be installed
+# you can set POPPLER_PATH to the location of the bin folder
+# this is the default location for poppler-0.68.0
+POPPLER_PATH = r'C:\Program Files\poppler-0.68.0\bin'
+
+
+def get_files_from_folder(folder, extensions=(".pdf",)):
+    """Get all pdf files from a folder
+    :param folder: the folder to get the files from
+    :param extensions: tuple of the file extensions to include
+    :return: list of files"""
+    files = []
+    for file in sorted(os.listdir(folder)):
+        if file.lower().endswith(extensions):
+            files.append(os.path.join(folder, file))
+    return files
+
+
+def iter_pdf_pages(file, dpi=200, window=1):
+    """Render the pages of a pdf file a few at a time
+    Only `window` pages are held in memory at once, so memory stays flat
+    however many pages the pdf has. pdf2image is imported on first use.
+    :param file: the pdf file
+    :param dpi: the resolution to render the pages at
+    :param window: the number of pages rendered per call to poppler
+    :return: generator of (page index, RGB numpy array) tuples"""
+    import numpy as np
+    import pdf2image
+    n_pages = pdf2image.pdfinfo_from_path(file, poppler_path=POPPLER_PATH)["Pages"]
+    for first_page in range(1, n_pages + 1, window):
+        last_page = min(first_page + window - 1, n_pages)
+        pages = pdf2image.convert_from_path(file, dpi, first_page=first_page, last_page=last_page,
+                                            poppler_path=POPPLER_PATH)
+        for i, page in enumerate(pages, first_page - 1):
+            yield i, np.asarray(page.convert("RGB"))
@@ -0,0 +1,83 @@
+import os
+import cv2
+import numpy as np
+
+"""
+Rendering of OCR results onto the drawing.
+All boxes of a result are drawn with a single cv2.polylines call over a stacked array,
+and the encoder can be switched to a low compression PNG, JPEG, WebP or a downscaled
+preview, so batch runs don't spend their time writing full resolution images.
+"""
+
+# default output settings
+RENDER_FORMAT = 'png'
+PNG_COMPRESSION = 1
+JPEG_QUALITY = 90
+WEBP_QUALITY = 80
+# scale of the written image, e.g. 0.25 for a quarter size preview
+PREVIEW_SCALE = 1.0
+
+ENCODERS = {
+    'png': ('.png', lambda: [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]),
+    'jpg': ('.jpg', lambda: [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]),
+    'webp': ('.webp', lambda: [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY]),
+}
+
+
+def get_polygons(result):
+    """Get the boxes of a result as closed polygons
+    :param result: OCRResult
+    :return: (N, 4, 2) int32 array of box corners"""
+    x1, y1, x2, y2 = result.x1, result.y1, result.x2, result.y2
+    return np.stack([np.stack([x1, y1], axis=1), np.stack([x2, y1], axis=1),
+                     np.stack([x2, y2], axis=1), np.stack([x1, y2], axis=1)], axis=1).astype(np.int32)
+
+
+def draw_boxes(image, result, color=(0, 0, 255), thickness=2, with_text=False):
+    """Draw every box of a result on an image in one call
+    :param image: numpy image, drawn on in place
+    :param result: OCRResult
+    :param color: colour of the boxes
+    :param thickness: thickness of the boxes
+    :param with_text: whether to write the text next to each box
+    :return: the annotated image"""
+    if len(result):
+        cv2.polylines(image, get_polygons(result), isClosed=True, color=color, thickness=thickness)
+        if with_text:
+            for text, x2, y2 in zip(result.text, result.x2.tolist(), result.y2.tolist()):
+                cv2.putText(image, text, (x2, y2), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return image
+
+
+def save_image(image, outfile, fmt=None, preview_scale=None):
+    """Encode and write an image
+    :param image: numpy image
+    :param outfile: output filepath, the extension is replaced to match the format
+    :param fmt: 'png', 'jpg' or 'webp', defaults to RENDER_FORMAT
+    :param preview_scale: scale the image is written at, defaults to PREVIEW_SCALE
+    :return: the filepath written"""
+    ext, params = ENCODERS[fmt or RENDER_FORMAT]
+    scale = PREVIEW_SCALE if preview_scale is None else preview_scale
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    outfile = os.path.splitext(outfile)[0] + ext
+    cv2.imwrite(outfile, image, params())
+    return outfile
+
+
+def render_result(image, result, outfile, color=(0, 0, 255), thickness=2, render=True, fmt=None, preview_scale=None):
+    """Draw a result on a copy of the image and write it
+    :param image: numpy image, it is not modified
+    :param result: OCRResult
+    :param outfile: output filepath
+    :param color: colour of the boxes
+    :param thickness: thickness of the boxes
+    :param render: False skips drawing and writing altogether
+    :param fmt: 'png', 'jpg' or 'webp', defaults to RENDER_FORMAT
+    :param preview_scale: scale the image is written at, defaults to PREVIEW_SCALE
+    :return: the annotated image, or None if render is False"""
+    if not render:
+        return None
+    annotated = draw_boxes(image.copy(), result, color=color, thickness=thickness)
+    save_image(annotated, outfile, fmt=fmt, preview_scale=preview_scale)
+    return annotated
@@ -0,0 +1,171 @@
+import io
+import sys
+import numpy as np
+
+"""
+Compact OCR result shared by the Keras, Textract and Tesseract engines.
+Word boxes are held in int32 coordinate arrays with float32 confidences, and the text of
+each word is an index into a table of interned strings, so repeated tags are stored once.
+"""
+
+
+class OCRResult:
+    """Array backed OCR result, one row per word"""
+
+    __slots__ = ('engine', 'keys', 'text_ids', 'texts', 'x1', 'y1', 'x2', 'y2', 'conf')
+
+    def __init__(self, keys, text_ids, texts, x1, y1, x2, y2, conf=None, engine=''):
+        """
+        :param keys: int array of word keys, e.g. the Textract block index
+        :param text_ids: int array of indices into texts
+        :param texts: list of unique strings
+        :param x1, y1, x2, y2: int arrays of pixel coordinates
+        :param conf: float array of confidences, NaN when the engine gives none
+        :param engine: engine name"""
+        self.engine = engine
+        self.keys = np.asarray(keys, dtype=np.int32)
+        self.text_ids = np.asarray(text_ids, dtype=np.int32)
+        self.texts = list(texts)
+        self.x1 = np.asarray(x1, dtype=np.int32)
+        self.y1 = np.asarray(y1, dtype=np.int32)
+        self.x2 = np.asarray(x2, dtype=np.int32)
+        self.y2 = np.asarray(y2, dtype=np.int32)
+        if conf is None:
+            conf = np.full(len(self.keys), np.nan)
+        self.conf = np.asarray(conf, dtype=np.float32)
+
+    @classmethod
+    def from_columns(cls, texts, x1, y1, x2, y2, conf=None, keys=None, engine=''):
+        """Build a result from one value per word, interning the texts
+        :param texts: list of word texts
+        :param x1, y1, x2, y2: pixel coordinates
+        :param conf: confidences
+        :param keys: word keys, defaults to 0..n-1
+        :param engine: engine name
+        :return: OCRResult"""
+        table = {}
+        text_ids = [table.setdefault(sys.intern(str(text)), len(table)) for text in texts]
+        if keys is None:
+            keys = np.arange(len(text_ids))
+        return cls(keys, text_ids, list(table), x1, y1, x2, y2, conf=conf, engine=engine)
+
+    @classmethod
+    def from_boundingbox_dict(cls, boundingbox_dict, engine=''):
+        """Build a result from an engine's dictionary of bounding boxes
+        :param boundingbox_dict: {'text', 'x1', 'y1', 'x2', 'y2'} or Textract {'text', 'boundingbox': {'pt1', 'pt2'}} boxes
+        :param engine: engine name
+        :return: OCRResult"""
+        keys, texts, coords = [], [], []
+        for key, value in boundingbox_dict.items():
+            keys.append(key)
+            texts.append(value['text'])
+            if 'boundingbox' in value:
+                (x1, y1), (x2, y2) = value['boundingbox']['pt1'], value['boundingbox']['pt2']
+            else:
+                x1, y1, x2, y2 = value['x1'], value['y1'], value['x2'], value['y2']
+            coords.append((x1, y1, x2, y2))
+        coords = np.array(coords, dtype=np.int32).reshape(-1, 4)
+        return cls.from_columns(texts, *coords.T, keys=keys, engine=engine)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f'OCRResult(engine={self.engine!r}, words={len(self)}, unique_texts={len(self.texts)})'
+
+    @property
+    def text(self):
+        """List of word texts"""
+        texts = self.texts
+        return [texts[i] for i in self.text_ids.tolist()]
+
+    @property
+    def boxes(self):
+        """(N, 4) int32 array of x1, y1, x2, y2 boxes"""
+        return np.stack([self.x1, self.y1, self.x2, self.y2], axis=1)
+
+    def to_boundingbox_dict(self, style='flat'):
+        """Convert to the dictionary format the engines used to return
+        :param style: 'flat' for {'text', 'x1', 'y1', 'x2', 'y2'} or 'textract' for {'text', 'boundingbox': {'pt1', 'pt2'}}
+        :return: dictionary of bounding boxes keyed by word key"""
+        rows = zip(self.keys.tolist(), self.text, self.x1.tolist(), self.y1.tolist(), self.x2.tolist(), self.y2.tolist())
+        if style == 'textract':
+            return {key: {'text': text, 'boundingbox': {'pt1': (x1, y1), 'pt2': (x2, y2)}}
+                    for key, text, x1, y1, x2, y2 in rows}
+        return {key: {'text': text, 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
+                for key, text, x1, y1, x2, y2 in rows}
+
+    def _arrays(self):
+        return {
+            'engine': np.array(self.engine),
+            'keys': self.keys,
+            'text_ids': self.text_ids,
+            'texts': np.array(self.texts, dtype=str),
+            'x1': self.x1, 'y1': self.y1, 'x2': self.x2, 'y2': self.y2,
+            'conf': self.conf,
+        }
+
+    def save_npz(self, file, compressed=True):
+        """Save to a NumPy .npz file
+        :param file: filepath or file object
+        :param compressed: whether to compress the arrays"""
+        (np.savez_compressed if compressed else np.savez)(file, **self._arrays())
+
+    @classmethod
+    def load_npz(cls, file):
+        """Load from a NumPy .npz file
+        :param file: filepath or file object
+        :return: OCRResult"""
+        with np.load(file, allow_pickle=False) as data:
+            return cls(data['keys'], data['text_ids'], data['texts'].tolist(), data['x1'], data['y1'],
+                       data['x2'], data['y2'], conf=data['conf'], engine=str(data['engine']))
+
+    def to_bytes(self):
+        """Serialise to compressed .npz bytes"""
+        buffer = io.BytesIO()
+        self.save_npz(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialise from .npz bytes
+        :param data: bytes from to_bytes
+        :return: OCRResult"""
+        return cls.load_npz(io.BytesIO(data))
+
+    def to_arrow(self):
+        """Convert to an Arrow table with a dictionary encoded text column, requires pyarrow
+        :return: pyarrow.Table"""
+        import pyarrow as pa
+        text = pa.DictionaryArray.from_arrays(pa.array(self.text_ids), pa.array(self.texts, type=pa.string()))
+        return pa.table({
+            'key': self.keys, 'text': text,
+            'x1': self.x1, 'y1': self.y1, 'x2': self.x2, 'y2': self.y2,
+            'conf': self.conf,
+        }, metadata={'engine': self.engine})
+
+    @classmethod
+    def from_arrow(cls, table):
+        """Build a result from an Arrow table made by to_arrow
+        :param table: pyarrow.Table
+        :return: OCRResult"""
+        text = table.column('text').combine_chunks()
+        engine = (table.schema.metadata or {}).get(b'engine', b'').decode()
+        return cls(table.column('key').to_numpy(), text.indices.to_numpy(zero_copy_only=False),
+                   text.dictionary.to_pylist(),
+                   *(table.column(c).to_numpy() for c in ('x1', 'y1', 'x2', 'y2')),
+                   conf=table.column('conf').to_numpy(), engine=engine)
+
+    def save_parquet(self, file):
+        """Save to a Parquet file, requires pyarrow
+        :param file: filepath"""
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), file)
+
+    @classmethod
+    def load_parquet(cls, file):
+        """Load from a Parquet file, requires pyarrow
+        :param file: filepath
+        :return: OCRResult"""
+        import pyarrow.parquet as pq
+        return cls.from_arrow(pq.read_table(file))
@@ -0,0 +1,75 @@
+import re
+import json
+import hashlib
+from functools import lru_cache
+
+"""
+Compiled classifier for P&ID tag strings.
+All of the rules are merged into a single alternation with one named group per rule,
+so a string is classified with at most one regex call. The alternation is tried in
+order, which keeps the precedence of the rules the same as checking them one by one.
+"""
+
+DIGITS = frozenset('0123456789')
+
+
+class TagClassifier:
+    """Classify strings into annotation classes using an ordered list of regex rules"""
+
+    def __init__(self, rules, default='Text', required_chars=DIGITS, cache_size=65536):
+        """Compile the rules
+        :param rules: list of (label, pattern, mode) tuples in order of precedence,
+                      mode is 'search' or 'fullmatch'
+        :param default: class returned when no rule matches
+        :param required_chars: characters of which every rule needs at least one,
+                               strings without any of them are rejected without a regex call.
+                               None disables the prefilter
+        :param cache_size: size of the LRU memo of classified strings"""
+        self.rules = list(rules)
+        self.default = default
+        self.required_chars = frozenset(required_chars) if required_chars is not None else None
+
+        alternatives = []
+        self.labels = {}
+        for i, (label, pattern, mode) in enumerate(self.rules):
+            name = f'r{i}'
+            if mode == 'search':
+                # a lazy prefix anchored at the start is equivalent to re.search
+                alternatives.append(f'(?P<{name}>(?s:.*?)(?:{pattern}))')
+            elif mode == 'fullmatch':
+                alternatives.append(f'(?P<{name}>(?:{pattern})\\Z)')
+            else:
+                raise ValueError(f'Unknown match mode {mode} for {label}')
+            self.labels[name] = label
+        self.regex = re.compile('|'.join(alternatives)) if alternatives else None
+        # changes whenever the rules or their order change, used to find stale classifications
+        self.signature = hashlib.sha256(json.dumps([self.rules, self.default]).encode('utf-8')).hexdigest()
+
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, string):
+        """Get the annotation class for a given string
+        :param string: string to get annotation class for
+        :return: annotation class"""
+        if self.regex is None:
+            return self.default
+        if self.required_chars is not None and self.required_chars.isdisjoint(string):
+            return self.default
+        match = self.regex.match(string)
+        if match is None:
+            return self.default
+        return self.labels[match.lastgroup]
+
+    def classify_many(self, strings):
+        """Get the annotation classes for a list of strings
+        :param strings: strings to get annotation classes for
+        :return: list of annotation classes"""
+        return list(map(self.classify, strings))
+
+    def cache_info(self):
+        """Get the hit/miss statistics of the memo"""
+        return self.classify.cache_info()
+
+    def cache_clear(self):
+        """Clear the memo"""
+        self.classify.cache_clear()
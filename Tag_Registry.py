@@ -0,0 +1,126 @@
+import os
+import json
+from functools import lru_cache
+from xml.sax.saxutils import quoteattr
+from Tag_Classifier import TagClassifier
+
+"""
+Data driven registry of the P&ID tag classes.
+A rule set file defines each class's regex patterns, its precedence and its Label Studio
+colour, and the registry builds both the compiled TagClassifier and the Label Studio label
+config from it. Each client's tag conventions live in a file of their own, so switching
+rule sets for a drawing set is a matter of loading a different file.
+
+Rule set format:
+    {
+        "name": "default",
+        "default": {"label": "Text", "background": "gray"},
+        "required_chars": "0123456789",
+        "classes": [
+            {"label": "Valve", "background": "purple", "precedence": 3,
+             "patterns": [{"pattern": "...", "mode": "fullmatch"}]}
+        ]
+    }
+Classes are tried in order of precedence, lowest first, and patterns in the order listed.
+Classes without a precedence come after the rest, in the order listed. Classes without
+patterns only appear in the label config, for labelling by hand. required_chars is the
+prefilter of the classifier, it must be null if any pattern can match without one of them.
+"""
+
+TAG_PATTERNS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tag_patterns.json')
+
+LABEL_CONFIG_TEMPLATE = """
+    <View>
+      <Image name="image" value="$ocr"/>
+      <Labels name="label" toName="image">
+{labels}
+      </Labels>
+      <Rectangle name="bbox" toName="image" strokeWidth="3"/>
+      <Polygon name="poly" toName="image" strokeWidth="3"/>
+      <TextArea name="transcription" toName="image"
+                editable="true"
+                perRegion="true"
+                required="true"
+                maxSubmissions="1"
+                rows="5"
+                placeholder="Recognized Text"
+                displayMode="region-list"
+                />
+    </View>
+    """
+
+
+class TagRegistry:
+    """Tag classes, their patterns and colours, loaded from a rule set"""
+
+    def __init__(self, config):
+        """
+        :param config: rule set dictionary, see the module docstring"""
+        self.config = config
+        self.name = config.get('name', '')
+        self.default = config.get('default', {'label': 'Text', 'background': 'gray'})
+        self.classes = list(config.get('classes', []))
+        required_chars = config.get('required_chars', '0123456789')
+
+        # stable sort, so classes of equal precedence keep the order they are listed in
+        ordered = sorted(self.classes, key=lambda c: c.get('precedence', float('inf')))
+        self.rules = [(c['label'], p['pattern'], p.get('mode', 'fullmatch'))
+                      for c in ordered for p in c.get('patterns', [])]
+        self.classifier = TagClassifier(self.rules, default=self.default['label'], required_chars=required_chars)
+        self.signature = self.classifier.signature
+
+    @classmethod
+    def from_file(cls, file=TAG_PATTERNS_FILE):
+        """Load a rule set file
+        :param file: json filepath
+        :return: TagRegistry"""
+        with open(file, 'r') as f:
+            return cls(json.load(f))
+
+    def __repr__(self):
+        return f'TagRegistry(name={self.name!r}, classes={len(self.classes)}, rules={len(self.rules)})'
+
+    @property
+    def labels(self):
+        """List of (label, background) of every class, the default class last"""
+        return [(c['label'], c.get('background', 'gray')) for c in self.classes] + \
+               [(self.default['label'], self.default.get('background', 'gray'))]
+
+    def classify(self, string):
+        """Get the annotation class for a given string
+        :param string: string to get annotation class for
+        :return: annotation class"""
+        return self.classifier.classify(string)
+
+    def reclassify(self, strings, previous=None):
+        """Classify tag strings in bulk, e.g. the texts of a previous run under a new rule set
+        Each distinct string is classified once.
+        :param strings: list of strings
+        :param previous: list of the classes the strings had before, to find what changed
+        :return: list of classes, and the indices whose class changed if previous is given"""
+        table = {string: self.classifier.classify(string) for string in set(strings)}
+        classes = [table[string] for string in strings]
+        if previous is None:
+            return classes, None
+        changed = [i for i, (new, old) in enumerate(zip(classes, previous)) if new != old]
+        return classes, changed
+
+    def label_config(self):
+        """Build the Label Studio label config for the classes
+        :return: label config XML"""
+        labels = '\n'.join(f'        <Label value={quoteattr(label)} background={quoteattr(background)}/>'
+                           for label, background in self.labels)
+        return LABEL_CONFIG_TEMPLATE.format(labels=labels)
+
+
+@lru_cache(maxsize=16)
+def _load_registry(file, mtime):
+    return TagRegistry.from_file(file)
+
+
+def get_registry(file=TAG_PATTERNS_FILE):
+    """Get the registry of a rule set file, loaded once and again only when the file changes
+    :param file: json filepath
+    :return: TagRegistry"""
+    file = os.path.abspath(file)
+    return _load_registry(file, os.path.getmtime(file))
@@ -1,62 +1,250 @@
 import pytesseract
-import pandas as pd
+import numpy as np
 import cv2
 import os
+import queue
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from OCR_Cache import ocr_cache, hash_image
+from OCR_Result import OCRResult
+from OCR_Render import render_result
+
+# tesserocr wraps the Tesseract C API, it is optional and
+# the pytesseract subprocess is used when it isn't installed
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 # pytesseract requires Tesseract to be installed
 # this is the default location for Tesseract-OCR
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-def convert_df_to_boundingbox_dict(df):
+# engine mode: 'tesserocr' keeps long-lived Tesseract instances in memory,
+# 'pytesseract' runs the tesseract binary for every image, 'auto' picks tesserocr if it is installed
+TESSERACT_MODE = 'auto'
+TESSERACT_LANG = 'eng'
+# folder with the language data for tesserocr, None uses the tesseract default
+TESSDATA_PATH = None
+TESSERACT_POOL_SIZE = os.cpu_count() or 1
+
+# columns of word boxes, index is the row of the word in the image_to_data output
+WordBoxes = namedtuple('WordBoxes', ['index', 'text', 'x1', 'y1', 'x2', 'y2', 'conf'])
+
+def get_tesseract_mode(mode=None):
+    """
+    Resolve the engine mode
+    :param mode: 'auto', 'tesserocr' or 'pytesseract', defaults to TESSERACT_MODE
+    :return: 'tesserocr' or 'pytesseract'
+    """
+    mode = mode or TESSERACT_MODE
+    if mode == 'auto':
+        return 'tesserocr' if tesserocr is not None else 'pytesseract'
+    if mode == 'tesserocr' and tesserocr is None:
+        raise ImportError('tesserocr is not installed, use mode="pytesseract"')
+    if mode not in ('tesserocr', 'pytesseract'):
+        raise ValueError(f'Unknown Tesseract mode {mode}')
+    return mode
+
+@lru_cache(maxsize=None)
+def get_tesseract_version(mode=None):
+    """
+    Get the version of Tesseract, the binary is only called once
+    :param mode: engine mode, see get_tesseract_mode
+    :return: version string
+    """
+    if get_tesseract_mode(mode) == 'tesserocr':
+        return tesserocr.tesseract_version().splitlines()[0]
+    return str(pytesseract.get_tesseract_version())
+
+class TesseractPool:
+    """
+    Pool of long-lived Tesseract API instances
+    Each instance loads the language data once and is reused for every image,
+    tesserocr releases the GIL while recognising so instances can run in parallel threads.
+    """
+
+    def __init__(self, size=TESSERACT_POOL_SIZE, lang=TESSERACT_LANG, path=TESSDATA_PATH):
+        """
+        :param size: maximum number of Tesseract instances
+        :param lang: Tesseract language
+        :param path: folder with the language data, None uses the tesseract default
+        """
+        self.size = size
+        self.lang = lang
+        self.path = path
+        self._apis = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        kwargs = {'lang': self.lang}
+        if self.path is not None:
+            kwargs['path'] = self.path
+        return tesserocr.PyTessBaseAPI(**kwargs)
+
+    def _acquire(self):
+        try:
+            return self._apis.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return self._create()
+        return self._apis.get()
+
+    def preload(self, n=1):
+        """
+        Create Tesseract instances up front so the first images don't pay for loading the language data
+        :param n: number of instances to create
+        """
+        apis = [self._acquire() for _ in range(min(n, self.size))]
+        for api in apis:
+            self._apis.put(api)
+
+    def image_to_data(self, image):
+        """
+        Recognise the words in an image, in the same format as pytesseract.image_to_data
+        :param image: numpy image, BGR or greyscale
+        :return: dictionary of lists with 'text', 'left', 'top', 'width', 'height' and 'conf' keys
+        """
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # tobytes packs the rows of a strided view, so describe the packed buffer
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        data = {'level': [], 'left': [], 'top': [], 'width': [], 'height': [], 'conf': [], 'text': []}
+        level = tesserocr.RIL.WORD
+        api = self._acquire()
+        try:
+            # hand the numpy buffer straight to Tesseract, no temporary file
+            api.SetImageBytes(image.tobytes(), width, height, 1, width)
+            api.Recognize()
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                bbox = word.BoundingBox(level)
+                if bbox is None:
+                    continue
+                x1, y1, x2, y2 = bbox
+                data['level'].append(5)
+                data['left'].append(x1)
+                data['top'].append(y1)
+                data['width'].append(x2 - x1)
+                data['height'].append(y2 - y1)
+                data['conf'].append(word.Confidence(level))
+                data['text'].append(word.GetUTF8Text(level))
+        finally:
+            api.Clear()
+            self._apis.put(api)
+        return data
+
+    def close(self):
+        """
+        End every idle Tesseract instance
+        """
+        while True:
+            try:
+                api = self._apis.get_nowait()
+            except queue.Empty:
+                break
+            api.End()
+            with self._lock:
+                self._created -= 1
+
+@lru_cache(maxsize=None)
+def get_tesseract_pool():
+    """
+    Get the shared pool of Tesseract instances
+    :return: TesseractPool
+    """
+    return TesseractPool()
+
+def load_tesseract(mode=None):
+    """
+    Prepare the engine, the first Tesseract instance is created up front in tesserocr mode
+    :param mode: engine mode, see get_tesseract_mode
+    :return: version string
     """
-    Convert dataframe to dictionary of words and their coordinates
-    :param df:
+    if get_tesseract_mode(mode) == 'tesserocr':
+        get_tesseract_pool().preload()
+    return get_tesseract_version(mode)
+
+def image_to_data(image, mode=None):
+    """
+    Get the word boxes of an image
+    :param image: numpy image
+    :param mode: engine mode, see get_tesseract_mode
+    :return: dictionary of lists in the pytesseract.image_to_data format
+    """
+    if get_tesseract_mode(mode) == 'tesserocr':
+        return get_tesseract_pool().image_to_data(image)
+    return pytesseract.image_to_data(image, lang=TESSERACT_LANG, output_type=pytesseract.Output.DICT)
+
+def convert_data_to_boxes(data):
+    """
+    Convert image_to_data output to columns of word boxes with vectorised column arithmetic
+    Rows with no confidence or no text are removed
+    :param data: dictionary of lists from image_to_data
+    :return: WordBoxes of numpy arrays
+    """
+    conf = np.asarray(data['conf'], dtype=np.float32)
+    text = np.asarray(data['text'], dtype=object)
+    mask = (conf != -1) & (np.char.strip(text.astype(str)) != '')
+    left = np.asarray(data['left'], dtype=np.int32)[mask]
+    top = np.asarray(data['top'], dtype=np.int32)[mask]
+    width = np.asarray(data['width'], dtype=np.int32)[mask]
+    height = np.asarray(data['height'], dtype=np.int32)[mask]
+    return WordBoxes(index=np.flatnonzero(mask), text=text[mask], x1=left, y1=top,
+                     x2=left + width, y2=top + height, conf=conf[mask])
+
+def convert_boxes_to_boundingbox_dict(boxes):
+    """
+    Convert columns of word boxes to a dictionary of words and their coordinates
+    :param boxes: WordBoxes
     :return: dictionary of words and their coordinates
     """
-    # create dictionary of words and their coordinates
-    boundingbox_dict = {}
-    for index, row in df.iterrows():
-        text = row['text']
-        x1, y1, x2, y2 = row['left'], row['top'], row['left'] + row['width'], row['top'] + row['height']
-        boundingbox_dict[index] = {'text': text, 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
-    return boundingbox_dict
-
-def annotate_image_with_boundingboxes(image, boundingbox_dict, with_text=False):
-    """
-    Annotate an image with bounding boxes
-    :param image:
-    :param boundingbox_dict:
-    :param with_text:
-    :return: annotated image
-    """
-    for key, value in boundingbox_dict.items():
-        text = value['text']
-        pt1 = (value['x1'], value['y1'])
-        pt2 = (value['x2'], value['y2'])
-        cv2.rectangle(img=image, pt1=pt1, pt2=pt2, color=(0, 0, 255), thickness=3)
-        if with_text:
-            cv2.putText(image, text, pt2, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-    return image
-
-def process_single_file(file):
-    # Read image
-    image = cv2.imread(file)
-    # get wordblocks from image
-    boxes = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-    #convert to dataframe
-    df = pd.DataFrame(boxes)
-    # remove rows with no text and text is trimmed
-    df = df[(df['conf'] != -1) & (df['text'].str.strip() != '')]
-    # convert to dictionary
-    boundingbox_dict = convert_df_to_boundingbox_dict(df)
-    # annotate image with bounding boxes
-    image2 = annotate_image_with_boundingboxes(image, boundingbox_dict)
+    columns = zip(boxes.index.tolist(), boxes.text.tolist(), boxes.x1.tolist(), boxes.y1.tolist(),
+                  boxes.x2.tolist(), boxes.y2.tolist())
+    return {index: {'text': text, 'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
+            for index, text, x1, y1, x2, y2 in columns}
+
+def convert_boxes_to_result(boxes):
+    """
+    Convert columns of word boxes to an OCRResult
+    :param boxes: WordBoxes
+    :return: OCRResult keyed by the row of each word in the image_to_data output
+    """
+    return OCRResult.from_columns(boxes.text.tolist(), boxes.x1, boxes.y1, boxes.x2, boxes.y2,
+                                  conf=boxes.conf, keys=boxes.index, engine='tesseract')
+
+def process_single_file(file, cache=ocr_cache, image=None, mode=None, render=True):
+    # Read image, unless the caller has already decoded it
+    if image is None:
+        image = cv2.imread(file)
+    # check the cache for a result for this image
+    result = None
+    if cache is not None:
+        mode = get_tesseract_mode(mode)
+        key = cache.make_key(hash_image(image), 'tesseract', get_tesseract_version(mode), {'mode': mode})
+        result = cache.get(key)
+    if result is None:
+        # get wordblocks from image
+        data = image_to_data(image, mode)
+        # convert to columns, removing rows with no text
+        boxes = convert_data_to_boxes(data)
+        # convert to an OCRResult
+        result = convert_boxes_to_result(boxes)
+        if cache is not None:
+            cache.put(key, result)
     # path handling
     dir, filename = os.path.split(file)
     fname, ext = os.path.splitext(filename)
     outfile = fname + '_Tesseract.png'
     outfile = os.path.join('Results', outfile)
-    # save image
-    cv2.imwrite(outfile, image2)
-    return boundingbox_dict, image2
+    # annotate a copy of the image with bounding boxes and save it, unless rendering is off
+    image2 = render_result(image, result, outfile, color=(0, 0, 255), thickness=3, render=render)
+    return result, image2
 
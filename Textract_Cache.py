@@ -0,0 +1,371 @@
+import os
+import json
+import uuid
+import argparse
+import numpy as np
+
+"""
+Compact binary cache of Textract responses.
+Only the fields the project uses are kept - Id, BlockType, Text, TextType, Confidence, Page,
+BoundingBox and Relationships - in typed arrays, and the polygons and response metadata are dropped.
+A .tbc file is a small JSON header followed by the arrays, each aligned to 64 bytes, so the
+file is memory mapped and the arrays are views of it rather than parsed.
+
+Layout:
+    b'TBC1' | uint32 header length | JSON header | arrays
+Texts are one UTF-8 blob with offsets, Ids are 16 byte UUIDs, and relationships are stored
+as offsets into relationship groups, each group a type and a run of target block indices.
+The header records the hash of the image the response was made from, see OCR_Cache.hash_image,
+and a saved JSON response keeps it as ImageHash, so a response made from different pixels is not reused.
+
+Migrate existing responses with:
+    python Textract_Cache.py Data/*.json --stamp-images
+where --stamp-images records the hash of the png next to each response, vouching they still match.
+"""
+
+MAGIC = b'TBC1'
+ALIGNMENT = 64
+CACHE_EXT = '.tbc'
+FORMAT_VERSION = 1
+
+# bits of the flags array, for fields that are not on every block
+HAS_TEXT = 1
+HAS_CONFIDENCE = 2
+HAS_PAGE = 4
+HAS_GEOMETRY = 8
+
+BOUNDINGBOX_FIELDS = ('Left', 'Top', 'Width', 'Height')
+
+
+class TextractBlocks:
+    """Textract blocks held as typed arrays, one row per block"""
+
+    FIELDS = ('block_type', 'text_type', 'flags', 'confidence', 'page', 'bbox', 'text_offsets', 'text_data',
+              'ids', 'id_offsets', 'id_data', 'rel_offsets', 'rel_types', 'rel_target_offsets', 'rel_targets')
+
+    def __init__(self, arrays, header):
+        """
+        :param arrays: dictionary of field name to array, see FIELDS
+        :param header: dictionary of code tables and response metadata"""
+        self.header = header
+        self.block_types = header['block_types']
+        self.text_types = header['text_types']
+        self.relationship_types = header['relationship_types']
+        for name in self.FIELDS:
+            setattr(self, name, arrays.get(name))
+
+    def __len__(self):
+        return len(self.block_type)
+
+    def __repr__(self):
+        return f'TextractBlocks(blocks={len(self)})'
+
+    @property
+    def image_hash(self):
+        """Hash of the image the response was made from, None if it was not recorded"""
+        return self.header.get('image_hash')
+
+    @classmethod
+    def from_response(cls, response, image_hash=None):
+        """Build from a Textract response or a list of blocks
+        :param response: Textract response dictionary or list of blocks
+        :param image_hash: hash of the image the response was made from, defaults to the response's ImageHash
+        :return: TextractBlocks"""
+        blocks = response['Blocks'] if isinstance(response, dict) else response
+        n = len(blocks)
+        block_types, text_types, relationship_types = {}, {'': 0}, {}
+        block_type = np.empty(n, dtype=np.uint8)
+        text_type = np.zeros(n, dtype=np.uint8)
+        flags = np.zeros(n, dtype=np.uint8)
+        confidence = np.zeros(n, dtype=np.float32)
+        page = np.zeros(n, dtype=np.uint32)
+        bbox = np.zeros((n, 4), dtype=np.float64)
+        texts, ids = [], []
+        for i, block in enumerate(blocks):
+            block_type[i] = block_types.setdefault(block['BlockType'], len(block_types))
+            if 'TextType' in block:
+                text_type[i] = text_types.setdefault(block['TextType'], len(text_types))
+            if 'Text' in block:
+                flags[i] |= HAS_TEXT
+            if 'Confidence' in block:
+                flags[i] |= HAS_CONFIDENCE
+                confidence[i] = block['Confidence']
+            if 'Page' in block:
+                flags[i] |= HAS_PAGE
+                page[i] = block['Page']
+            if 'Geometry' in block:
+                flags[i] |= HAS_GEOMETRY
+                boundingbox = block['Geometry']['BoundingBox']
+                bbox[i] = [boundingbox[k] for k in BOUNDINGBOX_FIELDS]
+            texts.append(block.get('Text', '').encode('utf-8'))
+            ids.append(block['Id'])
+        arrays = {
+            'block_type': block_type, 'text_type': text_type, 'flags': flags,
+            'confidence': confidence, 'page': page, 'bbox': bbox,
+        }
+        arrays['text_offsets'], arrays['text_data'] = pack_strings(texts)
+
+        # Textract Ids are UUIDs, anything else is kept as text
+        try:
+            arrays['ids'] = np.frombuffer(b''.join(uuid.UUID(i).bytes for i in ids), dtype=np.uint8).reshape(n, 16)
+            if any(str(uuid.UUID(i)) != i for i in ids):
+                raise ValueError
+        except ValueError:
+            arrays.pop('ids', None)
+            arrays['id_offsets'], arrays['id_data'] = pack_strings([i.encode('utf-8') for i in ids])
+
+        # relationships as offsets into groups of target block indices
+        index = {block_id: i for i, block_id in enumerate(ids)}
+        rel_offsets, rel_types, rel_target_offsets, rel_targets = [0], [], [0], []
+        for block in blocks:
+            for group in block.get('Relationships', []):
+                rel_types.append(relationship_types.setdefault(group['Type'], len(relationship_types)))
+                rel_targets.extend(index[i] for i in group['Ids'])
+                rel_target_offsets.append(len(rel_targets))
+            rel_offsets.append(len(rel_types))
+        arrays['rel_offsets'] = np.array(rel_offsets, dtype=np.int64)
+        arrays['rel_types'] = np.array(rel_types, dtype=np.uint8)
+        arrays['rel_target_offsets'] = np.array(rel_target_offsets, dtype=np.int64)
+        arrays['rel_targets'] = np.array(rel_targets, dtype=np.int32)
+
+        header = {
+            'version': FORMAT_VERSION,
+            'block_types': list(block_types),
+            'text_types': list(text_types),
+            'relationship_types': list(relationship_types),
+        }
+        if isinstance(response, dict):
+            for key in ('DocumentMetadata', 'DetectDocumentTextModelVersion'):
+                if key in response:
+                    header[key] = response[key]
+            image_hash = image_hash or response.get('ImageHash')
+        if image_hash:
+            header['image_hash'] = image_hash
+        return cls(arrays, header)
+
+    def save(self, file):
+        """Write to a .tbc file, via a temporary file so readers never see a partial file
+        :param file: filepath"""
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in self.FIELDS
+                  if getattr(self, name) is not None}
+        header = dict(self.header, arrays={})
+        offset = 0
+        for name, array in arrays.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += array.nbytes
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        # the arrays start on an aligned boundary after the header
+        start = -(-(len(MAGIC) + 4 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+        header_bytes = header_bytes.ljust(start - len(MAGIC) - 4)
+
+        tmp = file + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint32(len(header_bytes)).tobytes())
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(start + header['arrays'][name]['offset'])
+                f.write(array.tobytes())
+        os.replace(tmp, file)
+
+    @classmethod
+    def load(cls, file):
+        """Memory map a .tbc file, the arrays are read-only views of the file
+        :param file: filepath
+        :return: TextractBlocks"""
+        raw = np.memmap(file, dtype=np.uint8, mode='r')
+        if raw[:4].tobytes() != MAGIC:
+            raise ValueError(f'{file} is not a Textract block cache')
+        length = int(raw[4:8].view(np.uint32)[0])
+        header = json.loads(raw[8:8 + length].tobytes())
+        start = 8 + length
+        arrays = {}
+        for name, spec in header.pop('arrays').items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            begin = start + spec['offset']
+            arrays[name] = raw[begin:begin + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+        return cls(arrays, header)
+
+    def get_text(self, i):
+        """Text of a block
+        :param i: block index
+        :return: string, empty if the block has none"""
+        return self.text_data[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode('utf-8')
+
+    def get_id(self, i):
+        """Textract Id of a block
+        :param i: block index
+        :return: Id string"""
+        if self.ids is not None:
+            return str(uuid.UUID(bytes=self.ids[i].tobytes()))
+        return self.id_data[self.id_offsets[i]:self.id_offsets[i + 1]].tobytes().decode('utf-8')
+
+    def mask(self, block_type):
+        """Boolean mask of the blocks of a type
+        :param block_type: e.g. 'WORD'
+        :return: boolean array"""
+        if block_type not in self.block_types:
+            return np.zeros(len(self), dtype=bool)
+        return self.block_type == self.block_types.index(block_type)
+
+    def to_blocks(self, block_type=None):
+        """Rebuild Textract block dictionaries, without the polygons
+        :param block_type: only rebuild blocks of this type, e.g. 'WORD', None for all
+        :return: list of blocks"""
+        ids = [self.get_id(i) for i in range(len(self))]
+        block_types, text_types, relationship_types = self.block_types, self.text_types, self.relationship_types
+        text_offsets, text_data = self.text_offsets.tolist(), self.text_data.tobytes()
+        rel_offsets, rel_types = self.rel_offsets.tolist(), self.rel_types.tolist()
+        rel_target_offsets, rel_targets = self.rel_target_offsets.tolist(), self.rel_targets.tolist()
+        rows = zip(self.block_type.tolist(), self.text_type.tolist(), self.flags.tolist(),
+                   self.confidence.tolist(), self.page.tolist(), self.bbox.tolist())
+        wanted = None if block_type is None else block_types.index(block_type) if block_type in block_types else -1
+
+        blocks = []
+        for i, (bt, tt, flags, confidence, page, bbox) in enumerate(rows):
+            if wanted is not None and bt != wanted:
+                continue
+            block = {'BlockType': block_types[bt]}
+            if flags & HAS_CONFIDENCE:
+                block['Confidence'] = confidence
+            if flags & HAS_TEXT:
+                block['Text'] = text_data[text_offsets[i]:text_offsets[i + 1]].decode('utf-8')
+            if tt:
+                block['TextType'] = text_types[tt]
+            if flags & HAS_GEOMETRY:
+                block['Geometry'] = {'BoundingBox': dict(zip(BOUNDINGBOX_FIELDS, bbox))}
+            block['Id'] = ids[i]
+            if rel_offsets[i] != rel_offsets[i + 1]:
+                block['Relationships'] = [
+                    {'Type': relationship_types[rel_types[g]],
+                     'Ids': [ids[t] for t in rel_targets[rel_target_offsets[g]:rel_target_offsets[g + 1]]]}
+                    for g in range(rel_offsets[i], rel_offsets[i + 1])]
+            if flags & HAS_PAGE:
+                block['Page'] = page
+            blocks.append(block)
+        return blocks
+
+    def to_response(self):
+        """Rebuild a Textract response with the blocks and the saved metadata
+        :return: response dictionary"""
+        response = {key: value for key, value in self.header.items()
+                    if key in ('DocumentMetadata', 'DetectDocumentTextModelVersion')}
+        if self.image_hash:
+            response['ImageHash'] = self.image_hash
+        response['Blocks'] = self.to_blocks()
+        return response
+
+
+def pack_strings(strings):
+    """Pack encoded strings into offsets and a byte blob
+    :param strings: list of bytes
+    :return: int64 offsets array and uint8 data array"""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in strings])
+    return offsets, np.frombuffer(b''.join(strings), dtype=np.uint8)
+
+
+def get_cache_file(file):
+    """Get the .tbc file that goes with an image or Textract JSON file
+    :param file: filepath
+    :return: .tbc filepath"""
+    return os.path.splitext(file)[0] + CACHE_EXT
+
+
+def load_textract_blocks(file, image_hash=None):
+    """Load the Textract blocks for an image or response file, preferring the binary cache
+    A JSON response without a cache is converted on the way, so the next load is fast.
+    :param file: image, .json or .tbc filepath
+    :param image_hash: hash of the decoded image, see OCR_Cache.hash_image, a saved response made from a
+    different image is not returned. A response saved without a hash, such as the bundled Data responses,
+    is returned with a warning. None skips the check, e.g. to replay responses
+    :return: TextractBlocks, or None if there is no saved response for the image"""
+    cache_file = get_cache_file(file)
+    json_file = os.path.splitext(file)[0] + '.json'
+    if os.path.exists(cache_file):
+        blocks = TextractBlocks.load(cache_file)
+    elif os.path.exists(json_file):
+        with open(json_file, 'r') as f:
+            blocks = TextractBlocks.from_response(json.load(f))
+        try:
+            blocks.save(cache_file)
+        except OSError:
+            pass
+    else:
+        return None
+    if image_hash is not None and blocks.image_hash is None:
+        print(f'The saved Textract response for {file} has no image hash, assuming it matches the image, '
+              f'run Textract_Cache.py --stamp-images to record it')
+    elif image_hash is not None and blocks.image_hash != image_hash:
+        # made from an older version of the drawing
+        return None
+    return blocks
+
+
+def get_image_hash(file):
+    """Hash the png next to a response file, as it decodes for the OCR engines
+    :param file: filepath
+    :return: hex digest, or None if there is no png"""
+    import cv2
+    from OCR_Cache import hash_image
+    image = cv2.imread(os.path.splitext(file)[0] + '.png')
+    return hash_image(image) if image is not None else None
+
+
+def migrate(files, remove=False, verify=True, stamp_images=False):
+    """Convert saved Textract JSON responses to .tbc files
+    :param files: list of .json filepaths
+    :param remove: whether to delete each JSON file once converted
+    :param verify: whether to check the converted blocks match the JSON, ignoring the polygons
+    :param stamp_images: whether to record the hash of the png next to each response, for
+    responses saved before the hash was, which are otherwise not reused for the image
+    :return: total JSON and .tbc sizes in bytes"""
+    json_bytes, cache_bytes = 0, 0
+    for file in files:
+        with open(file, 'r') as f:
+            response = json.load(f)
+        cache_file = get_cache_file(file)
+        image_hash = get_image_hash(file) if stamp_images else None
+        TextractBlocks.from_response(response, image_hash=image_hash).save(cache_file)
+        if verify:
+            expected = [strip_block(block) for block in response['Blocks']]
+            if TextractBlocks.load(cache_file).to_blocks() != expected:
+                raise ValueError(f'{cache_file} does not match {file}')
+        size, cache_size = os.path.getsize(file), os.path.getsize(cache_file)
+        json_bytes += size
+        cache_bytes += cache_size
+        print(f'{file}: {size / 1024:.0f} KB -> {cache_size / 1024:.0f} KB')
+        if remove:
+            os.remove(file)
+    return json_bytes, cache_bytes
+
+
+def strip_block(block):
+    """Drop the fields of a block that the cache does not keep
+    :param block: Textract block
+    :return: block with the same fields as TextractBlocks.to_blocks"""
+    block = {key: value for key, value in block.items()
+             if key in ('BlockType', 'Confidence', 'Text', 'TextType', 'Geometry', 'Id', 'Relationships', 'Page')}
+    if 'Geometry' in block:
+        block['Geometry'] = {'BoundingBox': {k: block['Geometry']['BoundingBox'][k] for k in BOUNDINGBOX_FIELDS}}
+    return block
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert saved Textract JSON responses to compact .tbc files')
+    parser.add_argument('files', nargs='+', help='Textract response .json files')
+    parser.add_argument('--remove', action='store_true', help='delete each JSON file once converted')
+    parser.add_argument('--no-verify', action='store_true', help='skip checking the converted blocks')
+    parser.add_argument('--stamp-images', action='store_true',
+                        help='record the hash of the png next to each response, so it is reused for that image')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    json_bytes, cache_bytes = migrate(args.files, remove=args.remove, verify=not args.no_verify,
+                                      stamp_images=args.stamp_images)
+    if cache_bytes:
+        print(f'Total: {json_bytes / 1024:.0f} KB -> {cache_bytes / 1024:.0f} KB ({json_bytes / cache_bytes:.1f}x smaller)')
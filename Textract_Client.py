@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+
+"""
+Shared plumbing for calling Textract from many threads at once.
+A token bucket keeps the request rate under the account's Textract TPS quota and throttled
+requests are retried with exponential backoff and full jitter. The boto3 client is created
+with a connection pool big enough for the number of concurrent requests, and can be pointed
+at a local stand-in of the Textract endpoint for offline testing.
+"""
+
+# default Textract quotas are per region and per API, check the Service Quotas console
+TEXTRACT_TPS = 5.0
+MAX_CONCURRENCY = 4
+MAX_POOL_CONNECTIONS = 10
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+RETRYABLE_ERRORS = {
+    'ThrottlingException',
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+    'InternalServerError',
+    'ServiceUnavailable',
+}
+
+
+class TokenBucket:
+    """Thread safe token bucket rate limiter"""
+
+    def __init__(self, rate=TEXTRACT_TPS, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum burst size, defaults to one second of tokens
+        :param clock: monotonic clock, replaceable for testing
+        :param sleep: sleep function, replaceable for testing"""
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        """Take tokens from the bucket, waiting until enough are available
+        :param tokens: number of tokens to take"""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def create_client(service='textract', region_name=None, aws_access_key_id=None, aws_secret_access_key=None,
+                  max_pool_connections=MAX_POOL_CONNECTIONS, endpoint_url=None):
+    """Create a boto3 client with a connection pool sized for concurrent requests
+    botocore's own retries are turned off, call_with_backoff retries instead
+    :param service: AWS service name
+    :param region_name: AWS region
+    :param aws_access_key_id: AWS access key id
+    :param aws_secret_access_key: AWS secret access key
+    :param max_pool_connections: size of the HTTP connection pool
+    :param endpoint_url: alternative endpoint, e.g. a local stand-in for offline testing
+    :return: boto3 client"""
+    import boto3
+    from botocore.config import Config
+    config = Config(max_pool_connections=max_pool_connections, retries={'max_attempts': 1, 'mode': 'standard'})
+    return boto3.client(service, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
+                        region_name=region_name, endpoint_url=endpoint_url, config=config)
+
+
+def get_error_code(error):
+    """Get the AWS error code of an exception
+    :param error: exception raised by a boto3 call
+    :return: error code or None"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+def call_with_backoff(func, *args, rate_limiter=None, max_retries=MAX_RETRIES, base=BACKOFF_BASE, cap=BACKOFF_MAX,
+                      sleep=time.sleep, **kwargs):
+    """Call an AWS API, retrying throttled calls with exponential backoff and full jitter
+    :param func: boto3 client method
+    :param rate_limiter: TokenBucket taken from before every attempt
+    :param max_retries: number of retries before giving up
+    :param base: first backoff in seconds
+    :param cap: longest backoff in seconds
+    :param sleep: sleep function, replaceable for testing
+    :return: API response"""
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if get_error_code(e) not in RETRYABLE_ERRORS or attempt == max_retries:
+                raise
+            sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
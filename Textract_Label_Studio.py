@@ -1,11 +1,29 @@
 import boto3
 import os
+import io
 import cv2
 import json
 import re
+import hashlib
+import struct
+import copy
+import glob
+import time
+import argparse
+import requests
+from bisect import bisect_right
+from itertools import islice
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from label_studio_sdk import Client
+from Tag_Registry import get_registry, TAG_PATTERNS_FILE
+from Textract_Cache import load_textract_blocks
 from botocore import UNSIGNED
 from botocore.client import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
 
 # I'm afraid I can't share my AWS credentials
 # unfortunately this is required to load the drawing data from S3
@@ -22,6 +40,12 @@ REGION_NAME = 'eu-west-1'
 
 # bucket for label studio images
 bucket = 'label-studio-imgs'
+# point S3 at a local stand-in such as MinIO or a moto server for testing
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+# uploads, large images are sent as concurrent multipart chunks
+UPLOAD_WORKERS = 8
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=4)
 
 # label studio url and api key - the api key is unique for each user
 # you can retireve it when you run label studio locally
@@ -29,52 +53,130 @@ bucket = 'label-studio-imgs'
 LABEL_STUDIO_URL = 'http://localhost:8080'
 API_KEY = ''
 
+# bulk import settings
+PROJECT_TITLE = 'Example Project'
+IMAGE_PREFIX = 'Example_Images/'
+IMPORT_CHUNK_SIZE = 100
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
 
-# regex patterns
-REDUCER_REGEX = r'[0-9]{1,2}\"x[0-9]{1,2}\"'
-VALVE_REGEX = r'(PV|PSV|BV|LV|SDSV|SDV|XV|ESV)-?[0-9]{4,5}'
-LINE_REGEX = r'[0-9./]{1,5}\"-[a-zA-Z]{1,2}-[0-9]{3,5}'
-LINE_REGEX2 = r'[a-zA-Z]{1,2}-[0-9]{3,5}-[0-9a-zA-Z]{3,6}'
-LINE_REGEX3 = r'[0-9./]{1,5}\"-?[0-9a-zA-Z]{1,2}-?[0-9]{3,5}-?[a-z-A-Z0-9]{0,4}'
-INSTRUMENT_REGEX = r'[a-zA-Z]{0,2}[\/]?[a-zA-Z]{2,3}-?[0-9]{4,5}-?[0-9]{0,2}[\/0-9]{0,2}'
-VESSEL_PUMP_REGEX = r'[a-zA-Z]{1}-?[0-9]{4,5}'
 
+# tag classes, their patterns, precedence and colours come from a rule set file, see Tag_Registry
+tag_registry = get_registry()
+tag_classifier = tag_registry.classifier
+
+def set_rule_set(file=TAG_PATTERNS_FILE):
+    """Switch the tag rule set, e.g. to another client's tag conventions
+    :param file: rule set json file
+    :return: TagRegistry"""
+    global tag_registry, tag_classifier
+    tag_registry = get_registry(file)
+    tag_classifier = tag_registry.classifier
+    return tag_registry
+
+@lru_cache(maxsize=None)
 def get_s3_client(unsigned=True):
-    """Get a boto3 client for S3
+    """Get a boto3 client for S3, created once and shared between threads
     :param unsigned: If True, the client will be unsigned
     :return: boto3 client"""
     if unsigned:
         conf = Config(signature_version=UNSIGNED)
         s3_cli = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                              region_name=REGION_NAME, config=conf)
+                              region_name=REGION_NAME, endpoint_url=S3_ENDPOINT_URL, config=conf)
     else:
+        conf = Config(max_pool_connections=UPLOAD_WORKERS * TRANSFER_CONFIG.max_concurrency)
         s3_cli = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                              region_name=REGION_NAME)
+                              region_name=REGION_NAME, endpoint_url=S3_ENDPOINT_URL, config=conf)
     return s3_cli
 
+@lru_cache(maxsize=None)
 def get_s3_resource():
     """Get a boto3 resource for S3
     :return: boto3 resource"""
     s3_res = boto3.resource('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                            region_name=REGION_NAME)
+                            region_name=REGION_NAME, endpoint_url=S3_ENDPOINT_URL)
     return s3_res
 
+def is_uploaded(s3_cli, bucket, key, data, sha256):
+    """Check whether an object already holds the same content
+    :param s3_cli: boto3 client
+    :param bucket: bucket name
+    :param key: key name
+    :param data: bytes to be uploaded
+    :param sha256: hex sha256 of the data
+    :return: True if the object matches"""
+    try:
+        head = s3_cli.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return False
+    if head.get('Metadata', {}).get('sha256') == sha256:
+        return True
+    # objects uploaded in one part have the md5 of their content as ETag
+    return head.get('ETag', '').strip('"') == hashlib.md5(data).hexdigest()
+
+def upload_bytes(data, bucket, key, content_type='image/png', s3_cli=None):
+    """Upload bytes to s3 as a public object, skipping it if the object already matches
+    The ACL, content type and content hash go with the upload, and large objects
+    are sent as concurrent multipart chunks.
+    :param data: bytes
+    :param bucket: bucket name
+    :param key: key name
+    :param content_type: content type of the object
+    :param s3_cli: boto3 client, defaults to the shared signed client
+    :return: url of the object and whether it was uploaded"""
+    s3_cli = s3_cli or get_s3_client(unsigned=False)
+    sha256 = hashlib.sha256(data).hexdigest()
+    uploaded = False
+    if not is_uploaded(s3_cli, bucket, key, data, sha256):
+        print(f'Saving {key} to s3')
+        extra_args = {'ACL': 'public-read', 'ContentType': content_type, 'Metadata': {'sha256': sha256}}
+        s3_cli.upload_fileobj(io.BytesIO(data), bucket, key, ExtraArgs=extra_args, Config=TRANSFER_CONFIG)
+        uploaded = True
+    return get_presigned_url(bucket, key), uploaded
+
 def save_to_s3(numpy_image, bucket, key):
     """Save a numpy image to s3
     :param numpy_image: numpy image
     :param bucket: bucket name
     :param key: key name
     :return: url of the saved image"""
-    print(f'Saving {key} to s3')
-    s3_res = get_s3_resource()
     data_serial = cv2.imencode('.png', numpy_image)[1].tobytes()
-    s3_res.Object(bucket, key).put(Body=data_serial, ContentType='image/PNG')
+    url, _ = upload_bytes(data_serial, bucket, key)
+    return url
 
-    object_acl = s3_res.ObjectAcl(bucket, key)
-    response = object_acl.put(ACL='public-read')
-    url = get_presigned_url(bucket, key)
+def upload_file(file, bucket, key):
+    """Upload an image file to s3 as it is, without decoding and re-encoding it
+    :param file: png filepath
+    :param bucket: bucket name
+    :param key: key name
+    :return: url of the saved image"""
+    with open(file, 'rb') as f:
+        data = f.read()
+    url, _ = upload_bytes(data, bucket, key)
     return url
 
+def get_image_key(file, prefix=IMAGE_PREFIX, root=None):
+    """Get the s3 key of an image
+    :param file: png filepath
+    :param prefix: key prefix
+    :param root: folder the key is relative to, None to use the file name only
+    :return: key name"""
+    name = os.path.relpath(file, root).replace(os.sep, '/') if root is not None else os.path.basename(file)
+    return prefix + name
+
+def upload_files(files, bucket, prefix=IMAGE_PREFIX, workers=UPLOAD_WORKERS, root=None):
+    """Upload image files to s3 from a thread pool
+    :param files: list of png filepaths
+    :param bucket: bucket name
+    :param prefix: key prefix, the file name is appended
+    :param workers: number of concurrent uploads
+    :param root: folder the keys are relative to, so files with the same name in different subfolders
+    get their own objects, None to use the file name only
+    :return: dictionary of filepath to url"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3') as pool:
+        urls = pool.map(lambda file: upload_file(file, bucket, get_image_key(file, prefix, root)), files)
+        return dict(zip(files, urls))
+
 def get_presigned_url(bucket, key, expiration=0):
     """Get a presigned url for an s3 object
     :param bucket: bucket name
@@ -87,12 +189,39 @@ def get_presigned_url(bucket, key, expiration=0):
     )
     return url
 
-def connect_to_label_studio():
+def get_image_size(file):
+    """Get the width and height of an image, from the header for png files
+    :param file: image filepath
+    :return: width and height"""
+    with open(file, 'rb') as f:
+        header = f.read(24)
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    image = cv2.imread(file)
+    return image.shape[1], image.shape[0]
+
+def create_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES):
+    """Create an HTTP session that keeps its connections open between requests
+    :param pool_size: number of pooled connections
+    :param retries: number of retries of failed connections and 5xx responses
+    :return: requests Session"""
+    session = requests.Session()
+    # only idempotent requests are retried, so an import is never sent twice
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def connect_to_label_studio(url=LABEL_STUDIO_URL, api_key=API_KEY, session=None):
     """Connect to the Label Studio API
+    :param url: Label Studio url, e.g. a local mock of the API for testing
+    :param api_key: Label Studio API key
+    :param session: requests Session shared by every request, defaults to a pooled session
     :return: Label Studio Client
     """
     # Connect to the Label Studio API and check the connection
-    ls = Client(url=LABEL_STUDIO_URL, api_key=API_KEY)
+    ls = Client(url=url, api_key=api_key, session=session or create_session())
     ls.check_connection()
     return ls
 
@@ -104,37 +233,31 @@ def create_project(ls, label_config, title='Test Project'):
     project = ls.start_project(label_config=label_config, title=title)
     return project
 
+def find_project(ls, title):
+    """Find a project in Label Studio by title
+    :param ls: Label Studio Client
+    :param title: Project title
+    :return: the first project with the title, or None"""
+    for project in ls.list_projects():
+        if project.params.get('title') == title:
+            return project
+    return None
+
+def get_or_create_project(ls, label_config, title=PROJECT_TITLE):
+    """Reuse the project with a title, creating it if there isn't one
+    :param ls: Label Studio Client
+    :param label_config: Label Studio label config, used if the project is created
+    :param title: Project title
+    :return: Label Studio Project"""
+    project = find_project(ls, title)
+    if project is None:
+        project = create_project(ls, label_config, title=title)
+    return project
+
 def create_label_config():
-    """Create a Label Studio label config
+    """Create a Label Studio label config with a label for each tag class of the rule set
     :return: Label Studio label config"""
-    label_config = """
-    <View>
-      <Image name="image" value="$ocr"/>
-      <Labels name="label" toName="image">
-        <Label value="Line Number" background="green"/>
-        <Label value="Reducer" background="blue"/>
-        <Label value="Valve" background="purple"/>
-        <Label value="Vessel/Pump" background="red"/>
-        <Label value="Instrument" background="yellow"/>
-        <Label value="Drawing Number" background="pink"/>
-        <Label value="Drawing Rev" background="orange"/>
-
-        <Label value="Text" background="gray"/>
-      </Labels>
-      <Rectangle name="bbox" toName="image" strokeWidth="3"/>
-      <Polygon name="poly" toName="image" strokeWidth="3"/>
-      <TextArea name="transcription" toName="image"
-                editable="true"
-                perRegion="true"
-                required="true"
-                maxSubmissions="1"
-                rows="5"
-                placeholder="Recognized Text"
-                displayMode="region-list"
-                />
-    </View>
-    """
-    return label_config
+    return tag_registry.label_config()
 
 def get_label_studio_boundingbox_from_block(idx, block, closest_block, height, width):
     """Get a Label Studio bounding box from a Textract block
@@ -235,11 +358,97 @@ def filter_blocks_by_regex(blocks, regex):
                 filtered_blocks.append(block)
     return filtered_blocks
 
-def find_block_vertically_below(block, blocks):
+class BlockIndex:
+    """Spatial index of Textract blocks for finding the block vertically below another.
+
+    Blocks are bucketed into fixed-width columns by their horizontal centre and each
+    column is sorted by Top, so a lookup only bisects the few columns that overlap
+    the search window instead of scanning every block on the page.
+    """
+
+    def __init__(self, blocks, columns=64):
+        """Build the index once per page
+        :param blocks: Textract blocks
+        :param columns: number of column buckets"""
+        entries = []
+        for order, blk in enumerate(blocks):
+            bx0 = blk['Geometry']['BoundingBox']['Left']
+            bx1 = bx0 + blk['Geometry']['BoundingBox']['Width']
+            block_center = bx0 + (abs(bx0 - bx1) / 2)
+            entries.append((blk['Geometry']['BoundingBox']['Top'], order, block_center, blk))
+
+        self.columns = max(1, columns)
+        if entries:
+            self.x_min = min(e[2] for e in entries)
+            x_max = max(e[2] for e in entries)
+        else:
+            self.x_min, x_max = 0.0, 0.0
+        self.column_width = (x_max - self.x_min) / self.columns or 1.0
+
+        buckets = [[] for _ in range(self.columns)]
+        for entry in entries:
+            buckets[self._column(entry[2])].append(entry)
+        for bucket in buckets:
+            bucket.sort(key=lambda e: (e[0], e[1]))
+        self.buckets = buckets
+        self.tops = [[e[0] for e in bucket] for bucket in buckets]
+
+    def _column(self, x):
+        """Get the column bucket for a horizontal position, clamped to the index"""
+        col = int((x - self.x_min) / self.column_width)
+        return min(max(col, 0), self.columns - 1)
+
+    def find_below(self, block):
+        """Find the block vertically below the given block.
+        Gives the same result as scanning every block with find_block_vertically_below.
+        :param block: Textract block
+        :return: Textract block that is vertically below the given block"""
+        x0, y0, x1, y1 = block['Geometry']['BoundingBox']['Left'], block['Geometry']['BoundingBox']['Top'], \
+                            block['Geometry']['BoundingBox']['Left'] + block['Geometry']['BoundingBox']['Width'], \
+                            block['Geometry']['BoundingBox']['Top'] + block['Geometry']['BoundingBox']['Height']
+        bbox_height = abs(y1 - y0)
+        bbox_width = abs(x1 - x0)
+        y_center = y0 + (bbox_height / 2)
+
+        # same column window as the linear search
+        a = x0 - bbox_width * 0.3
+        b = x1 + bbox_width * 0.3
+        lo, hi = min(a, b), max(a, b)
+        # any block whose Top is further than 1.5 heights below the centre is rejected
+        # by the distance check, so the search never needs to look past 2 heights
+        y_limit = y_center + bbox_height * 2
+
+        best = None
+        for col in range(self._column(lo), self._column(hi) + 1):
+            tops = self.tops[col]
+            bucket = self.buckets[col]
+            for j in range(bisect_right(tops, y0), bisect_right(tops, y_limit)):
+                top, order, block_center, blk = bucket[j]
+                if not lo < block_center < hi:
+                    continue
+                key = (abs(top - y_center), order)
+                if best is None or key < best[0]:
+                    best = (key, blk)
+
+        if best is None:
+            return None
+
+        # if the closest annotation is too far away, return None
+        closest_block = best[1]
+        closest_block_y_center = closest_block['Geometry']['BoundingBox']['Top'] + (closest_block['Geometry']['BoundingBox']['Height'] / 2)
+        if abs(y_center - closest_block_y_center) > bbox_height*1.5:
+            return None
+        return closest_block
+
+
+def find_block_vertically_below(block, blocks, index=None):
     """Finds the block that is vertically below the given block.
     :param block: Textract block
     :param blocks: Textract blocks
+    :param index: optional BlockIndex built from blocks, avoids a scan of every block
     :return: Textract block that is vertically below the given block"""
+    if index is not None:
+        return index.find_below(block)
 
     # get block coordinates
     x0, y0, x1, y1 = block['Geometry']['BoundingBox']['Left'], block['Geometry']['BoundingBox']['Top'], \
@@ -294,71 +503,146 @@ def get_annotation_class(string):
     """Get the annotation class for a given string
     :param string: string to get annotation class for
     :return: annotation class"""
-    if re.search(LINE_REGEX, string):
-        return 'Line Number'
-    # elif re.search(LINE_REGEX2, string):
-    #     return 'Line Number'
-    elif re.search(LINE_REGEX3, string):
-        return 'Line Number'
-    elif re.fullmatch(REDUCER_REGEX, string):
-        return 'Reducer'
-    elif re.fullmatch(VALVE_REGEX, string):
-        return 'Valve'
-    elif re.fullmatch(INSTRUMENT_REGEX, string):
-        return 'Instrument'
-    elif re.fullmatch(VESSEL_PUMP_REGEX, string):
-        return 'Vessel/Pump'
-    else:
-        return 'Text'
+    return tag_classifier.classify(string)
 
 def process_texract_json_for_label_studio(file, height, width):
-    """Process a Textract JSON file for Label Studio
-    :param file: Textract JSON file
+    """Process a Textract response file for Label Studio
+    The compact .tbc cache is used if there is one, see Textract_Cache
+    :param file: image, Textract JSON or .tbc file
     :return: Label Studio JSON
     """
-    with open(file, 'r') as f:
-        json_file = json.load(f)
-        blocks = json_file['Blocks']
-        blocks = [block for block in blocks if block['BlockType'] == 'WORD']
-        results = []
-        flagged_blocks = []
-        for i, block in enumerate(blocks):
-            if block in flagged_blocks:
-                continue
-            closest_block = find_block_vertically_below(block, blocks)
-            res, flagged_block = get_label_studio_boundingbox_from_block(idx=i, block=block, closest_block=closest_block,height=height, width=width)
-            if flagged_block is not None:
-                flagged_blocks.append(flagged_block)
-            results.extend(res)
+    textract_blocks = load_textract_blocks(file)
+    if textract_blocks is None:
+        raise FileNotFoundError(f'No Textract response for {file}')
+    blocks = textract_blocks.to_blocks('WORD')
+    index = BlockIndex(blocks)
+    results = []
+    # blocks that have been combined with the block above, tracked by Textract Id
+    flagged_blocks = set()
+    for i, block in enumerate(blocks):
+        if block['Id'] in flagged_blocks:
+            continue
+        closest_block = find_block_vertically_below(block, blocks, index=index)
+        res, flagged_block = get_label_studio_boundingbox_from_block(idx=i, block=block, closest_block=closest_block,height=height, width=width)
+        if flagged_block is not None:
+            flagged_blocks.add(flagged_block['Id'])
+        results.extend(res)
     return results
 
-def process_file(file):
+def load_template(file='ocr_template.json'):
+    """Load the Label Studio task template
+    :param file: template file
+    :return: task template"""
+    with open(file, 'r') as f:
+        return json.load(f)
+
+def build_task(file, template, prefix=IMAGE_PREFIX, url=None):
+    """Build the Label Studio task for a drawing
+    :param file: png file with a Textract response next to it
+    :param template: task template, it is not modified
+    :param prefix: S3 key prefix of the images
+    :param url: url of the image if it has already been uploaded, else it is uploaded to S3
+    :return: Label Studio task"""
+    # image size, read from the png header rather than decoding the image
+    img_width, img_height = get_image_size(file)
+    # save image to s3
+    if url is None:
+        url = upload_file(file, bucket, prefix + os.path.basename(file))
+    # update a copy of the template with the image url
+    task = copy.deepcopy(template)
+    task['data']['ocr'] = url
+    # process the textract response and update the template with the results
+    results = process_texract_json_for_label_studio(file, img_height, img_width)
+    task['predictions'][0]['result'] = results
+    return task
+
+def get_files_with_responses(folder, recursive=False):
+    """Get the png files in a folder that have a saved Textract response
+    :param folder: folder of drawings
+    :param recursive: whether to include the drawings in subfolders
+    :return: sorted list of png files"""
+    files = []
+    pattern = os.path.join(folder, '**', '*.png') if recursive else os.path.join(folder, '*.png')
+    for file in sorted(glob.glob(pattern, recursive=recursive)):
+        base = os.path.splitext(file)[0]
+        if os.path.exists(base + '.tbc') or os.path.exists(base + '.json'):
+            files.append(file)
+    return files
+
+def iter_chunks(items, chunk_size):
+    """Split an iterable into lists of up to chunk_size items
+    :param items: iterable
+    :param chunk_size: number of items per chunk
+    :return: generator of lists"""
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def import_tasks(project, tasks, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import tasks into a project in chunks, one request per chunk
+    :param project: Label Studio Project
+    :param tasks: iterable of tasks, built as they are needed
+    :param chunk_size: number of tasks per request
+    :return: list of the ids of the imported tasks, in the order of the tasks"""
+    task_ids = []
+    for chunk in iter_chunks(tasks, chunk_size):
+        task_ids.extend(project.import_tasks(chunk))
+        print(f'Imported {len(task_ids)} tasks')
+    return task_ids
+
+def process_folder(folder, title=PROJECT_TITLE, chunk_size=IMPORT_CHUNK_SIZE, ls=None):
+    """Import every drawing in a folder into a Label Studio project
+    The project is looked up by title and reused, the images are uploaded from a thread pool
+    and the tasks are imported in chunks over one pooled HTTP session instead of a request per drawing.
+    :param folder: folder of png files with Textract responses next to them
+    :param title: Project title
+    :param chunk_size: number of tasks per import request
+    :param ls: Label Studio Client, defaults to a new connection
+    :return: number of tasks imported"""
+    start = time.perf_counter()
+    ls = ls or connect_to_label_studio()
+    project = get_or_create_project(ls, create_label_config(), title=title)
+    template = load_template()
+    files = get_files_with_responses(folder)
+    # upload the images concurrently, unchanged images are skipped
+    urls = upload_files(files, bucket)
+    count = len(import_tasks(project, (build_task(file, template, url=urls[file]) for file in files),
+                             chunk_size=chunk_size))
+    print(f'Imported {count} tasks into {title} in {time.perf_counter() - start:.1f}s')
+    return count
+
+def process_file(file, title=PROJECT_TITLE):
+    """Import a single drawing into a Label Studio project
+    :param file: png file with a Textract response next to it
+    :param title: Project title"""
     # connect to label studio
     ls = connect_to_label_studio()
     # get label config
     label_config = create_label_config()
-    # create project
-    project = create_project(ls, label_config, title='Example Project')
-    # read image
-    image = cv2.imread(file)
-    img_width, img_height = image.shape[1], image.shape[0]
-    # path handling
-    path, f = os.path.split(file)
-    fname, ext = os.path.splitext(f)
-    key = 'Example_Images/' + f
-    # save image to s3
-    url = save_to_s3(image, bucket, key)
-    # load the label config template
-    template = json.load(open('ocr_template.json'))
-    # update the template with the image url
-    template['data']['ocr'] = url
-    # process the textract json file
-    json_file = file.replace('.png', '.json')
-    results = process_texract_json_for_label_studio(json_file, img_height, img_width)
-    # update the template with the results
-    template['predictions'][0]['result'] = results
+    # reuse or create the project
+    project = get_or_create_project(ls, label_config, title=title)
     # create task and import it into label studio
-    project.import_tasks([template])
+    task = build_task(file, load_template())
+    project.import_tasks([task])
     print(f'Created task for {file}')
 
-process_file(r'Data/MAPG-L-0010-040-D-AB00 - 000 - Z17.png')
\ No newline at end of file
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Import drawings and their Textract predictions into Label Studio')
+    parser.add_argument('inputs', nargs='*', help='png files or folders of png files')
+    parser.add_argument('--project', default=PROJECT_TITLE, help='title of the project to reuse or create')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='tasks per import request')
+    parser.add_argument('--rules', default=TAG_PATTERNS_FILE, help='tag rule set json file')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    set_rule_set(args.rules)
+    for item in args.inputs or [r'Data/MAPG-L-0010-040-D-AB00 - 000 - Z17.png']:
+        if os.path.isdir(item):
+            process_folder(item, title=args.project, chunk_size=args.chunk_size)
+        else:
+            process_file(item, title=args.project)
@@ -1,7 +1,17 @@
-import boto3
 import os
 import cv2
 import json
+import numpy as np
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from Textract_Client import (create_client, call_with_backoff, TokenBucket, TEXTRACT_TPS, MAX_CONCURRENCY,
+                             MAX_POOL_CONNECTIONS, MAX_RETRIES)
+from OCR_Cache import ocr_cache, hash_image
+from OCR_Result import OCRResult
+from Textract_Cache import TextractBlocks, load_textract_blocks, get_cache_file, HAS_CONFIDENCE
+from OCR_Render import render_result
+from OCR_Files import iter_pdf_pages
 
 # Apologies, I can't share my AWS credentials
 # if you have an AWS account, you can set the environment variables below
@@ -16,44 +26,260 @@ os.environ['AWS_SECRET_ACCESS_Key'] = ''
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 REGION_NAME = 'eu-west-1'
+# point the client at a local stand-in of the Textract endpoint, e.g. a moto server, for offline testing
+TEXTRACT_ENDPOINT_URL = os.environ.get('TEXTRACT_ENDPOINT_URL') or None
+# S3 bucket pdfs are uploaded to for asynchronous multi-page jobs
+TEXTRACT_S3_BUCKET = os.environ.get('TEXTRACT_S3_BUCKET', '')
+TEXTRACT_S3_PREFIX = 'textract-input/'
+# polling of asynchronous jobs, the interval doubles up to the maximum
+JOB_POLL_INTERVAL = 2.0
+JOB_POLL_MAX_INTERVAL = 30.0
+# responses are saved as compact .tbc files, see Textract_Cache, set to also keep the raw json
+KEEP_RESPONSE_JSON = False
+# Textract API version, used to key cached results
+TEXTRACT_API_VERSION = '2018-06-27'
+
+@lru_cache(maxsize=None)
+def get_textract_client(max_pool_connections=MAX_POOL_CONNECTIONS):
+    """Create a Textract client on first use, boto3 is only imported when Textract is called
+    Args:
+    max_pool_connections (int): The size of the client's connection pool, one per concurrent request
+    return: A boto3 Textract client, safe to share between threads"""
+    return create_client('textract', region_name=REGION_NAME, aws_access_key_id=AWS_ACCESS_KEY_ID,
+                         aws_secret_access_key=AWS_SECRET_ACCESS_KEY, max_pool_connections=max_pool_connections,
+                         endpoint_url=TEXTRACT_ENDPOINT_URL)
+
+def __getattr__(name):
+    # keep Textract_OCR.textract working without creating the client at import time
+    if name == 'textract':
+        return get_textract_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Create a Textract client
-textract = boto3.client('textract', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                        region_name=REGION_NAME)
 
+def save_response(file, response, image_hash=None):
+    """Save a Textract response next to the file it was made from
+    The response is saved as a compact .tbc file, and as json too if KEEP_RESPONSE_JSON is set.
+    Args:
+    file (str): The image filepath
+    response (dict): The Textract response
+    image_hash (str): The hash of the image sent, see OCR_Cache.hash_image, recorded so the
+    response is only reused for the same image
+    return: The .tbc filepath"""
+    save = get_cache_file(file)
+    TextractBlocks.from_response(response, image_hash=image_hash).save(save)
+    if KEEP_RESPONSE_JSON:
+        with open(os.path.splitext(file)[0] + '.json', 'w') as f:
+            json.dump(dict(response, ImageHash=image_hash) if image_hash else response, f)
+    return save
+
+def hash_image_bytes(file_as_bytes):
+    """Hash an encoded image the way process_single_file hashes the decoded file
+    Args:
+    file_as_bytes (bytes): The encoded image
+    return: The image hash, None if the bytes are not an image cv2 can decode, e.g. a pdf"""
+    image = cv2.imdecode(np.frombuffer(file_as_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return hash_image(image) if image is not None else None
 
-def detect_document_text(file):
+def detect_document_text(file, image=None, client=None, rate_limiter=None):
     """Detects text in the document
+    Throttled requests are retried with exponential backoff.
     Args:
-    file (str): A filepath
+    file (str): A filepath, the response is saved next to it
+    image (numpy.ndarray): The decoded image, sent instead of reading the file if given
+    client: A Textract client, defaults to the shared pooled client
+    rate_limiter (TokenBucket): Shared rate limiter, None to send straight away
     return: A list of blocks"""
     # Call Amazon Textract
-    file_as_bytes = open(file, 'rb').read()
-    response = textract.detect_document_text(Document={'Bytes': file_as_bytes})
-
-    # hand file name
-    path, name = os.path.split(file)
-    f, ext = os.path.splitext(name)
-    save = os.path.join(path, f + '.json')
+    if image is not None:
+        file_as_bytes = cv2.imencode('.png', image)[1].tobytes()
+        image_hash = hash_image(image)
+    else:
+        with open(file, 'rb') as f:
+            file_as_bytes = f.read()
+        image_hash = hash_image_bytes(file_as_bytes)
+    client = client or get_textract_client()
+    response = call_with_backoff(client.detect_document_text, Document={'Bytes': file_as_bytes},
+                                 rate_limiter=rate_limiter)
     # save the response
-    with open(save, 'w') as f:
-        json.dump(response, f)
+    save_response(file, response, image_hash=image_hash)
 
     # get the text blocks
     blocks = response['Blocks']
     return blocks
 
-def analyse_document(file, feature_types=['TABLES']):
+def detect_documents_text(files, concurrency=MAX_CONCURRENCY, tps=TEXTRACT_TPS, client=None, max_retries=MAX_RETRIES):
+    """Detect text in a batch of documents in parallel
+    Requests go out from a thread pool, a shared token bucket keeps them under the TPS quota
+    and throttled requests are retried with exponential backoff.
+    Args:
+    files (list): A list of filepaths, each response is saved next to its file
+    concurrency (int): The number of requests in flight at once
+    tps (float): The number of requests sent per second
+    client: A Textract client, e.g. a stub for offline testing, defaults to a client pooled for the concurrency
+    max_retries (int): The number of retries of a throttled request
+    return: A dictionary of filepath to list of blocks and a dictionary of filepath to exception for failed files"""
+    client = client or get_textract_client(max(concurrency, MAX_POOL_CONNECTIONS))
+    rate_limiter = TokenBucket(tps)
+
+    def submit(file):
+        with open(file, 'rb') as f:
+            file_as_bytes = f.read()
+        response = call_with_backoff(client.detect_document_text, Document={'Bytes': file_as_bytes},
+                                     rate_limiter=rate_limiter, max_retries=max_retries)
+        save_response(file, response, image_hash=hash_image_bytes(file_as_bytes))
+        return response['Blocks']
+
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='textract') as pool:
+        futures = {pool.submit(submit, file): file for file in files}
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                results[file] = future.result()
+            except Exception as e:
+                errors[file] = e
+    return results, errors
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """Create an S3 client on first use for uploading documents for asynchronous jobs
+    return: A boto3 S3 client"""
+    return create_client('s3', region_name=REGION_NAME, aws_access_key_id=AWS_ACCESS_KEY_ID,
+                         aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+
+def upload_document(file, bucket=None, key=None, s3_client=None):
+    """Upload a document to S3 for an asynchronous Textract job
+    Args:
+    file (str): A filepath
+    bucket (str): The bucket name, defaults to TEXTRACT_S3_BUCKET
+    key (str): The object key, defaults to the file name under TEXTRACT_S3_PREFIX
+    s3_client: An S3 client, defaults to the shared client
+    return: The bucket and key of the object"""
+    bucket = bucket or TEXTRACT_S3_BUCKET
+    if not bucket:
+        raise ValueError('No S3 bucket for asynchronous Textract jobs, pass bucket or set TEXTRACT_S3_BUCKET')
+    key = key or TEXTRACT_S3_PREFIX + os.path.basename(file)
+    (s3_client or get_s3_client()).upload_file(file, bucket, key)
+    return bucket, key
+
+def start_document_text_detection(bucket, key, client=None, notification_channel=None):
+    """Start an asynchronous text detection job on a document in S3
+    Args:
+    bucket (str): The bucket name
+    key (str): The object key of a pdf, png, jpeg or tiff
+    client: A Textract client, defaults to the shared pooled client
+    notification_channel (dict): {'SNSTopicArn', 'RoleArn'} to publish the completion status to, None to poll
+    return: The job id"""
+    client = client or get_textract_client()
+    kwargs = {'DocumentLocation': {'S3Object': {'Bucket': bucket, 'Name': key}}}
+    if notification_channel is not None:
+        kwargs['NotificationChannel'] = notification_channel
+    return call_with_backoff(client.start_document_text_detection, **kwargs)['JobId']
+
+def wait_for_job(job_id, client=None, wait=None, poll_interval=JOB_POLL_INTERVAL,
+                 max_interval=JOB_POLL_MAX_INTERVAL, timeout=None):
+    """Wait for an asynchronous text detection job to finish
+    Args:
+    job_id (str): The job id
+    client: A Textract client, defaults to the shared pooled client
+    wait (callable): Blocks until the completion notification for a job id arrives, e.g. from an SQS queue
+        subscribed to the notification channel, None to poll the job status
+    poll_interval (float): The first polling interval in seconds, doubled up to max_interval
+    max_interval (float): The longest polling interval in seconds
+    timeout (float): Seconds to wait before giving up, None to wait forever
+    return: The first page of the job's results"""
+    client = client or get_textract_client()
+    if wait is not None:
+        wait(job_id)
+    start = time.monotonic()
+    while True:
+        response = call_with_backoff(client.get_document_text_detection, JobId=job_id)
+        status = response['JobStatus']
+        if status in ('SUCCEEDED', 'PARTIAL_SUCCESS'):
+            return response
+        if status == 'FAILED':
+            raise RuntimeError(f'Textract job {job_id} failed: {response.get("StatusMessage")}')
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise TimeoutError(f'Textract job {job_id} did not finish within {timeout}s')
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_interval)
+
+def iter_job_pages(job_id, client=None, first_response=None):
+    """Stream the blocks of a finished job one page at a time
+    Results are paginated over NextToken and a page is yielded as soon as the
+    blocks of a later page arrive, so only one page is held in memory.
+    Args:
+    job_id (str): The job id
+    client: A Textract client, defaults to the shared pooled client
+    first_response (dict): The first page of results if it has already been fetched, e.g. by wait_for_job
+    return: A generator of (page number, list of blocks) tuples, page numbers start at 1"""
+    client = client or get_textract_client()
+    response = first_response or call_with_backoff(client.get_document_text_detection, JobId=job_id)
+    pending = {}
+    while True:
+        for block in response['Blocks']:
+            page = block.get('Page', 1)
+            # blocks come back in page order, so earlier pages are complete
+            for done in sorted(p for p in pending if p < page):
+                yield done, pending.pop(done)
+            pending.setdefault(page, []).append(block)
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        response = call_with_backoff(client.get_document_text_detection, JobId=job_id, NextToken=next_token)
+    for page in sorted(pending):
+        yield page, pending.pop(page)
+
+def detect_pdf_text(file, output_folder=None, bucket=None, client=None, s3_client=None, wait=None,
+                    notification_channel=None, timeout=None, dpi=200):
+    """Detect text in every page of a pdf with one asynchronous Textract job
+    The pdf is uploaded once instead of rasterising and sending each page, and the
+    blocks of each page are saved as <name>_<page index>.tbc, next to where the
+    page images are rendered, so process_single_file picks them up. Each page is
+    rendered locally too, only to record the hash of its image with the blocks.
+    Args:
+    file (str): A pdf filepath
+    output_folder (str): The folder the page responses are saved to, defaults to the pdf's folder
+    bucket (str): The bucket the pdf is uploaded to, defaults to TEXTRACT_S3_BUCKET
+    client: A Textract client, defaults to the shared pooled client
+    s3_client: An S3 client, defaults to the shared client
+    wait (callable): Blocks until the completion notification for a job id arrives, None to poll
+    notification_channel (dict): {'SNSTopicArn', 'RoleArn'} to publish the completion status to
+    timeout (float): Seconds to wait for the job, None to wait forever
+    dpi (int): The resolution the page images are rendered at, the same as Keras_OCR.convert_pdfs_to_images
+    return: A generator of (page index, list of blocks) tuples, page indices start at 0"""
+    client = client or get_textract_client()
+    bucket, key = upload_document(file, bucket=bucket, s3_client=s3_client)
+    job_id = start_document_text_detection(bucket, key, client=client, notification_channel=notification_channel)
+    first_response = wait_for_job(job_id, client=client, wait=wait, timeout=timeout)
+
+    output_folder = output_folder or os.path.dirname(file)
+    name = os.path.splitext(os.path.basename(file))[0]
+    # hashed the way process_single_file hashes the page png, which cv2 reads back as BGR
+    image_hashes = {i: hash_image(cv2.cvtColor(page, cv2.COLOR_RGB2BGR)) for i, page in iter_pdf_pages(file, dpi)}
+    for page, blocks in iter_job_pages(job_id, client=client, first_response=first_response):
+        response = {'DocumentMetadata': {'Pages': 1}, 'Blocks': blocks}
+        save_response(os.path.join(output_folder, f'{name}_{page - 1}.png'), response,
+                      image_hash=image_hashes.get(page - 1))
+        yield page - 1, blocks
+
+def analyse_document(file, feature_types=['TABLES'], client=None, rate_limiter=None):
     """Detect text, tables, forms, and key-value pairs in a document
+    Throttled requests are retried with exponential backoff.
     Args:
     file (str): A filepath
     feature_types (list): A list of feature types
+    client: A Textract client, defaults to the shared pooled client
+    rate_limiter (TokenBucket): Shared rate limiter, None to send straight away
     return: A list of blocks
         """
     # open the file
-    file_as_bytes = open(file, 'rb').read()
+    with open(file, 'rb') as f:
+        file_as_bytes = f.read()
     # Call Amazon Textract with analyse_document
-    response = textract.analyze_document(Document={'Bytes': file_as_bytes}, FeatureTypes=feature_types)
+    client = client or get_textract_client()
+    response = call_with_backoff(client.analyze_document, Document={'Bytes': file_as_bytes},
+                                 FeatureTypes=feature_types, rate_limiter=rate_limiter)
     return response
 
 def get_text_from_block(block):
@@ -97,23 +323,42 @@ def process_blocks_to_boundingbox_dict(blocks, height, width):
             boundingbox_dict[i] = {'text': text, 'boundingbox': {'pt1': pt1, 'pt2': pt2}}
     return boundingbox_dict
 
-def annotate_image_with_boundingboxes(image, boundingbox_dict, with_text=False, color=(0, 0, 255), thickness=2):
-    """Annotate an image with bounding boxes
-    Args:
-    image (numpy.ndarray): An image
-    boundingbox_dict (dict): A dictionary of bounding boxes
-    with_text (bool): Whether to write the text on the image
-    color (tuple): The color of the bounding box
-    thickness (int): The thickness of the bounding box
-    return: An annotated image"""
-    for key, value in boundingbox_dict.items():
-        text = value['text']
-        pt1 = value['boundingbox']['pt1']
-        pt2 = value['boundingbox']['pt2']
-        cv2.rectangle(img=image, pt1=pt1, pt2=pt2, color=color, thickness=thickness)
-        if with_text:
-            cv2.putText(image, text, pt2, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-    return image
+def process_blocks_to_result(blocks, height, width):
+    """Process the WORD blocks to an OCRResult
+    Args:
+    blocks (list): A list of blocks
+    height (int): The height of the image
+    width (int): The width of the image
+    return: An OCRResult keyed by block index"""
+    keys, texts, coords, conf = [], [], [], []
+    for i, block in enumerate(blocks):
+        text = get_text_from_block(block)
+        if text is not None:
+            pt1, pt2 = get_cv2_boundingbox_from_block(block, height, width)
+            keys.append(i)
+            texts.append(text)
+            coords.append((*pt1, *pt2))
+            conf.append(block.get('Confidence', float('nan')))
+    x1, y1, x2, y2 = zip(*coords) if coords else ((), (), (), ())
+    return OCRResult.from_columns(texts, x1, y1, x2, y2, conf=conf, keys=keys, engine='textract')
+
+def process_textract_blocks_to_result(textract_blocks, height, width):
+    """Process the WORD blocks of a Textract block cache to an OCRResult, without building block dictionaries
+    Args:
+    textract_blocks (TextractBlocks): The cached blocks
+    height (int): The height of the image
+    width (int): The width of the image
+    return: An OCRResult keyed by block index, the same as process_blocks_to_result"""
+    keys = np.flatnonzero(textract_blocks.mask('WORD'))
+    left, top, box_width, box_height = textract_blocks.bbox[keys].T
+    # astype truncates towards zero like int()
+    x1 = (left * width).astype(np.int32)
+    y1 = (top * height).astype(np.int32)
+    x2 = ((left + box_width) * width).astype(np.int32)
+    y2 = ((top + box_height) * height).astype(np.int32)
+    conf = np.where(textract_blocks.flags[keys] & HAS_CONFIDENCE, textract_blocks.confidence[keys], np.nan)
+    texts = [textract_blocks.get_text(i) for i in keys.tolist()]
+    return OCRResult.from_columns(texts, x1, y1, x2, y2, conf=conf, keys=keys, engine='textract')
 
 def load_response_json(file):
     """Load a json file
@@ -124,35 +369,44 @@ def load_response_json(file):
         response = json.load(f)
     return response
 
-def process_single_file(file):
+def process_single_file(file, cache=ocr_cache, image=None, render=True):
     """Process a single file
     Args:
     file (str): An image filepath
-    return: A dictionary of bounding boxes and an annotated image
+    cache (OCRCache): The result cache, None to skip it
+    image (numpy.ndarray): The file already decoded with cv2.imread, it is not modified
+    render (bool): Whether to draw and save the annotated image, see OCR_Render for the output format
+    return: An OCRResult and an annotated image, None if render is False
     """
 
-    image = cv2.imread(file)
+    if image is None:
+        image = cv2.imread(file)
     height, width, channels = image.shape
-
-    # if textract data already exists, load it
     dir, filename = os.path.split(file)
     fname, ext = os.path.splitext(filename)
-    jsonfile = fname + '.json'
-    jsonfile = os.path.join(dir, jsonfile)
-    if os.path.exists(jsonfile):
-        response = load_response_json(jsonfile)
-        blocks = response['Blocks']
-    # else, call textract
-    else:
-        blocks = detect_document_text(file)
-    # process the blocks
-    boundingbox_dict = process_blocks_to_boundingbox_dict(blocks, height, width)
-    # annotate the image
-    image2 = annotate_image_with_boundingboxes(image, boundingbox_dict)
-    # save the image
+
+    # check the cache for a result for this image
+    result = None
+    image_hash = hash_image(image)
+    if cache is not None:
+        key = cache.make_key(image_hash, 'textract', TEXTRACT_API_VERSION)
+        result = cache.get(key)
+    if result is None:
+        # if textract data already exists for this image, load it from the .tbc cache, or the json
+        # which is converted on the way, a response saved for an older version of the drawing is not used
+        textract_blocks = load_textract_blocks(file, image_hash=image_hash)
+        if textract_blocks is not None:
+            result = process_textract_blocks_to_result(textract_blocks, height, width)
+        # else, call textract
+        else:
+            blocks = detect_document_text(file, image=image)
+            result = process_blocks_to_result(blocks, height, width)
+        if cache is not None:
+            cache.put(key, result)
+    # annotate a copy of the image and save it
     outfile = fname + '_textract.png'
     outfile = os.path.join('Results', outfile)
-    cv2.imwrite(outfile, image2)
-    return boundingbox_dict, image2
+    image2 = render_result(image, result, outfile, color=(0, 0, 255), thickness=2, render=render)
+    return result, image2
 
 
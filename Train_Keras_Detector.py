@@ -1,11 +1,20 @@
-import datetime
+import argparse
+import json
+import random
 import string
 import math
 import os
+import glob
+import multiprocessing
+from importlib.metadata import version
+import numpy as np
 import tensorflow as tf
 import sklearn.model_selection
 import cv2
 import keras_ocr
+from Textract_Cache import load_textract_blocks
+from Textract_OCR import process_textract_blocks_to_result
+from Keras_OCR import RECOGNIZER_ALPHABET
 
 """
 This script was taken from the keras-ocr github page and modified to work with the custom fonts and backgrounds.
@@ -14,121 +23,446 @@ The font used in autocad is a .shx file, which is a font file that is used in Au
 The romans.fft file is a converted shx font
 For the background, I took a P&ID CAD drawing and removed text from it.
 Then converted them to png files.
+
+Rendering text with PIL is much slower than a training step, so the synthetic pages and their
+detector targets are rendered once, by a pool of processes, into sharded TFRecord files.
+Training then reads the shards through tf.data, interleaving shards, shuffling and prefetching,
+so the model rather than the text rendering sets the pace. Use --regenerate to rebuild the shards.
+
+With --mode recognizer the recognizer is fine-tuned instead, on word crops streamed straight from
+the synthetic pages and/or from drawings labelled by their saved Textract responses. Training
+resumes from its last epoch if it is interrupted and the metrics are appended to a csv file.
 """
 
 data_dir = '.'
 # Custom alphabet to include some symbols that are commonly found in P&ID drawings
 alphabet = string.digits + string.ascii_letters + '!?."#/\\'
-recognizer_alphabet = ''.join(sorted(set(alphabet.lower())))
+# the lower case alphabet the recognizer is fine-tuned on, Keras_OCR loads the fine-tuned weights with it
+recognizer_alphabet = RECOGNIZER_ALPHABET
 
 # load the fonts, we need multiple, but we're only using romans__.ttf.
-fonts = [r"fonts\Romans_SHX\romans__.ttf"] * 1000
+fonts = [os.path.join('fonts', 'Romans_SHX', 'romans__.ttf')] * 1000
 
 backgrounds = [os.path.join(r"backgrounds", file) for file in os.listdir(r"backgrounds")]
-text_generator = keras_ocr.data_generation.get_text_generator(alphabet=alphabet)
-# print('The first generated text is:', next(text_generator))
+
+SPLITS = ('train', 'val', 'test')
+SHARD_DIR = os.path.join(data_dir, 'shards', 'detector')
+SHARD_SIZE = 64
+# synthetic pages rendered per split
+PAGES = {'train': 1024, 'val': 128, 'test': 128}
+IMAGE_SIZE = 1024
+SEED = 42
+SHUFFLE_BUFFER = 256
+# recognizer training
+CROP_SHUFFLE_BUFFER = 2048
+CROP_STREAMS = 4
+RECOGNIZER_DIR = os.path.join('Models', 'recognizer')
+# settings of the synthetic page generator, recorded in the shard manifest
+# font_size=(6, 20), margin=20, rotationX=(0, 30), rotationY=(0, 30), rotationZ=(0, 0)
+GENERATOR_SETTINGS = {
+    'font_size': (20, 40),
+    'margin': 50,
+    'rotationX': (-0.2, 0.2),
+    'rotationY': (-0.05, 0.05),
+    'rotationZ': (-15, 15),
+}
+# bump when the shard record layout changes
+SHARD_FORMAT_VERSION = 1
+
+# see keras_ocr.detection.compute_input
+IMAGE_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
+IMAGE_VARIANCE = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255
 
 def get_train_val_test_split(arr):
     train, valtest = sklearn.model_selection.train_test_split(arr, train_size=0.8, random_state=42)
     val, test = sklearn.model_selection.train_test_split(valtest, train_size=0.5, random_state=42)
     return train, val, test
 
-
-background_splits = get_train_val_test_split(backgrounds)
-font_splits = get_train_val_test_split(fonts)
-
-image_generators = [
-    keras_ocr.data_generation.get_image_generator(
-        height=1024,
-        width=1024,
+def get_image_generator(split, seed=SEED):
+    """Create the synthetic page generator of a split
+    :param split: 'train', 'val' or 'test'
+    :param seed: seed of the text and page layout
+    :return: generator of (image, lines) tuples"""
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    i = SPLITS.index(split)
+    text_generator = keras_ocr.data_generation.get_text_generator(alphabet=alphabet)
+    return keras_ocr.data_generation.get_image_generator(
+        height=IMAGE_SIZE,
+        width=IMAGE_SIZE,
         text_generator=text_generator,
         font_groups={
-            alphabet: current_fonts
+            alphabet: get_train_val_test_split(fonts)[i]
         },
-        backgrounds=current_backgrounds,
-        # font_size=(6, 20),
-        # margin=20,
-        # rotationX=(0, 30),
-        # rotationY=(0, 30),
-        # rotationZ=(0, 0),
-        font_size=(20, 40),
-        margin=50,
-        rotationX=(-0.2, 0.2),
-        rotationY=(-0.05, 0.05),
-        rotationZ=(-15, 15)
-
-    ) for current_fonts, current_backgrounds in zip(
-        font_splits,
-        background_splits
+        backgrounds=get_train_val_test_split(backgrounds)[i],
+        **GENERATOR_SETTINGS
+    )
+
+def get_shard_file(split, shard, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f'{split}-{shard:05d}.tfrecord')
+
+def write_shard(task):
+    """Render synthetic pages and their detector targets into a TFRecord shard, in a worker process
+    The image is stored as png and the region and affinity maps as uint8.
+    :param task: (split, shard index, number of pages, shard folder) tuple
+    :return: shard filepath"""
+    split, shard, n_pages, shard_dir = task
+    outfile = get_shard_file(split, shard, shard_dir)
+    # every shard has its own seed, so shards are reproducible whichever worker renders them
+    image_generator = get_image_generator(split, seed=SEED + 1000 * SPLITS.index(split) + shard)
+    heatmap = keras_ocr.detection.get_gaussian_heatmap(size=512, distanceRatio=1.5)
+    tmp = outfile + '.tmp'
+    with tf.io.TFRecordWriter(tmp) as writer:
+        for _ in range(n_pages):
+            image, lines = next(image_generator)
+            maps = keras_ocr.detection.compute_maps(heatmap=heatmap, image_height=image.shape[0],
+                                                    image_width=image.shape[1], lines=lines)
+            maps = np.clip(np.rint(maps * 255), 0, 255).astype(np.uint8)
+            # the generator makes RGB images, cv2 encodes BGR
+            png = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes()
+            feature = {
+                'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[png])),
+                'maps': tf.train.Feature(bytes_list=tf.train.BytesList(value=[maps.tobytes()])),
+                'maps_shape': tf.train.Feature(int64_list=tf.train.Int64List(value=list(maps.shape))),
+            }
+            writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+    os.replace(tmp, outfile)
+    return outfile
+
+def get_shard_manifest(pages, shard_size):
+    """The parameters the shards are rendered with, shards made with other parameters are rebuilt
+    :param pages: dictionary of split to number of pages
+    :param shard_size: pages per shard
+    :return: manifest dictionary"""
+    return {
+        'version': SHARD_FORMAT_VERSION,
+        'keras_ocr': version('keras-ocr'),
+        'pages': {split: pages[split] for split in SPLITS},
+        'shard_size': shard_size,
+        'seed': SEED,
+        'image_size': IMAGE_SIZE,
+        'alphabet': alphabet,
+        'fonts': sorted(set(fonts)),
+        'backgrounds': sorted(os.path.basename(file) for file in backgrounds),
+        # through json so tuples compare equal to the lists read back
+        'generator': json.loads(json.dumps(GENERATOR_SETTINGS)),
+    }
+
+def build_shards(pages=PAGES, shard_size=SHARD_SIZE, shard_dir=SHARD_DIR, workers=None, regenerate=False):
+    """Pre-render the synthetic pages of every split into shards with a process pool
+    Shards that already exist are kept unless regenerate is set, so an interrupted build resumes.
+    A manifest of the parameters is kept next to the shards, when it is missing or differs,
+    e.g. after changing the page count or shard size, all the shards are rebuilt.
+    :param pages: dictionary of split to number of pages
+    :param shard_size: pages per shard
+    :param shard_dir: folder of the shards
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param regenerate: whether to rebuild existing shards
+    :return: dictionary of split to list of shard files"""
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest_file = os.path.join(shard_dir, 'manifest.json')
+    manifest = get_shard_manifest(pages, shard_size)
+    previous = None
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            previous = json.load(f)
+    if regenerate or previous != manifest:
+        if not regenerate and (previous is not None or glob.glob(os.path.join(shard_dir, '*.tfrecord'))):
+            print('The shard parameters changed or have no manifest, rebuilding the shards')
+        for file in glob.glob(os.path.join(shard_dir, '*.tfrecord')):
+            os.remove(file)
+        # written before rendering, the shards are written atomically so an interrupted build still resumes
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    tasks, shards = [], {}
+    for split in SPLITS:
+        n_shards = math.ceil(pages[split] / shard_size)
+        shards[split] = [get_shard_file(split, i, shard_dir) for i in range(n_shards)]
+        for i, file in enumerate(shards[split]):
+            if not os.path.exists(file):
+                tasks.append((split, i, min(shard_size, pages[split] - i * shard_size), shard_dir))
+    print(f'Rendering {len(tasks)} shards')
+    if tasks:
+        # spawn so each worker starts its own TensorFlow instead of a forked one
+        with multiprocessing.get_context('spawn').Pool(processes=workers) as pool:
+            for i, file in enumerate(pool.imap_unordered(write_shard, tasks), 1):
+                print(f'[{i}/{len(tasks)}] {file}')
+    return shards
+
+def parse_example(serialized):
+    """Decode a shard record into the detector input and target
+    :param serialized: serialised tf.train.Example
+    :return: normalised image and region/affinity maps"""
+    example = tf.io.parse_single_example(serialized, {
+        'image': tf.io.FixedLenFeature([], tf.string),
+        'maps': tf.io.FixedLenFeature([], tf.string),
+        'maps_shape': tf.io.FixedLenFeature([3], tf.int64),
+    })
+    image = tf.cast(tf.io.decode_png(example['image'], channels=3), tf.float32)
+    image = (image - IMAGE_MEAN) / IMAGE_VARIANCE
+    maps = tf.reshape(tf.io.decode_raw(example['maps'], tf.uint8), example['maps_shape'])
+    return image, tf.cast(maps, tf.float32) / 255.0
+
+def get_dataset(files, batch_size, training=True, seed=SEED):
+    """Read shards through tf.data
+    :param files: list of shard files
+    :param batch_size: batch size
+    :param training: whether to shuffle and repeat
+    :param seed: shuffle seed
+    :return: tf.data.Dataset of (image, maps) batches"""
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if training:
+        dataset = dataset.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=min(len(files), 4),
+                                 num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+    if training:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, seed=seed, reshuffle_each_iteration=True).repeat()
+    dataset = dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def train_detector(shards, pages=PAGES, batch_size=4, epochs=10):
+    """Train the detector on the pre-rendered shards
+    :param shards: dictionary of split to list of shard files
+    :param pages: dictionary of split to number of pages
+    :param batch_size: batch size
+    :param epochs: number of epochs
+    :return: trained detector"""
+    # load the detector
+    detector = keras_ocr.detection.Detector(weights='clovaai_general')
+    os.makedirs('Models', exist_ok=True)
+    # train detector
+    detector.model.fit(
+        get_dataset(shards['train'], batch_size),
+        steps_per_epoch=math.ceil(pages['train'] / batch_size),
+        epochs=epochs,
+        callbacks=[
+            # tf.keras.callbacks.EarlyStopping(restore_best_weights=True, patience=20),
+            tf.keras.callbacks.CSVLogger(os.path.join('Models', 'Models_Detector.csv')),
+            tf.keras.callbacks.ModelCheckpoint(filepath=os.path.join('Models', 'Models.h5'))
+        ],
+        validation_data=get_dataset(shards['val'], batch_size, training=False),
+    )
+    print('Training Complete')
+
+    # save detector weights
+    detector.model.save_weights(os.path.join('Models', 'Detector_Weights.h5'))
+    return detector
+
+def load_recognizer(freeze_backbone=True):
+    """Load the pretrained recognizer with the P&ID alphabet
+    :param freeze_backbone: whether to only train the layers after the backbone
+    :return: compiled recognizer"""
+    # load the recognizer
+    recognizer = keras_ocr.recognition.Recognizer(
+        alphabet=recognizer_alphabet,
+        weights='kurapan'
     )
-]
-
-# See what the first validation image looks like.
-image, lines = next(image_generators[1])
-text = keras_ocr.data_generation.convert_lines_to_paragraph(lines)
-print('The first generated validation image (below) contains:', text)
-cv2.imwrite('validation_image.png', image)
-
-# load the detector
-detector = keras_ocr.detection.Detector(weights='clovaai_general')
-# load the recognizer
-recognizer = keras_ocr.recognition.Recognizer(
-    alphabet=recognizer_alphabet,
-    weights='kurapan'
-)
-recognizer.compile()
-# this makes only the last layer of the recogniser trainable
-for layer in recognizer.backbone.layers:
-    layer.trainable = False
-
-
-detector_batch_size = 1
-detector_basepath = os.path.join(data_dir, f'detector_{datetime.datetime.now().isoformat()}')
-# create generators
-detection_train_generator, detection_val_generator, detection_test_generator = [
-    detector.get_batch_generator(
-        image_generator=image_generator,
-        batch_size=detector_batch_size
-    ) for image_generator in image_generators
-]
-# train detector
-detector.model.fit(
-    detection_train_generator,
-    steps_per_epoch=math.ceil(len(background_splits[0]) / detector_batch_size),
-    epochs=10,
-    workers=0,
-    callbacks=[
-        # tf.keras.callbacks.EarlyStopping(restore_best_weights=True, patience=20),
-        tf.keras.callbacks.CSVLogger(r'Models\Models_Detector.csv'),
-        tf.keras.callbacks.ModelCheckpoint(filepath=r'Models\Models.h5')
-    ],
-    validation_data=detection_val_generator,
-    validation_steps=math.ceil(len(background_splits[1]) / detector_batch_size),
-    batch_size=detector_batch_size
-)
-print('Training Complete')
-
-# save detector weights
-detector.model.save_weights(r'Models\Detector_Weights.h5')
-
-# load the trained detector into the pipeline
-pipeline = keras_ocr.pipeline.Pipeline(detector=detector, recognizer=recognizer)
-# get the next image from the generator
-image, lines = next(image_generators[0])
-# predict the text in the image
-predictions = pipeline.recognize(images=[image])[0]
-# draw the predictions on the image
-drawn = keras_ocr.tools.drawBoxes(
-    image=image, boxes=predictions, boxes_format='predictions'
-)
-# print the actual text and the predicted text
-print(
-    'Actual:', '\n'.join([' '.join([character for _, character in line]) for line in lines]),
-    'Predicted:', [text for text, box in predictions]
-)
-# save the image
-cv2.imwrite(r'Results\Detector_image.png', image)
-# save the image with the predictions
-cv2.imwrite(r'Results\Detector_Results.png', drawn)
-print('Fin.')
+    if freeze_backbone:
+        # this makes only the last layer of the recogniser trainable
+        for layer in recognizer.backbone.layers:
+            layer.trainable = False
+    recognizer.compile()
+    return recognizer
+
+def clean_label(text, max_length):
+    """Normalise a word to the recognizer alphabet
+    :param text: word text
+    :param max_length: longest label the recognizer can predict
+    :return: lower case text, or None if the word can't be used as a label"""
+    text = ' '.join(text.lower().split())
+    if not text or len(text) > max_length or any(c not in recognizer_alphabet for c in text):
+        return None
+    return text
+
+def iter_synthetic_crops(split, max_length, width, height, seed=SEED):
+    """Stream word crops from synthetic pages, the pages are rendered in memory and never written
+    :param split: 'train', 'val' or 'test'
+    :param max_length: longest label the recognizer can predict
+    :param width: recognizer input width
+    :param height: recognizer input height
+    :param seed: seed of the text and page layout
+    :return: generator of (RGB crop, text) tuples"""
+    crops = keras_ocr.data_generation.convert_image_generator_to_recognizer_input(
+        image_generator=get_image_generator(split, seed=seed), max_string_length=max_length,
+        target_width=width, target_height=height, margin=1)
+    for crop, text in crops:
+        text = clean_label(text, max_length)
+        if text is not None:
+            yield crop, text
+
+def iter_drawing_crops(files, max_length, width, height, seed=SEED):
+    """Stream word crops from drawings labelled by their saved Textract responses, forever, in shuffled order
+    :param files: list of png files with a .tbc or .json Textract response next to them
+    :param max_length: longest label the recognizer can predict
+    :param width: recognizer input width
+    :param height: recognizer input height
+    :param seed: shuffle seed
+    :return: generator of (RGB crop, text) tuples
+    Raises ValueError if a full pass over the files yields no crops, rather than looping forever"""
+    rng = random.Random(seed)
+    files = list(files)
+    while True:
+        rng.shuffle(files)
+        yielded = False
+        for file in files:
+            textract_blocks = load_textract_blocks(file)
+            if textract_blocks is None:
+                continue
+            image = cv2.cvtColor(cv2.imread(file), cv2.COLOR_BGR2RGB)
+            result = process_textract_blocks_to_result(textract_blocks, image.shape[0], image.shape[1])
+            for text, (x1, y1, x2, y2) in zip(result.text, result.boxes.tolist()):
+                text = clean_label(text, max_length)
+                if text is None or x2 <= x1 or y2 <= y1:
+                    continue
+                yielded = True
+                yield keras_ocr.tools.fit(image[y1:y2, x1:x2], width=width, height=height), text
+        if not yielded:
+            raise ValueError(f'No usable word crops in {len(files)} drawings, they need saved Textract '
+                             'responses with words in the recognizer alphabet')
+
+def get_crop_dataset(recognizer, split='train', source='synthetic', drawings=(), batch_size=32,
+                     streams=CROP_STREAMS, seed=SEED):
+    """Stream word crops into fixed size batches for the recognizer's training model
+    keras-ocr's recognizer has a fixed input width, so every crop is letterboxed to it and
+    labels are padded to the longest string the model predicts. Several crop streams with
+    their own seeds are interleaved, so text rendering overlaps with training.
+    :param recognizer: compiled recognizer
+    :param split: synthetic split to render crops from
+    :param source: 'synthetic', 'drawings' or 'both'
+    :param drawings: list of png files with Textract responses, for the drawings source
+    :param batch_size: batch size
+    :param streams: number of interleaved crop streams
+    :param seed: seed of the streams and shuffling
+    :return: tf.data.Dataset of ((images, labels, input_length, label_length), dummy target) batches"""
+    _, height, width, channels = recognizer.model.input_shape
+    max_length = recognizer.training_model.input_shape[1][1]
+    drawings = list(drawings)
+    if source in ('drawings', 'both') and not drawings:
+        raise ValueError(f'The {source} source needs drawings with saved Textract responses, none were given')
+
+    def generate(stream):
+        stream_seed = seed + 1000 * SPLITS.index(split) + int(stream)
+        use_drawings = source == 'drawings' or (source == 'both' and int(stream) % 2 == 1)
+        if use_drawings:
+            crops = iter_drawing_crops(drawings, max_length, width, height, seed=stream_seed)
+        else:
+            crops = iter_synthetic_crops(split, max_length, width, height, seed=stream_seed)
+        for crop, text in crops:
+            if channels == 1:
+                crop = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)[..., np.newaxis]
+            label = [recognizer_alphabet.index(c) for c in text]
+            yield crop, np.array(label + [-1] * (max_length - len(label)), dtype=np.int32), len(label)
+
+    signature = (tf.TensorSpec((height, width, channels), tf.uint8),
+                 tf.TensorSpec((max_length,), tf.int32),
+                 tf.TensorSpec((), tf.int32))
+    dataset = tf.data.Dataset.range(streams).interleave(
+        lambda stream: tf.data.Dataset.from_generator(generate, output_signature=signature, args=(stream,)),
+        cycle_length=streams, num_parallel_calls=streams, deterministic=False)
+
+    def to_inputs(image, label, label_length):
+        inputs = (tf.cast(image, tf.float32) / 255.0, tf.cast(label, tf.float32),
+                  tf.constant([max_length], tf.float32), tf.cast(label_length, tf.float32)[tf.newaxis])
+        return inputs, tf.zeros((1,))
+
+    return dataset.shuffle(CROP_SHUFFLE_BUFFER, seed=seed).map(to_inputs, num_parallel_calls=tf.data.AUTOTUNE) \
+        .batch(batch_size, drop_remainder=True).prefetch(tf.data.AUTOTUNE)
+
+def train_recognizer(source='synthetic', drawings=(), batch_size=32, epochs=10, steps_per_epoch=500,
+                     validation_steps=50, freeze_backbone=True, checkpoint_dir=RECOGNIZER_DIR):
+    """Fine-tune the recognizer on streamed word crops
+    Progress is backed up every epoch, so rerunning the same command resumes an interrupted run.
+    :param source: 'synthetic', 'drawings' or 'both'
+    :param drawings: list of png files with Textract responses, for the drawings source
+    :param batch_size: batch size
+    :param epochs: number of epochs
+    :param steps_per_epoch: batches per epoch, the crop stream is endless
+    :param validation_steps: synthetic validation batches per epoch
+    :param freeze_backbone: whether to only train the layers after the backbone
+    :param checkpoint_dir: folder of the backup, checkpoints and metrics
+    :return: trained recognizer"""
+    recognizer = load_recognizer(freeze_backbone=freeze_backbone)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    recognizer.training_model.fit(
+        get_crop_dataset(recognizer, 'train', source=source, drawings=drawings, batch_size=batch_size),
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
+        callbacks=[
+            tf.keras.callbacks.BackupAndRestore(backup_dir=os.path.join(checkpoint_dir, 'backup')),
+            tf.keras.callbacks.ModelCheckpoint(filepath=os.path.join(checkpoint_dir, 'Recognizer_{epoch:03d}.h5'),
+                                               save_weights_only=True),
+            tf.keras.callbacks.CSVLogger(os.path.join(checkpoint_dir, 'Models_Recognizer.csv'), append=True),
+        ],
+        validation_data=get_crop_dataset(recognizer, 'val', batch_size=batch_size, streams=1),
+        validation_steps=validation_steps,
+    )
+    print('Training Complete')
+
+    # save recognizer weights
+    recognizer.model.save_weights(os.path.join('Models', 'Recognizer_Weights.h5'))
+    return recognizer
+
+def show_sample(detector=None, recognizer=None):
+    """Run the trained models on a test page and save the predictions
+    :param detector: trained detector, defaults to the pretrained one
+    :param recognizer: trained recognizer, defaults to the pretrained one"""
+    detector = detector or keras_ocr.detection.Detector(weights='clovaai_general')
+    recognizer = recognizer or load_recognizer()
+    # load the trained detector into the pipeline
+    pipeline = keras_ocr.pipeline.Pipeline(detector=detector, recognizer=recognizer)
+    # get the next image from the generator
+    image, lines = next(get_image_generator('test'))
+    # predict the text in the image
+    predictions = pipeline.recognize(images=[image])[0]
+    # draw the predictions on the image
+    drawn = keras_ocr.tools.drawBoxes(
+        image=image, boxes=predictions, boxes_format='predictions'
+    )
+    # print the actual text and the predicted text
+    print(
+        'Actual:', '\n'.join([' '.join([character for _, character in line]) for line in lines]),
+        'Predicted:', [text for text, box in predictions]
+    )
+    # save the image
+    cv2.imwrite(os.path.join('Results', 'Detector_image.png'), image)
+    # save the image with the predictions
+    cv2.imwrite(os.path.join('Results', 'Detector_Results.png'), drawn)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train the keras-ocr detector or recognizer on synthetic P&ID pages')
+    parser.add_argument('--mode', choices=('detector', 'recognizer'), default='detector', help='model to train')
+    parser.add_argument('--regenerate', action='store_true', help='rebuild the synthetic page shards')
+    parser.add_argument('--shards-only', action='store_true', help='build the shards and stop')
+    parser.add_argument('--workers', type=int, default=None, help='processes rendering the shards')
+    parser.add_argument('--train-pages', type=int, default=PAGES['train'], help='synthetic training pages')
+    parser.add_argument('--val-pages', type=int, default=PAGES['val'], help='synthetic validation pages')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='pages per shard')
+    parser.add_argument('--batch-size', type=int, default=None, help='defaults to 4 for the detector, 32 for the recognizer')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--source', choices=('synthetic', 'drawings', 'both'), default='synthetic',
+                        help='where the recognizer word crops come from')
+    parser.add_argument('--drawings', default='Data', help='folder of png drawings with Textract responses')
+    parser.add_argument('--steps', type=int, default=500, help='recognizer batches per epoch')
+    parser.add_argument('--train-backbone', action='store_true', help='also train the recognizer backbone')
+    return parser.parse_args(argv)
+
 
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode == 'recognizer':
+        drawings = [file for file in glob.glob(os.path.join(args.drawings, '*.png'))
+                    if load_textract_blocks(file) is not None]
+        if args.source != 'synthetic' and not drawings:
+            raise SystemExit(f'No png drawings with saved Textract responses in {args.drawings!r}, '
+                             f'needed for --source {args.source}')
+        recognizer = train_recognizer(source=args.source, drawings=drawings, batch_size=args.batch_size or 32,
+                                      epochs=args.epochs, steps_per_epoch=args.steps,
+                                      freeze_backbone=not args.train_backbone)
+        show_sample(recognizer=recognizer)
+    else:
+        pages = dict(PAGES, train=args.train_pages, val=args.val_pages)
+        shards = build_shards(pages, shard_size=args.shard_size, workers=args.workers, regenerate=args.regenerate)
+        if not args.shards_only:
+            detector = train_detector(shards, pages=pages, batch_size=args.batch_size or 4, epochs=args.epochs)
+            show_sample(detector=detector)
+    print('Fin.')
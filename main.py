@@ -1,24 +1,290 @@
-from Keras_OCR import process_single_file as Keras_OCR
-from Textract_OCR import process_single_file as Textract_OCR
-from Tesseract_OCR import process_single_file as Tesseract_OCR
+from OCR_Files import get_files_from_folder, POPPLER_PATH
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import subprocess
+import importlib
+import argparse
+import hashlib
+import glob
+import json
+import sys
 import os
+import time
 
-def ocr_comparison(file):
+# engine registry: name -> (module, display name, function that loads the engine's models)
+# modules are only imported when their engine is selected, so a Tesseract-only
+# run never loads TensorFlow
+ENGINES = {
+    'keras': ('Keras_OCR', 'Keras', 'get_pipeline'),
+    'textract': ('Textract_OCR', 'Textract', 'get_textract_client'),
+    'tesseract': ('Tesseract_OCR', 'Tesseract', 'load_tesseract'),
+}
+DEFAULT_ENGINES = ['keras', 'textract', 'tesseract']
+# engines that run TensorFlow get a worker of their own
+TF_ENGINES = {'keras'}
+# seconds allowed for importing main and the selected engines, see check_import_time
+IMPORT_TIME_BUDGET = 1.0
+
+# engines used by a batch worker process, set by init_worker
+worker_engines = {}
+
+
+def get_engine(name):
+    """Import an engine and get its process_single_file function
+    :param name: engine name, one of ENGINES
+    :return: process_single_file function"""
+    module_name, _, _ = ENGINES[name]
+    return importlib.import_module(module_name).process_single_file
+
+def load_engine(name):
+    """Import an engine and load its models
+    :param name: engine name, one of ENGINES
+    :return: process_single_file function"""
+    module_name, _, loader = ENGINES[name]
+    engine = get_engine(name)
+    getattr(importlib.import_module(module_name), loader)()
+    return engine
+
+def run_timed(engine, file, image, render=True):
+    """Run an engine and time it
+    :param engine: engine process_single_file function
+    :param file: image file
+    :param image: decoded image shared between the engines
+    :param render: whether the engine draws and saves its annotated image
+    :return: engine result and wall time in seconds"""
+    start = time.perf_counter()
+    result = engine(file, image=image, render=render)
+    return result, time.perf_counter() - start
+
+def ocr_comparison(file, engines=DEFAULT_ENGINES, render=True):
+    """Run the OCR engines on the same file at the same time
+    The image is decoded once and shared read-only between the engines.
+    Tesseract subprocesses and Textract requests run in a thread pool,
+    while TensorFlow gets a worker of its own.
+    :param file: png file
+    :param engines: list of engine names
+    :param render: whether the engines draw and save their annotated images
+    :return: dictionary of engine results and dictionary of engine wall times
+    When Textract runs, the other engines are scored against it and the
+    summary is written to Results/<name>_comparison.csv"""
+    import cv2
+    from OCR_Comparison import compare_engines, print_summary, write_summary
     if os.path.splitext(file)[1] != '.png':
         raise Exception('File must be a png file. File provided: ' + file)
     print('OCR Comparison')
     print('File: ' + file)
-    print('Running Keras OCR on ' + file)
-    keras_data, keras_image = Keras_OCR(file)
-    print('Running Textract OCR on ' + file)
-    textract_data, textract_image = Textract_OCR(file)
-    print('Running Tesseract OCR on ' + file)
-    tesseract_data, tesseract_image = Tesseract_OCR(file)
-    print('OCR Comparison Complete')
+    start = time.perf_counter()
+    image = cv2.imread(file)
+    image.flags.writeable = False
 
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='tensorflow') as tf_pool, \
+            ThreadPoolExecutor(max_workers=2, thread_name_prefix='io') as io_pool:
+        futures = {}
+        for name in engines:
+            display_name = ENGINES[name][1]
+            print(f'Running {display_name} OCR on ' + file)
+            pool = tf_pool if name in TF_ENGINES else io_pool
+            futures[display_name] = pool.submit(run_timed, get_engine(name), file, image, render)
 
-if __name__ == '__main__':
-    file = r'Data/MAPG-L-0010-040-D-AB00 - 000 - Z17.png'
-    ocr_comparison(file)
+        results, timings = {}, {}
+        for name, future in futures.items():
+            results[name], timings[name] = future.result()
+
+    for name, elapsed in timings.items():
+        print(f'{name}: {elapsed:.2f}s')
+    if 'Textract' in results and len(results) > 1:
+        summary = compare_engines({name: result for name, (result, _) in results.items()}, reference='Textract')
+        print_summary(summary)
+        fname = os.path.splitext(os.path.basename(file))[0]
+        write_summary(summary, os.path.join('Results', fname + '_comparison.csv'))
+    print(f'OCR Comparison Complete in {time.perf_counter() - start:.2f}s')
+    return results, timings
+
+def expand_inputs(inputs):
+    """Expand folders and glob patterns into a list of pdf and png files
+    :param inputs: list of files, folders or glob patterns
+    :return: sorted list of files"""
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            files.update(get_files_from_folder(item, extensions=('.pdf', '.png')))
+        else:
+            files.update(f for f in glob.glob(item) if f.lower().endswith(('.pdf', '.png')))
+    return sorted(files)
+
+def get_page_tasks(files):
+    """Split files into one task per page
+    :param files: list of pdf and png files
+    :return: list of (file, page) tasks, page is None for png files"""
+    tasks = []
+    for file in files:
+        if file.lower().endswith('.pdf'):
+            import pdf2image
+            n_pages = pdf2image.pdfinfo_from_path(file, poppler_path=POPPLER_PATH)['Pages']
+            tasks.extend((file, page) for page in range(n_pages))
+        else:
+            tasks.append((file, None))
+    return tasks
 
+def get_task_id(file, page):
+    """Get the id of a task used in the manifest and output names
+    The id carries a short hash of the file's absolute path, so drawings with the
+    same name in different folders don't overwrite each other's results, and a
+    resumed batch gets the same ids whichever directory it is run from.
+    :param file: pdf or png file
+    :param page: page number or None
+    :return: task id"""
+    name = os.path.splitext(os.path.basename(file))[0]
+    path = os.path.normcase(os.path.realpath(file))
+    name = f'{name}_{hashlib.sha1(path.encode()).hexdigest()[:8]}'
+    return name if page is None else f'{name}_{page}'
 
+def load_manifest(manifest):
+    """Load the ids of the finished tasks from a manifest
+    :param manifest: manifest file, one JSON record per line
+    :return: set of finished task ids"""
+    done = set()
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted run
+                    continue
+                if record.get('status') == 'done':
+                    done.add(record['id'])
+    return done
+
+def init_worker(engines, render_format=None, preview_scale=None):
+    """Load the selected engines once when a worker process starts
+    :param engines: list of engine names
+    :param render_format: image format for annotated pages, see OCR_Render
+    :param preview_scale: scale annotated pages are written at"""
+    import OCR_Render
+    if render_format is not None:
+        OCR_Render.RENDER_FORMAT = render_format
+    if preview_scale is not None:
+        OCR_Render.PREVIEW_SCALE = preview_scale
+    worker_engines.update({name: load_engine(name) for name in engines})
+
+def process_page(task):
+    """Run the selected engines on a single page, in a worker process
+    :param task: (file, page, output folder, dpi, render) tuple
+    :return: manifest record"""
+    import cv2
+    import numpy as np
+    file, page, output_folder, dpi, render = task
+    task_id = get_task_id(file, page)
+    start = time.perf_counter()
+    try:
+        if page is None:
+            image_file = file
+            image = cv2.imread(image_file)
+        else:
+            import pdf2image
+            # render just this page straight into memory, the file name is only used to name outputs
+            page_image = pdf2image.convert_from_path(file, dpi, first_page=page + 1, last_page=page + 1,
+                                                     poppler_path=POPPLER_PATH)[0]
+            image_file = os.path.join(output_folder, task_id + '.png')
+            image = cv2.cvtColor(np.asarray(page_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            del page_image
+        image.flags.writeable = False
+        for name, engine in worker_engines.items():
+            result, _ = engine(image_file, image=image, render=render)
+            result.save_npz(os.path.join(output_folder, f'{task_id}_{name}.npz'))
+        status, error = 'done', None
+    except Exception as e:
+        status, error = 'failed', repr(e)
+    return {'id': task_id, 'file': file, 'page': page, 'status': status, 'error': error,
+            'engines': list(worker_engines), 'seconds': round(time.perf_counter() - start, 3)}
+
+def run_batch(inputs, engines=DEFAULT_ENGINES, output_folder=os.path.join('Results', 'batch'),
+              workers=None, dpi=200, render=False, render_format=None, preview_scale=None):
+    """Run the selected engines over a corpus of drawings with a process pool
+    Pages are sharded across the workers, results are written as each page finishes
+    and a manifest lets an interrupted run resume where it stopped.
+    :param inputs: list of files, folders or glob patterns
+    :param engines: list of engine names
+    :param output_folder: folder for the results and the manifest
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param dpi: resolution pdf pages are rendered at
+    :param render: whether to draw and save annotated pages, off by default for batch runs
+    :param render_format: image format for annotated pages, see OCR_Render
+    :param preview_scale: scale annotated pages are written at
+    :return: number of pages processed in this run"""
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = os.path.join(output_folder, 'manifest.jsonl')
+    done = load_manifest(manifest)
+    tasks = [(file, page, output_folder, dpi, render) for file, page in get_page_tasks(expand_inputs(inputs))
+             if get_task_id(file, page) not in done]
+    print(f'{len(done)} pages already done, {len(tasks)} pages to process')
+    if not tasks:
+        return 0
+
+    start = time.perf_counter()
+    # spawn so each worker loads its own copy of the models instead of a forked TensorFlow
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=workers, initializer=init_worker, initargs=(list(engines), render_format, preview_scale)) as pool, \
+            open(manifest, 'a') as f:
+        for i, record in enumerate(pool.imap_unordered(process_page, tasks), 1):
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            print(f'[{i}/{len(tasks)}] {record["id"]}: {record["status"]} ({record["seconds"]}s)')
+    elapsed = time.perf_counter() - start
+    print(f'Processed {len(tasks)} pages in {elapsed:.1f}s ({len(tasks) / elapsed:.2f} pages/sec)')
+    return len(tasks)
+
+def measure_import_time(engines):
+    """Measure how long importing main and the selected engines takes in a fresh interpreter
+    :param engines: list of engine names
+    :return: import time in seconds"""
+    code = ('import time; start = time.perf_counter(); import main; '
+            f'[main.get_engine(name) for name in {list(engines)!r}]; print(time.perf_counter() - start)')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(out.stdout.strip().splitlines()[-1])
+
+def check_import_time(engines, budget=IMPORT_TIME_BUDGET):
+    """Check the cold start of the selected engines is within the import time budget
+    :param engines: list of engine names
+    :param budget: allowed import time in seconds
+    :return: True if the import time is within budget"""
+    elapsed = measure_import_time(engines)
+    ok = elapsed <= budget
+    print(f'Import time for {", ".join(engines)}: {elapsed:.3f}s (budget {budget:.3f}s) {"OK" if ok else "OVER BUDGET"}')
+    return ok
+
+def parse_args(argv=None):
+    import OCR_Render
+    parser = argparse.ArgumentParser(description='Run the OCR engines on a drawing or a corpus of drawings')
+    parser.add_argument('inputs', nargs='*', help='png files, pdf files, folders or glob patterns')
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=DEFAULT_ENGINES)
+    parser.add_argument('--output', default=os.path.join('Results', 'batch'), help='folder for batch results')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--dpi', type=int, default=200, help='resolution pdf pages are rendered at')
+    parser.add_argument('--render', action='store_true', help='save annotated pages in batch mode')
+    parser.add_argument('--no-render', action='store_true', help='do not save annotated images for a single file')
+    parser.add_argument('--format', choices=sorted(OCR_Render.ENCODERS), default=None,
+                        help='image format for annotated pages')
+    parser.add_argument('--preview-scale', type=float, default=None, help='scale annotated pages are written at')
+    parser.add_argument('--check-import-time', action='store_true',
+                        help=f'exit with an error if importing the engines takes over {IMPORT_TIME_BUDGET}s')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.check_import_time:
+        sys.exit(0 if check_import_time(args.engines) else 1)
+    if args.inputs:
+        run_batch(args.inputs, engines=args.engines, output_folder=args.output, workers=args.workers, dpi=args.dpi,
+                  render=args.render, render_format=args.format, preview_scale=args.preview_scale)
+    else:
+        import OCR_Render
+        file = r'Data/MAPG-L-0010-040-D-AB00 - 000 - Z17.png'
+        if args.format is not None:
+            OCR_Render.RENDER_FORMAT = args.format
+        if args.preview_scale is not None:
+            OCR_Render.PREVIEW_SCALE = args.preview_scale
+        ocr_comparison(file, engines=args.engines, render=not args.no_render)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules live in the repository root, next to the data folders they use
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
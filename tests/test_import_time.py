@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import pytest
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules that must only be imported once an engine that needs them is selected
+HEAVY_MODULES = ['cv2', 'numpy', 'pdf2image', 'tensorflow', 'keras_ocr', 'boto3', 'pytesseract',
+                 'Keras_OCR', 'Textract_OCR', 'Tesseract_OCR', 'OCR_Render', 'OCR_Comparison']
+# modules each engine needs to import, the engine's test is skipped without them
+ENGINE_DEPENDENCIES = {
+    'keras': ['cv2', 'pdf2image'],
+    'textract': ['cv2'],
+    'tesseract': ['cv2', 'pytesseract'],
+}
+
+
+def run_python(code, *flags):
+    return subprocess.run([sys.executable, *flags, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT)
+
+
+def get_cumulative_import_time(stderr, module):
+    """Cumulative seconds of a top level import from python -X importtime output"""
+    for line in stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1e6
+    raise AssertionError(f'{module} not found in the import time output')
+
+
+def test_import_main_within_budget():
+    out = run_python('import main', '-X', 'importtime')
+    elapsed = get_cumulative_import_time(out.stderr, 'main')
+    assert elapsed <= main.IMPORT_TIME_BUDGET, f'import main took {elapsed:.3f}s, budget {main.IMPORT_TIME_BUDGET}s'
+
+
+def test_import_main_loads_no_engine():
+    out = run_python(f'import sys, main; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    assert out.stdout.strip() == ''
+
+
+@pytest.mark.parametrize('engine', sorted(main.ENGINES))
+def test_engine_import_within_budget(engine):
+    for module in ENGINE_DEPENDENCIES[engine]:
+        pytest.importorskip(module)
+    elapsed = main.measure_import_time([engine])
+    assert elapsed <= main.IMPORT_TIME_BUDGET, f'importing {engine} took {elapsed:.3f}s, budget {main.IMPORT_TIME_BUDGET}s'
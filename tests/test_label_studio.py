@@ -0,0 +1,101 @@
+import hashlib
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('boto3')
+pytest.importorskip('requests')
+pytest.importorskip('label_studio_sdk')
+
+from botocore.exceptions import ClientError
+import Textract_Label_Studio
+from Textract_Label_Studio import is_uploaded, upload_bytes, import_tasks
+
+DATA = b'png bytes'
+SHA256 = hashlib.sha256(DATA).hexdigest()
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class StubS3:
+    """S3 client holding a single object's head, or nothing"""
+
+    def __init__(self, head=None):
+        self.head = head
+        self.uploads = []
+
+    def head_object(self, Bucket, Key):
+        if self.head is None:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return self.head
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.uploads.append((fileobj.read(), bucket, key, ExtraArgs))
+
+
+class StubProject:
+    """Label Studio project whose import endpoint returns the ids of the new tasks, like the SDK"""
+
+    def __init__(self, first_id=100):
+        self.next_id = first_id
+        self.imports = []
+
+    def import_tasks(self, tasks):
+        self.imports.append(list(tasks))
+        task_ids = list(range(self.next_id, self.next_id + len(tasks)))
+        self.next_id += len(tasks)
+        return task_ids
+
+
+@pytest.fixture
+def no_presigning(monkeypatch):
+    monkeypatch.setattr(Textract_Label_Studio, 'get_presigned_url', lambda bucket, key: f'{bucket}/{key}')
+
+
+def test_is_uploaded_matches_sha256_metadata():
+    assert is_uploaded(StubS3({'Metadata': {'sha256': SHA256}, 'ETag': '"multipart-1"'}), 'b', 'k', DATA, SHA256)
+
+
+def test_is_uploaded_matches_single_part_etag():
+    assert is_uploaded(StubS3({'ETag': f'"{MD5}"'}), 'b', 'k', DATA, SHA256)
+
+
+def test_is_uploaded_rejects_changed_content():
+    assert not is_uploaded(StubS3({'Metadata': {'sha256': '0' * 64}, 'ETag': '"0"'}), 'b', 'k', DATA, SHA256)
+
+
+def test_is_uploaded_missing_object():
+    assert not is_uploaded(StubS3(), 'b', 'k', DATA, SHA256)
+
+
+def test_upload_bytes_skips_matching_object(no_presigning):
+    s3 = StubS3({'ETag': f'"{MD5}"'})
+    url, uploaded = upload_bytes(DATA, 'bucket', 'key', s3_cli=s3)
+    assert url == 'bucket/key'
+    assert not uploaded
+    assert s3.uploads == []
+
+
+def test_upload_bytes_uploads_with_hash(no_presigning):
+    s3 = StubS3()
+    _, uploaded = upload_bytes(DATA, 'bucket', 'key', s3_cli=s3)
+    assert uploaded
+    data, bucket, key, extra_args = s3.uploads[0]
+    assert (data, bucket, key) == (DATA, 'bucket', 'key')
+    assert extra_args['Metadata'] == {'sha256': SHA256}
+
+
+
+def test_import_tasks_in_chunks():
+    project = StubProject()
+    tasks = ({'data': {'ocr': f'drawing_{i}.png'}} for i in range(5))
+    task_ids = import_tasks(project, tasks, chunk_size=2)
+    assert [len(chunk) for chunk in project.imports] == [2, 2, 1]
+    assert [task['data']['ocr'] for chunk in project.imports for task in chunk] == \
+           [f'drawing_{i}.png' for i in range(5)]
+    # one id per task, in the order of the tasks, across the chunks
+    assert task_ids == [100, 101, 102, 103, 104]
+
+
+def test_import_tasks_nothing_to_import():
+    project = StubProject()
+    assert import_tasks(project, [], chunk_size=2) == []
+    assert project.imports == []
@@ -0,0 +1,138 @@
+import os
+import json
+import sqlite3
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('boto3')
+pytest.importorskip('requests')
+pytest.importorskip('label_studio_sdk')
+
+import Label_Studio_Sync
+from Label_Studio_Sync import SyncState, sync_folder
+
+
+class StubProject:
+    """Label Studio project that records imports and PATCH requests"""
+
+    id = 1
+
+    def __init__(self):
+        self.next_id = 100
+        self.imports = []
+        self.requests = []
+
+    def import_tasks(self, tasks):
+        self.imports.append(tasks)
+        task_ids = list(range(self.next_id, self.next_id + len(tasks)))
+        self.next_id += len(tasks)
+        return task_ids
+
+    def get_task(self, task_id):
+        return {'predictions': [{'id': task_id + 1000}]}
+
+    def make_request(self, method, url, json=None):
+        self.requests.append((method, url, json))
+
+
+@pytest.fixture
+def project(monkeypatch):
+    project = StubProject()
+    label_studio = Label_Studio_Sync.label_studio
+    uploads = []
+
+    def upload_files(files, bucket, root=None):
+        uploads.extend(os.path.relpath(file, root) for file in files)
+        return {file: f'{os.path.relpath(file, root)}@{Label_Studio_Sync.file_sha256(file)[:8]}' for file in files}
+
+    def build_task(file, template, url=None):
+        # the predictions follow the saved response, so a changed response changes the results
+        with open(os.path.splitext(file)[0] + '.json') as f:
+            words = [block['Text'] for block in json.load(f)['Blocks']]
+        return {'data': {'ocr': url}, 'predictions': [{'result': words}]}
+
+    monkeypatch.setattr(label_studio, 'get_or_create_project', lambda ls, label_config, title: project)
+    monkeypatch.setattr(label_studio, 'create_label_config', lambda: None)
+    monkeypatch.setattr(label_studio, 'load_template', lambda: None)
+    monkeypatch.setattr(label_studio, 'upload_files', upload_files)
+    monkeypatch.setattr(label_studio, 'build_task', build_task)
+    project.uploads = uploads
+    return project
+
+
+def write_drawing(folder, name, image=b'png', words=('PV-101',)):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name + '.png'), 'wb') as f:
+        f.write(image)
+    with open(os.path.join(folder, name + '.json'), 'w') as f:
+        json.dump({'Blocks': [{'BlockType': 'WORD', 'Text': word} for word in words]}, f)
+
+
+def sync(folder, db):
+    return sync_folder(str(folder), ls=object(), db=str(db))
+
+
+def test_new_drawings_are_imported_with_their_own_state(tmp_path, project):
+    write_drawing(tmp_path / 'drawings', 'P-001')
+    write_drawing(tmp_path / 'drawings' / 'site_b', 'P-001', image=b'other png')
+    db = tmp_path / 'sync.sqlite'
+    counts = sync(tmp_path / 'drawings', db)
+    assert counts == {'imported': 2, 'patched': 0, 'unchanged': 0}
+    assert sorted(project.uploads) == ['P-001.png', os.path.join('site_b', 'P-001.png')]
+    state = SyncState(str(db))
+    first, second = state.get(1, 'P-001.png'), state.get(1, 'site_b/P-001.png')
+    state.close()
+    assert {first['task_id'], second['task_id']} == {100, 101}
+    assert first['file_hash'] != second['file_hash']
+
+
+def test_unchanged_drawings_are_skipped(tmp_path, project):
+    write_drawing(tmp_path / 'drawings', 'P-001')
+    db = tmp_path / 'sync.sqlite'
+    sync(tmp_path / 'drawings', db)
+    project.uploads.clear()
+    counts = sync(tmp_path / 'drawings', db)
+    assert counts == {'imported': 0, 'patched': 0, 'unchanged': 1}
+    assert len(project.imports) == 1
+    assert project.uploads == []
+    assert project.requests == []
+
+
+def test_changed_response_patches_the_prediction(tmp_path, project):
+    write_drawing(tmp_path / 'drawings', 'P-001')
+    db = tmp_path / 'sync.sqlite'
+    sync(tmp_path / 'drawings', db)
+    project.uploads.clear()
+    write_drawing(tmp_path / 'drawings', 'P-001', words=('PV-101', 'FV-202'))
+    counts = sync(tmp_path / 'drawings', db)
+    assert counts == {'imported': 0, 'patched': 1, 'unchanged': 0}
+    # the image is the same, so it is not uploaded again
+    assert project.uploads == []
+    assert project.requests == [('PATCH', '/api/predictions/1100', {'result': ['PV-101', 'FV-202']})]
+
+
+def test_changed_image_patches_the_task(tmp_path, project):
+    write_drawing(tmp_path / 'drawings', 'P-001')
+    db = tmp_path / 'sync.sqlite'
+    sync(tmp_path / 'drawings', db)
+    project.uploads.clear()
+    write_drawing(tmp_path / 'drawings', 'P-001', image=b'new png')
+    counts = sync(tmp_path / 'drawings', db)
+    assert counts == {'imported': 0, 'patched': 0, 'unchanged': 1}
+    assert project.uploads == ['P-001.png']
+    [(method, url, body)] = project.requests
+    assert (method, url) == ('PATCH', '/api/tasks/100')
+    assert body['data']['ocr'].startswith('P-001.png@')
+
+
+def test_state_written_before_the_column_rename_is_kept(tmp_path, project):
+    write_drawing(tmp_path / 'drawings', 'P-001')
+    db = tmp_path / 'sync.sqlite'
+    sync(tmp_path / 'drawings', db)
+    # rename the column back, as a database from before the rename has it
+    connection = sqlite3.connect(str(db))
+    connection.execute('ALTER TABLE drawings RENAME COLUMN file_hash TO image_hash')
+    connection.commit()
+    connection.close()
+    counts = sync(tmp_path / 'drawings', db)
+    assert counts == {'imported': 0, 'patched': 0, 'unchanged': 1}
@@ -0,0 +1,19 @@
+import os
+import main
+
+
+def test_task_id_separates_folders(tmp_path):
+    first = main.get_task_id(str(tmp_path / 'site_a' / 'P-001.pdf'), 0)
+    second = main.get_task_id(str(tmp_path / 'site_b' / 'P-001.pdf'), 0)
+    assert first != second
+    assert first.startswith('P-001_') and first.endswith('_0')
+    assert main.get_task_id(str(tmp_path / 'P-001.png'), None).count('_') == 1
+
+
+def test_task_id_does_not_depend_on_the_working_directory(tmp_path, monkeypatch):
+    (tmp_path / 'drawings').mkdir()
+    monkeypatch.chdir(tmp_path)
+    relative = main.get_task_id(os.path.join('drawings', 'P-001.pdf'), 2)
+    monkeypatch.chdir(tmp_path / 'drawings')
+    assert main.get_task_id('P-001.pdf', 2) == relative
+    assert main.get_task_id(str(tmp_path / 'drawings' / 'P-001.pdf'), 2) == relative
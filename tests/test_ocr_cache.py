@@ -0,0 +1,83 @@
+import os
+import threading
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from OCR_Cache import OCRCache
+from OCR_Result import OCRResult
+
+
+def make_result(n):
+    coords = np.arange(n, dtype=np.int32)
+    return OCRResult.from_columns([f'PV-{i}' for i in range(n)], coords, coords, coords + 10, coords + 10,
+                                  engine='tesseract')
+
+
+def entry_sizes(cache):
+    return sum(size for _, size, _ in cache._entries())
+
+
+def test_put_and_get(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    key = cache.make_key('a' * 64, 'tesseract', '5.3')
+    cache.put(key, make_result(3))
+    assert cache.get(key).text == make_result(3).text
+    assert cache.get(cache.make_key('b' * 64, 'tesseract', '5.3')) is None
+
+
+def test_overwriting_an_entry_counts_it_once(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    key = cache.make_key('a' * 64, 'tesseract', '5.3')
+    cache.put(cache.make_key('b' * 64, 'tesseract', '5.3'), make_result(2))
+    for n in (5, 50, 5):
+        cache.put(key, make_result(n))
+    assert cache._size == entry_sizes(cache)
+
+
+def test_concurrent_puts_keep_the_size_exact(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    keys = [cache.make_key(str(i) * 64, 'keras', '0.9') for i in range(4)]
+
+    def put_all(n):
+        for key in keys:
+            cache.put(key, make_result(n))
+
+    threads = [threading.Thread(target=put_all, args=(n,)) for n in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache._size == entry_sizes(cache)
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith('.tmp')]
+
+
+def test_eviction_keeps_the_cache_under_its_limit(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    cache.put(cache.make_key('0' * 64, 'keras', '0.9'), make_result(20))
+    cache.max_bytes = int(entry_sizes(cache) * 2.5)
+    for i in range(1, 6):
+        cache.put(cache.make_key(str(i) * 64, 'keras', '0.9'), make_result(20))
+    assert entry_sizes(cache) <= cache.max_bytes
+    assert cache._size == entry_sizes(cache)
+
+
+def test_unwritable_cache_is_skipped(tmp_path, capsys):
+    # a file where the cache directory should be
+    blocked = tmp_path / 'cache'
+    blocked.write_bytes(b'')
+    cache = OCRCache(str(blocked))
+    key = cache.make_key('a' * 64, 'tesseract', '5.3')
+    cache.put(key, make_result(3))
+    assert cache.get(key) is None
+    assert 'Skipped caching' in capsys.readouterr().out
+
+
+def test_old_format_entries_are_swept(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    (tmp_path / 'ab').mkdir()
+    (tmp_path / 'ab' / ('a' * 64 + '.json.gz')).write_bytes(b'old entry')
+    cache.put(cache.make_key('a' * 64, 'tesseract', '5.3'), make_result(3))
+    cache.evict()
+    assert [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith('.json.gz')] == []
+    assert cache._size == entry_sizes(cache)
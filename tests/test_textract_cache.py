@@ -0,0 +1,49 @@
+import os
+import json
+import shutil
+import pytest
+
+pytest.importorskip('numpy')
+
+from Textract_Cache import TextractBlocks, load_textract_blocks
+DATA_RESPONSE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data',
+                             'MAPG-L-0010-040-D-AB00 - 000 - Z17.json')
+RESPONSE = {'Blocks': [{'BlockType': 'WORD', 'Id': '069dbcb0-90ce-4502-8064-f642d53abf91', 'Text': 'PV-101',
+                        'Confidence': 99.0, 'Geometry': {'BoundingBox': {'Width': 0.1, 'Height': 0.05,
+                                                                         'Left': 0.2, 'Top': 0.3}}}]}
+
+
+def save_json(path, response):
+    with open(path, 'w') as f:
+        json.dump(response, f)
+
+
+def test_stamped_response_is_only_reused_for_the_same_image(tmp_path):
+    save_json(tmp_path / 'drawing.json', dict(RESPONSE, ImageHash='a' * 64))
+    image = str(tmp_path / 'drawing.png')
+    assert load_textract_blocks(image, image_hash='a' * 64).image_hash == 'a' * 64
+    # the .tbc written by the first load keeps the hash
+    assert load_textract_blocks(image, image_hash='b' * 64) is None
+    assert load_textract_blocks(image) is not None
+
+
+def test_unstamped_response_is_reused_with_a_warning(tmp_path, capsys):
+    save_json(tmp_path / 'drawing.json', RESPONSE)
+    blocks = load_textract_blocks(str(tmp_path / 'drawing.png'), image_hash='a' * 64)
+    assert blocks is not None
+    assert blocks.image_hash is None
+    assert '--stamp-images' in capsys.readouterr().out
+
+
+def test_bundled_response_loads_for_the_offline_demo(tmp_path):
+    shutil.copy(DATA_RESPONSE, tmp_path)
+    image = str(tmp_path / os.path.basename(DATA_RESPONSE).replace('.json', '.png'))
+    blocks = load_textract_blocks(image, image_hash='a' * 64)
+    assert blocks is not None
+    assert blocks.mask('WORD').any()
+
+
+def test_hash_round_trips_through_the_response():
+    blocks = TextractBlocks.from_response(RESPONSE, image_hash='c' * 64)
+    assert blocks.to_response()['ImageHash'] == 'c' * 64
+    assert TextractBlocks.from_response(blocks.to_response()).image_hash == 'c' * 64
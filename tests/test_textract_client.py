@@ -0,0 +1,118 @@
+import pytest
+import Textract_Client
+from Textract_Client import TokenBucket, call_with_backoff, get_error_code, RETRYABLE_ERRORS
+
+
+class FakeClock:
+    """Clock that only moves when the code under test sleeps"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class AWSError(Exception):
+    """Stand-in for botocore's ClientError, which carries the error code in its response"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FlakyCall:
+    """Raises the given errors in turn, then returns a response"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        if self.errors:
+            raise AWSError(self.errors.pop(0))
+        return {'Blocks': []}
+
+
+def test_token_bucket_allows_a_burst_then_holds_the_rate():
+    clock = FakeClock()
+    # powers of two keep the fake clock's arithmetic exact
+    bucket = TokenBucket(rate=4, capacity=4, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == 0.0
+    for _ in range(8):
+        bucket.acquire()
+    # 8 tokens beyond the burst at 4 per second
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_token_bucket_refills_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire(2)
+    clock.now += 60
+    bucket.acquire(2)
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_get_error_code():
+    assert get_error_code(AWSError('ThrottlingException')) == 'ThrottlingException'
+    assert get_error_code(ValueError('no response')) is None
+
+
+def test_backoff_retries_throttled_calls(monkeypatch):
+    monkeypatch.setattr(Textract_Client.random, 'uniform', lambda low, high: high)
+    clock = FakeClock()
+    func = FlakyCall('ThrottlingException', 'ProvisionedThroughputExceededException')
+    response = call_with_backoff(func, Document={'Bytes': b'png'}, base=0.5, cap=20, sleep=clock.sleep)
+    assert response == {'Blocks': []}
+    assert len(func.calls) == 3
+    assert func.calls[0][1] == {'Document': {'Bytes': b'png'}}
+    # exponential backoff, the jitter is drawn up to base * 2 ** attempt
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(Textract_Client.random, 'uniform', lambda low, high: high)
+    clock = FakeClock()
+    func = FlakyCall(*['ThrottlingException'] * 5)
+    call_with_backoff(func, base=1, cap=4, max_retries=5, sleep=clock.sleep)
+    assert clock.sleeps == [1, 2, 4, 4, 4]
+
+
+def test_backoff_gives_up_after_max_retries():
+    clock = FakeClock()
+    func = FlakyCall(*['ThrottlingException'] * 4)
+    with pytest.raises(AWSError):
+        call_with_backoff(func, max_retries=3, sleep=clock.sleep)
+    assert len(func.calls) == 4
+    assert len(clock.sleeps) == 3
+
+
+def test_backoff_does_not_retry_other_errors():
+    assert 'InvalidParameterException' not in RETRYABLE_ERRORS
+    clock = FakeClock()
+    func = FlakyCall('InvalidParameterException')
+    with pytest.raises(AWSError):
+        call_with_backoff(func, sleep=clock.sleep)
+    assert len(func.calls) == 1
+    assert clock.sleeps == []
+
+
+def test_backoff_takes_a_token_every_attempt():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, capacity=1, clock=clock, sleep=clock.sleep)
+    func = FlakyCall('ThrottlingException')
+    call_with_backoff(func, rate_limiter=bucket, base=0, sleep=clock.sleep)
+    # the retry waited a full second for its token
+    assert len(func.calls) == 2
+    assert clock.now == pytest.approx(1.0)
@@ -0,0 +1,163 @@
+import uuid
+import threading
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+pytest.importorskip('boto3')
+
+import Textract_Client
+import Textract_OCR
+from OCR_Cache import hash_image
+from Textract_Cache import load_textract_blocks
+
+
+class AWSError(Exception):
+    """Stand-in for botocore's ClientError, which carries the error code in its response"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class StubTextract:
+    """Textract client that throttles chosen documents and pages job results over NextToken"""
+
+    def __init__(self, throttle=None, fail=None, job_pages=None, job_statuses=None):
+        self.throttle = dict(throttle or {})
+        self.fail = set(fail or ())
+        self.job_pages = job_pages or []
+        self.job_statuses = list(job_statuses or [])
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def detect_document_text(self, Document):
+        data = Document['Bytes']
+        with self.lock:
+            self.calls.append(data)
+            if self.throttle.get(data):
+                self.throttle[data] -= 1
+                raise AWSError('ThrottlingException')
+        if data in self.fail:
+            raise AWSError('InvalidParameterException')
+        return {'Blocks': [{'BlockType': 'PAGE', 'Id': data.hex()[:8]}]}
+
+    def start_document_text_detection(self, DocumentLocation, NotificationChannel=None):
+        return {'JobId': 'job'}
+
+    def get_document_text_detection(self, JobId, NextToken=None):
+        self.calls.append(NextToken)
+        if self.job_statuses:
+            return {'JobStatus': self.job_statuses.pop(0), 'Blocks': []}
+        index = int(NextToken) if NextToken else 0
+        response = {'JobStatus': 'SUCCEEDED', 'Blocks': self.job_pages[index]}
+        if index + 1 < len(self.job_pages):
+            response['NextToken'] = str(index + 1)
+        return response
+
+
+class StubS3:
+    """S3 client that records uploads"""
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload_file(self, file, bucket, key):
+        self.uploads.append((file, bucket, key))
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(Textract_Client.random, 'uniform', lambda low, high: 0)
+    monkeypatch.setattr(Textract_OCR.time, 'sleep', lambda seconds: None)
+
+
+def write_image(path, value):
+    image = np.full((8, 8, 3), value, dtype=np.uint8)
+    cv2.imwrite(str(path), image)
+    return str(path), cv2.imread(str(path))
+
+
+def test_detect_documents_text_retries_throttled_files(tmp_path):
+    throttled, throttled_image = write_image(tmp_path / 'a.png', 10)
+    other, _ = write_image(tmp_path / 'b.png', 200)
+    with open(throttled, 'rb') as f:
+        client = StubTextract(throttle={f.read(): 2})
+    results, errors = Textract_OCR.detect_documents_text([throttled, other], concurrency=2, tps=1000,
+                                                         client=client, max_retries=3)
+    assert errors == {}
+    assert set(results) == {throttled, other}
+    assert len(client.calls) == 4
+    # the saved response is only reused for the image it was made from
+    assert load_textract_blocks(throttled, image_hash=hash_image(throttled_image)) is not None
+    assert load_textract_blocks(throttled, image_hash='0' * 16) is None
+
+
+def test_detect_documents_text_collects_errors(tmp_path):
+    good, _ = write_image(tmp_path / 'good.png', 10)
+    bad, _ = write_image(tmp_path / 'bad.png', 200)
+    with open(bad, 'rb') as f:
+        bad_bytes = f.read()
+    client = StubTextract(throttle={bad_bytes: 5}, fail={bad_bytes})
+    results, errors = Textract_OCR.detect_documents_text([good, bad], concurrency=2, tps=1000,
+                                                         client=client, max_retries=2)
+    assert set(results) == {good}
+    assert set(errors) == {bad}
+    assert errors[bad].response['Error']['Code'] == 'ThrottlingException'
+
+
+def test_iter_job_pages_follows_next_token():
+    pages = [
+        [{'Id': '1', 'Page': 1}, {'Id': '2', 'Page': 1}],
+        [{'Id': '3', 'Page': 1}, {'Id': '4', 'Page': 2}],
+        [{'Id': '5', 'Page': 3}],
+    ]
+    client = StubTextract(job_pages=pages)
+    result = [(page, [block['Id'] for block in blocks])
+              for page, blocks in Textract_OCR.iter_job_pages('job', client=client)]
+    assert result == [(1, ['1', '2', '3']), (2, ['4']), (3, ['5'])]
+    assert client.calls == [None, '1', '2']
+
+
+def test_iter_job_pages_starts_from_the_first_response():
+    client = StubTextract(job_pages=[[{'Id': '1', 'Page': 1}], [{'Id': '2', 'Page': 2}]])
+    first = client.get_document_text_detection(JobId='job')
+    pages = list(Textract_OCR.iter_job_pages('job', client=client, first_response=first))
+    assert [page for page, _ in pages] == [1, 2]
+    assert client.calls == [None, '1']
+
+
+def test_wait_for_job_polls_until_done():
+    client = StubTextract(job_statuses=['IN_PROGRESS', 'IN_PROGRESS', 'SUCCEEDED'])
+    response = Textract_OCR.wait_for_job('job', client=client)
+    assert response['JobStatus'] == 'SUCCEEDED'
+    assert len(client.calls) == 3
+
+
+def test_wait_for_job_raises_on_failure():
+    client = StubTextract(job_statuses=['IN_PROGRESS', 'FAILED'])
+    with pytest.raises(RuntimeError):
+        Textract_OCR.wait_for_job('job', client=client)
+
+
+def test_detect_pdf_text_needs_a_bucket(monkeypatch):
+    monkeypatch.setattr(Textract_OCR, 'TEXTRACT_S3_BUCKET', '')
+    s3 = StubS3()
+    with pytest.raises(ValueError, match='TEXTRACT_S3_BUCKET'):
+        list(Textract_OCR.detect_pdf_text('drawing.pdf', client=StubTextract(), s3_client=s3))
+    assert s3.uploads == []
+
+
+def test_detect_pdf_text_saves_page_hashes(tmp_path, monkeypatch):
+    pages = [np.full((8, 8, 3), value, dtype=np.uint8) for value in (10, 200)]
+    monkeypatch.setattr(Textract_OCR, 'iter_pdf_pages', lambda file, dpi: enumerate(pages))
+    client = StubTextract(job_pages=[[{'BlockType': 'PAGE', 'Id': str(uuid.uuid4()), 'Page': page}]
+                                     for page in (1, 2)])
+    result = list(Textract_OCR.detect_pdf_text(str(tmp_path / 'drawing.pdf'), bucket='bucket', client=client,
+                                               s3_client=StubS3()))
+    assert [page for page, _ in result] == [0, 1]
+    for i, page in enumerate(pages):
+        # the page png is read back as BGR by process_single_file
+        image_hash = hash_image(cv2.cvtColor(page, cv2.COLOR_RGB2BGR))
+        assert load_textract_blocks(str(tmp_path / f'drawing_{i}.png'), image_hash=image_hash) is not None
+        assert load_textract_blocks(str(tmp_path / f'drawing_{i}.png'), image_hash='0' * 64) is None